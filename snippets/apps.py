@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class SnippetsConfig(AppConfig):
     name = 'snippets'
+
+    def ready(self):
+        from . import instrumentation, profiling, signals, sqlite  # noqa: F401
+        if settings.SNIPPETS_PROFILING:
+            profiling.install_signal_handler()
@@ -0,0 +1,153 @@
+"""
+Async variants of the snippet list, detail and highlight endpoints, for ASGI.
+
+Django 3.2 has no async ORM, so the database work of each view runs in a
+worker thread with its own connection (`database_sync_to_async()`), and
+Pygments renders in `highlighting.get_render_pool()`. The event loop stays free
+to serve other requests meanwhile. Responses match those of `SnippetViewSet`.
+"""
+import functools
+from types import SimpleNamespace
+
+import pygments
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import conditional, highlighting
+from .compiled import compile_serializer
+from .filters import SnippetFilter, SnippetSearchFilter
+from .models import RENDER_DONE, RENDER_LAZY, Snippet
+from .pagination import SnippetPagination
+from .serializers import SnippetHyperlinkedModelSerializer
+from .views import get_highlight_lines, get_highlight_page
+
+
+def database_sync_to_async(function):
+    """
+    Run `function` in a worker thread of its own, so that concurrent calls do not queue
+    behind each other, closing the thread's database connection as a request would.
+    """
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def require_safe(view):
+    """
+    `django.views.decorators.http.require_safe` for async views, which it does not support in Django 3.2.
+    """
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def get_context(request):
+    return {'request': Request(request), 'format': None}
+
+
+@database_sync_to_async
+def get_list_page(request):
+    context = get_context(request)
+    view = SimpleNamespace()
+    paginator = SnippetPagination()
+    compiled = compile_serializer(SnippetHyperlinkedModelSerializer(context=context))
+    queryset = SnippetFilter().filter_queryset(context['request'], Snippet.objects.all(), view)
+    queryset = SnippetSearchFilter().filter_queryset(context['request'], queryset, view)
+    view.count_queryset = queryset
+    queryset = compiled.prepare(queryset, getattr(view, 'keyset_ordering', paginator.ordering))
+    page = paginator.paginate_queryset(queryset, context['request'], view)
+    return paginator.get_paginated_response(compiled.render(page)).data
+
+
+@database_sync_to_async
+def get_snippet(request, pk):
+    # Resolve the lazy `request.user` here, where database access is allowed.
+    request.user.pk
+    try:
+        return Snippet.objects.select_related('owner').get(pk=pk)
+    except Snippet.DoesNotExist:
+        raise Http404
+
+
+@database_sync_to_async
+def serialize(request, snippet):
+    return SnippetHyperlinkedModelSerializer(snippet, context=get_context(request)).data
+
+
+@database_sync_to_async
+def get_list_version(request):
+    # Resolve the lazy `request.user` here too, for the ETag.
+    request.user.pk
+    return conditional.get_table_version(Snippet)
+
+
+@require_safe
+async def snippet_list(request):
+    latest, count = await get_list_version(request)
+    etag = conditional.make_etag(request, latest and latest.isoformat(), count)
+    # Deleting rows does not move the latest `updated`, so If-Modified-Since is not trusted here.
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            response = json_response(await get_list_page(request))
+        except APIException as exc:
+            # Invalid filters and cursors, answered as DRF's exception handler would.
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(detail, exc.status_code)
+    return conditional.set_validators(response, etag, latest)
+
+
+@require_safe
+async def snippet_detail(request, pk):
+    snippet = await get_snippet(request, pk)
+    etag = conditional.make_etag(request, snippet.pk, snippet.updated.isoformat())
+    response = get_conditional_response(request, etag=etag, last_modified=conditional.timestamp(snippet.updated))
+    if response is None:
+        response = json_response(await serialize(request, snippet))
+    return conditional.set_validators(response, etag, snippet.updated)
+
+
+@require_safe
+async def snippet_highlight(request, pk):
+    """
+    Serve the highlighted page; a Snippet still pending is rendered in the process pool
+    rather than waited for, and the stored HTML is left for the worker to write.
+    A Snippet highlighted page by page is rendered a page at a time in a worker thread,
+    as are windows of lines (`?lines=`).
+    """
+    snippet = await get_snippet(request, pk)
+    lines = await sync_to_async(get_highlight_lines, thread_sensitive=False)(request, snippet)
+    number = 1
+    if lines is None:
+        number = await sync_to_async(get_highlight_page, thread_sensitive=False)(request, snippet)
+    etag = conditional.make_etag(request, snippet.pk, snippet.updated.isoformat(), snippet.render_status,
+                                 pygments.__version__)
+    response = get_conditional_response(request, etag=etag, last_modified=conditional.timestamp(snippet.updated))
+    if response is None:
+        body = snippet.highlighted
+        if lines is not None:
+            body = await sync_to_async(snippet.render_highlighted_lines, thread_sensitive=False)(*lines)
+        elif snippet.render_status == RENDER_LAZY:
+            body = await sync_to_async(snippet.render_highlighted_page, thread_sensitive=False)(number)
+        elif snippet.render_status != RENDER_DONE:
+            body = await highlighting.render_async(*snippet.get_render_inputs())
+        page = highlighting.render_page(body, snippet.title, snippet.get_stylesheet_url())
+        response = HttpResponse(page, content_type='text/html; charset=utf-8')
+    return conditional.set_validators(response, etag, snippet.updated)
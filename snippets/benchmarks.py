@@ -0,0 +1,147 @@
+"""
+Helpers shared by the `benchmark_*` management commands.
+
+Benchmarks run against a throwaway test database, never against the
+configured one.
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from . import bulk
+from .models import Snippet
+
+SAMPLE_CODE = '''def fibonacci(n):
+    """Return the first `n` Fibonacci numbers."""
+    numbers = [0, 1]
+    while len(numbers) < n:
+        numbers.append(numbers[-1] + numbers[-2])
+    return numbers[:n]
+'''
+
+
+@contextmanager
+def benchmark_database(path=None):
+    """
+    Create a fresh test database for the duration of the block.
+
+    On SQLite the database is a file (in a temporary directory unless `path` is
+    given), so that timings include real I/O rather than an in-memory database.
+    """
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict.setdefault('TEST', {})
+            connection.settings_dict['TEST']['NAME'] = path or os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def seed(snippets, users=10, batch_size=5000, code=SAMPLE_CODE, highlighted=''):
+    """
+    Bulk insert `users` users and `snippets` snippets owned by them, bypassing `Snippet.save()`.
+    """
+    User.objects.bulk_create([User(username='benchmark-%d' % index) for index in range(users)])
+    owners = list(User.objects.filter(username__startswith='benchmark-'))
+    for start in range(0, snippets, batch_size):
+        Snippet.objects.bulk_create([
+            Snippet(owner=owners[index % len(owners)], title='Snippet %d' % index, code=code,
+                    highlighted=highlighted)
+            for index in range(start, min(start + batch_size, snippets))
+        ], batch_size=batch_size)
+
+
+# Share of snippets per language, and the lines their code is built from.
+LANGUAGE_MIX = [
+    ('python', 0.35), ('javascript', 0.2), ('java', 0.1), ('c', 0.08),
+    ('go', 0.07), ('sql', 0.07), ('bash', 0.07), ('html', 0.06),
+]
+CODE_LINES = {
+    'python': ['def handler_{n}(request, limit={n}):', '    """Sum the first items."""',
+               '    items = [item for item in range(limit) if item % 3]', '    return sum(items)  # {n}', ''],
+    'javascript': ['function handler{n}(request) {{', '  const items = [...Array({n}).keys()];',
+                   "  return items.filter((item) => item % 3).reduce((a, b) => a + b, 0); // {n}", '}}', ''],
+    'java': ['public int handler{n}(int limit) {{', '    int total = 0;',
+             '    for (int i = 0; i < limit; i++) {{ total += i % 3; }}', '    return total + {n};', '}}'],
+    'c': ['int handler_{n}(int limit) {{', '    int total = 0;',
+          '    for (int i = 0; i < limit; i++) total += i % 3;', '    return total + {n}; /* {n} */', '}}'],
+    'go': ['func handler{n}(limit int) int {{', '\ttotal := 0', '\tfor i := 0; i < limit; i++ {{ total += i % 3 }}',
+           '\treturn total + {n}', '}}'],
+    'sql': ['SELECT owner_id, count(*) AS total_{n}', 'FROM snippets_snippet',
+            "WHERE language = 'python' AND id > {n}", 'GROUP BY owner_id ORDER BY total_{n} DESC;', ''],
+    'bash': ['for file in /var/log/app-{n}/*.log; do', '  grep -c "ERROR" "$file" || true  # {n}', 'done', ''],
+    'html': ['<section id="item-{n}" class="card">', '  <h2>Item {n}</h2>',
+             '  <p>Total: <strong>{n}</strong></p>', '</section>'],
+}
+STYLE_MIX = [('friendly', 0.5), ('monokai', 0.2), ('default', 0.2), ('emacs', 0.1)]
+
+
+def choose(rng, mix):
+    return rng.choices([value for value, _ in mix], [weight for _, weight in mix])[0]
+
+
+def make_code(rng, language):
+    """
+    Return code in `language` of a realistic, long-tailed length: 25 lines at the median, rarely thousands.
+    """
+    lines = CODE_LINES[language]
+    count = min(3000, max(1, int(rng.lognormvariate(3.2, 1.0))))
+    return '\n'.join(lines[index % len(lines)].format(n=rng.randrange(10000)) for index in range(count)) + '\n'
+
+
+def seed_realistic(snippets, users=10, seed=0, password='benchmark', batch_size=1000):
+    """
+    Insert `users` users, with `password`, and `snippets` highlighted snippets of
+    mixed languages, styles and sizes owned by them, the same for the same `seed`.
+    """
+    rng = random.Random(seed)
+    encoded = make_password(password)
+    User.objects.bulk_create([User(username='loadtest-%d' % index, password=encoded) for index in range(users)])
+    owners = list(User.objects.filter(username__startswith='loadtest-').order_by('pk'))
+    for start in range(0, snippets, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, snippets)):
+            language = choose(rng, LANGUAGE_MIX)
+            batch.append(Snippet(owner=owners[index % len(owners)], title='%s snippet %d' % (language, index),
+                                 code=make_code(rng, language), language=language, style=choose(rng, STYLE_MIX),
+                                 linenos=rng.random() < 0.2))
+        bulk.render_highlights(batch)
+        Snippet.objects.bulk_create(batch, batch_size=batch_size)
+    return owners
+
+
+def measure(function, repeat=5):
+    """
+    Call `function` `repeat` times and return the timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    return 'median %9.2f ms  min %9.2f ms' % (statistics.median(timings), min(timings))
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarize_latency(timings):
+    return 'p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms' % tuple(percentile(timings, p) for p in (50, 95, 99))
@@ -0,0 +1,148 @@
+"""
+Batch writes for the `bulk` action of `SnippetViewSet`.
+
+A batch is validated in one pass, its highlights are rendered together (cache
+hits locally, misses in parallel in `highlighting.get_render_pool()`) and it is written with
+`bulk_create()` / `bulk_update()` / a single delete, in one transaction.
+"""
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import conditional, highlighting, responsecache
+from .models import Snippet
+from .search import get_search_backend
+
+PERMISSION_DENIED = 'You do not have permission to perform this action.'
+
+def render_highlights(snippets):
+    """
+    Set the highlighted HTML of every snippet in `snippets`, rendering identical inputs once.
+
+    Small batches are rendered in this process; with `SNIPPETS_HIGHLIGHT_MODE = 'async'`
+    cache misses are marked pending for the `highlight_worker` command instead.
+    Oversized snippets are left to be highlighted when viewed.
+    """
+    misses = {}
+    for snippet in snippets:
+        if highlighting.is_oversized(snippet.code):
+            snippet.set_lazy()
+            continue
+        inputs = snippet.get_render_inputs()
+        html = highlighting.get_cached(*inputs)
+        if html is None:
+            misses.setdefault(inputs, []).append(snippet)
+        snippet.set_highlighted(html)
+    if not misses or highlighting.is_async():
+        return
+
+    inputs = list(misses)
+    if len(inputs) < settings.SNIPPETS_BULK_PARALLEL_MIN:
+        results = (highlighting.render(*args) for args in inputs)
+    else:
+        workers = settings.SNIPPETS_RENDER_PROCESSES or os.cpu_count() or 1
+        chunksize = max(1, len(inputs) // (4 * workers))
+        results = highlighting.get_render_pool().map(highlighting.render, *zip(*inputs), chunksize=chunksize)
+    cache = highlighting.get_render_cache()
+    for args, html in zip(inputs, results):
+        cache.set(highlighting.render_key(*args), html)
+        for snippet in misses[args]:
+            snippet.set_highlighted(html)
+
+
+def get_items(data):
+    """
+    Check that the request body is a list of at most `SNIPPETS_BULK_MAX_ITEMS` items.
+    """
+    if not isinstance(data, list):
+        raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+    if len(data) > settings.SNIPPETS_BULK_MAX_ITEMS:
+        raise ValidationError({'non_field_errors': [
+            'Ensure this list has no more than %d items.' % settings.SNIPPETS_BULK_MAX_ITEMS]})
+    return data
+
+
+def get_instances(view, items):
+    """
+    Look up the Snippets `items` refer to by `id` (or which are ids) and check the
+    view's object permissions on each. Returns the instances and the errors of each item.
+    """
+    pks, errors = [], []
+    for item in items:
+        pk = item.get('id') if isinstance(item, dict) else item
+        try:
+            pks.append(int(pk))
+            errors.append({})
+        except (TypeError, ValueError):
+            pks.append(None)
+            errors.append({'id': ['A valid integer is required.']})
+
+    found = view.get_queryset().in_bulk([pk for pk in pks if pk is not None])
+    seen = set()
+    instances = []
+    for index, pk in enumerate(pks):
+        instance = found.get(pk)
+        instances.append(instance)
+        if pk is None:
+            continue
+        if instance is None:
+            errors[index] = {'id': ['Not found.']}
+        elif pk in seen:
+            errors[index] = {'id': ['Duplicate id.']}
+        else:
+            for permission in view.get_permissions():
+                if not permission.has_object_permission(view.request, view, instance):
+                    errors[index] = {'detail': getattr(permission, 'message', PERMISSION_DENIED)}
+                    break
+        seen.add(pk)
+    return instances, errors
+
+
+def merge_errors(errors, serializer):
+    """
+    Combine the lookup `errors` of each item with the validation errors of a list `serializer`.
+    """
+    if serializer.is_valid():
+        return errors
+    return [dict(lookup, **validation) for lookup, validation in zip(errors, serializer.errors)]
+
+
+def create(snippets):
+    with transaction.atomic():
+        Snippet.objects.bulk_create(snippets, batch_size=settings.SNIPPETS_BULK_BATCH_SIZE)
+        if snippets and snippets[0].pk is None and connection.vendor == 'sqlite':
+            # SQLite cannot return the ids of a bulk insert, but the transaction holds
+            # the database's only write lock, so the newest ids are ours, in order.
+            pks = Snippet.objects.order_by('-pk').values_list('pk', flat=True)[:len(snippets)]
+            for snippet, pk in zip(snippets, reversed(list(pks))):
+                snippet.pk = pk
+    conditional.invalidate(Snippet)
+    owners = {snippet.owner_id for snippet in snippets}
+    responsecache.invalidate('snippets', 'users', *responsecache.user_tags(*owners))
+    get_search_backend().index(snippets)
+    return snippets
+
+
+def update(snippets, fields):
+    # `bulk_update()` does not apply `auto_now`.
+    now = timezone.now()
+    for snippet in snippets:
+        snippet.updated = now
+    fields = set(fields) | {'highlighted', 'highlight_state', 'line_index', 'render_status', 'updated'}
+    with transaction.atomic():
+        Snippet.objects.bulk_update(snippets, sorted(fields), batch_size=settings.SNIPPETS_BULK_BATCH_SIZE)
+    conditional.invalidate(Snippet)
+    responsecache.invalidate('snippets', *responsecache.snippet_tags(*[snippet.pk for snippet in snippets]))
+    get_search_backend().index(snippets)
+    return snippets
+
+
+def delete(snippets):
+    pks = [snippet.pk for snippet in snippets]
+    batch_size = settings.SNIPPETS_BULK_BATCH_SIZE
+    with transaction.atomic():
+        for start in range(0, len(pks), batch_size):
+            Snippet.objects.filter(pk__in=pks[start:start + batch_size]).delete()
@@ -0,0 +1,126 @@
+"""
+Compression of stored text, for `snippets.fields.CompressedTextField`.
+
+A stored value is two header bytes, then the text: as UTF-8 with format 0,
+deflated with format 1. The second byte is the version of the preset
+dictionary it was deflated with, 0 for none. The empty string is stored empty.
+
+Highlighted HTML is mostly the same markup over and over (the formatter's
+wrappers and `<span class="...">` tags), which a preset dictionary lets zlib
+refer to from the first byte on: small snippets, the most common, shrink
+several times more with it than without. Dictionaries are trained on sample
+documents by `manage.py train_compression_dictionary`, and shipped as
+`dictionaries/<name>-<version>.zdict`. Values are written with the latest
+version; every version stays readable as long as its file is kept unchanged,
+so a dictionary is never edited: a retrained one is added as the next version.
+"""
+import collections
+import functools
+import os
+import re
+import zlib
+
+from django.conf import settings
+
+PLAIN = 0
+DEFLATE = 1
+# Shorter text is not worth compressing.
+MIN_SIZE = 64
+# zlib looks back 32 KB at most, the document included.
+DICTIONARY_SIZE = 16 * 1024
+DICTIONARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionaries')
+FRAGMENT = re.compile(r'<[^>]*>|&\w+;|\w+|\s+|[^\w\s<&]')
+
+
+class Compressed(bytes):
+    """
+    A value as stored, compressed with the preset dictionary `dictionary`.
+    """
+
+    def __new__(cls, value, dictionary=None):
+        compressed = super().__new__(cls, value)
+        compressed.dictionary = dictionary
+        return compressed
+
+    def decompress(self):
+        return decompress(self, self.dictionary)
+
+
+def get_dictionary_path(name, version):
+    return os.path.join(DICTIONARY_DIR, '%s-%d.zdict' % (name, version))
+
+
+@functools.lru_cache(maxsize=None)
+def get_dictionary(name, version):
+    with open(get_dictionary_path(name, version), 'rb') as file:
+        return file.read()
+
+
+@functools.lru_cache(maxsize=None)
+def get_latest_version(name):
+    """
+    Return the latest version of dictionary `name`, or 0 if there is none.
+    """
+    pattern = re.compile(r'%s-(\d+)\.zdict$' % re.escape(name))
+    matches = (pattern.match(filename) for filename in os.listdir(DICTIONARY_DIR))
+    return max((int(match.group(1)) for match in matches if match), default=0)
+
+
+def compress(text, dictionary=None):
+    """
+    Return `text` as stored, deflated with the latest version of the preset dictionary `dictionary`.
+    """
+    if not text:
+        return b''
+    data = text.encode('utf-8')
+    if len(data) < MIN_SIZE:
+        return bytes([PLAIN, 0]) + data
+    version = get_latest_version(dictionary) if dictionary else 0
+    options = {'zdict': get_dictionary(dictionary, version)} if version else {}
+    compressor = zlib.compressobj(getattr(settings, 'SNIPPETS_COMPRESSION_LEVEL', 6), zlib.DEFLATED, -15, **options)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return bytes([PLAIN, 0]) + data
+    return bytes([DEFLATE, version]) + compressed
+
+
+def decompress(value, dictionary=None):
+    """
+    Return the text stored as `value`. The dictionary is named in the field; its version in the value.
+    """
+    if not value:
+        return ''
+    format, version = value[0], value[1]
+    if format == PLAIN:
+        return value[2:].decode('utf-8')
+    if format != DEFLATE:
+        raise ValueError('Unknown compressed format %d' % format)
+    options = {}
+    if version:
+        options['zdict'] = get_dictionary(dictionary, version)
+    return zlib.decompressobj(-15, **options).decompress(value[2:]).decode('utf-8')
+
+
+def train(samples, size=DICTIONARY_SIZE):
+    """
+    Return a preset dictionary of up to `size` bytes for documents like `samples`: the
+    runs of up to three fragments (tags, words, entities) saving the most bytes in them.
+    The most valuable come last, where zlib reaches them at the shortest distance.
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        fragments = FRAGMENT.findall(sample)
+        for length in (1, 2, 3):
+            counts.update(''.join(fragments[index:index + length]) for index in range(len(fragments) - length + 1))
+    # Runs shorter than zlib's shortest match save nothing.
+    ranked = sorted(((count - 1) * len(run.encode('utf-8')), run) for run, count in counts.items()
+                    if count > 1 and len(run) >= 3)
+    chosen = []
+    used = 0
+    for _, run in reversed(ranked):
+        data = run.encode('utf-8')
+        if used + len(data) > size or any(run in other for other in chosen):
+            continue
+        chosen.append(run)
+        used += len(data)
+    return ''.join(reversed(chosen)).encode('utf-8')
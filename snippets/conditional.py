@@ -0,0 +1,67 @@
+"""
+Validators (ETag and Last-Modified) for conditional GETs of snippets.
+
+A snippet is versioned by its `updated` column, and a table by its latest
+`updated` value and its row count, cached for `SNIPPETS_LIST_VERSION_TIMEOUT`
+seconds and invalidated by `snippets.signals` on every write in this process.
+Each database a table is read from (see `snippets.dbrouters`) has its own copy.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import dbrouters
+
+
+def version_key(model, using):
+    return 'snippets:version:%s:%s' % (model._meta.label_lower, using)
+
+
+def get_table_version(model):
+    """
+    Return `(latest updated, row count)` of `model`'s table.
+    """
+    using = router.db_for_read(model)
+    key = version_key(model, using)
+    version = cache.get(key)
+    if version is None:
+        aggregate = model._default_manager.using(using).aggregate(latest=Max('updated'), count=Count('pk'))
+        version = (aggregate['latest'], aggregate['count'])
+        cache.set(key, version, settings.SNIPPETS_LIST_VERSION_TIMEOUT)
+    return version
+
+
+def invalidate(model):
+    cache.delete_many([version_key(model, using) for using in [DEFAULT_DB_ALIAS] + dbrouters.get_replicas()])
+
+
+def make_etag(request, *version):
+    """
+    Tag the representation of `version` served to `request`: it depends on the
+    absolute URL, the negotiated media type and, in the browsable API, on the user.
+    """
+    parts = [str(part) for part in version] + [
+        request.build_absolute_uri(),
+        getattr(request, 'accepted_media_type', '') or request.META.get('HTTP_ACCEPT', ''),
+        str(request.user.pk),
+    ]
+    return '"%s"' % hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def timestamp(value):
+    return None if value is None else int(value.timestamp())
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timestamp(last_modified))
+    # Stored copies must be revalidated, which costs a 304 at most.
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Accept', 'Cookie'])
+    return response
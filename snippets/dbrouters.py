@@ -0,0 +1,101 @@
+"""
+Route the reads of safe requests to read replicas, and everything else to the primary.
+
+`SNIPPETS_READ_REPLICAS` names the `DATABASES` aliases of the replicas, which
+something outside Django keeps in sync with 'default' (e.g. Litestream or LiteFS
+for SQLite). `ReplicaRoutingMiddleware` picks a replica for each GET, HEAD or
+OPTIONS request; `PrimaryReplicaRouter` sends that request's reads there, and
+every other query, including those outside requests, to 'default'.
+
+Replicas lag behind, so a client that has just written would not always read
+its write back. After an unsafe request, or any request that wrote, the client
+is handed a cookie pinning it to the primary for `SNIPPETS_REPLICA_MAX_LAG`
+seconds, the longest a replica is expected to take to catch up.
+"""
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'snippets_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The routing state of the current request: {'replica': alias or None, 'pinned': bool, 'wrote': bool}.
+_state = contextvars.ContextVar('snippets_routing', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'SNIPPETS_READ_REPLICAS', []))
+
+
+def get_replica():
+    """
+    Return the replica the current request reads from, or `None` when it reads from the primary.
+    """
+    state = _state.get()
+    return None if state is None else state['replica']
+
+
+def is_pinned():
+    """
+    Return whether the current request is pinned to the primary after a recent write of its client.
+    """
+    state = _state.get()
+    return state is not None and state['pinned']
+
+
+class PrimaryReplicaRouter:
+    # A session missing from a lagging replica would log its user out.
+    primary_apps = {'sessions'}
+
+    def db_for_read(self, model, **hints):
+        replica = get_replica()
+        # Reads inside a transaction must see its writes.
+        if (replica is None or model._meta.app_label in self.primary_apps
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def has_pin(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        replicas = get_replicas()
+        pinned = self.has_pin(request)
+        replica = None
+        if replicas and request.method in SAFE_METHODS and not pinned:
+            replica = random.choice(replicas)
+        state = {'replica': replica, 'pinned': pinned, 'wrote': False}
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if replicas and (request.method not in SAFE_METHODS or state['wrote']):
+            max_lag = settings.SNIPPETS_REPLICA_MAX_LAG
+            response.set_cookie(PIN_COOKIE, str(time.time() + max_lag), max_age=max_lag, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,112 @@
+"""
+Content encodings of cached responses (see `snippets.responsecache`).
+
+Compressing a response on every request costs more CPU than rendering it
+from the cache. Instead a response is compressed once, in each encoding of
+`SNIPPETS_RESPONSE_ENCODINGS`, when it is stored, and requests get the stored
+variant their `Accept-Encoding` prefers. Responses shorter than
+`SNIPPETS_RESPONSE_ENCODING_MIN_SIZE` bytes are not worth compressing. Brotli
+(`br`) needs the optional `brotli` package, and is skipped without it.
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressed once per cached response, so the highest levels pay off; Brotli's
+# 10 and 11 are several times slower still, for little gain on HTML and JSON.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+QUALITY = re.compile(r';\s*q\s*=\s*([0-9.]+)')
+
+
+def compress_gzip(content):
+    # No timestamp, so that the same content compresses to the same bytes.
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_brotli(content):
+    return brotli.compress(content, quality=BROTLI_QUALITY)
+
+
+ENCODERS = {
+    'br': compress_brotli,
+    'gzip': compress_gzip,
+}
+
+
+def get_encodings():
+    """
+    Return the encodings responses are stored in, the preferred first.
+    """
+    return [encoding for encoding in settings.SNIPPETS_RESPONSE_ENCODINGS if encoding != 'br' or brotli is not None]
+
+
+def encode(content):
+    """
+    Return `content` compressed in each encoding that makes it shorter, by encoding.
+    """
+    if len(content) < settings.SNIPPETS_RESPONSE_ENCODING_MIN_SIZE:
+        return {}
+    variants = {}
+    for encoding in get_encodings():
+        data = ENCODERS[encoding](content)
+        if len(data) < len(content):
+            variants[encoding] = data
+    return variants
+
+
+def parse_accept_encoding(header):
+    """
+    Return the quality of each content coding in an `Accept-Encoding` header.
+    """
+    accepted = {}
+    for item in header.split(','):
+        coding = item.split(';', 1)[0].strip().lower()
+        if not coding:
+            continue
+        match = QUALITY.search(item)
+        try:
+            accepted[coding] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            accepted[coding] = 0.0
+    return accepted
+
+
+def choose(request, variants):
+    """
+    Return the encoding of `variants` the request accepts with the highest quality,
+    in our order of preference among equals, or `None` to send the content as is.
+    """
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    best, best_quality = None, 0.0
+    for encoding in get_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if encoding in variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def apply(request, response, variants):
+    """
+    Send `response` in the encoding of `variants` the request prefers, if any.
+    """
+    if not variants:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = choose(request, variants)
+    if encoding is None:
+        return response
+    response.content = variants[encoding]
+    response['Content-Encoding'] = encoding
+    # The content differs by encoding, so its validator may only match weakly, as GZipMiddleware makes it.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    return response
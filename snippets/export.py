@@ -0,0 +1,55 @@
+"""
+Streaming export of snippets as a JSON array or as newline delimited JSON.
+
+Rows are read from a server-side iterator in chunks, rendered with a compiled
+serializer and encoded one chunk at a time, so memory use does not grow with
+the size of the table.
+"""
+from itertools import islice
+
+from rest_framework.utils.encoders import JSONEncoder
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_chunks(compiled, queryset, chunk_size):
+    """
+    Yield lists of rendered items, `chunk_size` rows at a time.
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield compiled.render(chunk)
+
+
+def encode_ndjson(chunks):
+    encode = JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for items in chunks:
+        yield ''.join(encode(item) + '\n' for item in items).encode('utf-8')
+
+
+def encode_json(chunks):
+    encode = JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    separator = '['
+    for items in chunks:
+        yield (separator + ','.join(encode(item) for item in items)).encode('utf-8')
+        separator = ','
+    yield b'[]' if separator == '[' else b']'
+
+
+ENCODERS = {
+    'json': encode_json,
+    'ndjson': encode_ndjson,
+}
+
+
+def stream(compiled, queryset, format, chunk_size):
+    """
+    Return an iterator over the encoded export of `queryset`.
+    """
+    return ENCODERS[format](iter_chunks(compiled, queryset, chunk_size))
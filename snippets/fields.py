@@ -0,0 +1,68 @@
+"""
+Model fields of the snippets app.
+"""
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .compression import Compressed, compress
+
+
+class CompressedAttribute(DeferredAttribute):
+    """
+    Decompress the value of a `CompressedTextField` when it is first read from the instance.
+    """
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, Compressed):
+            value = instance.__dict__[self.field.attname] = value.decompress()
+        return value
+
+    # A data descriptor, so that reads go through `__get__()` although the value is in the instance's `__dict__`.
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    A `TextField` stored compressed with the preset dictionary `dictionary` (see `snippets.compression`).
+
+    Values are decompressed on first access to the model attribute, so that instances loading
+    the column without reading it never decompress it. `.values()` returns them as stored,
+    as `Compressed` bytes. Rows stored as text, before the column was compressed, read as text.
+    """
+    descriptor_class = CompressedAttribute
+
+    def __init__(self, *args, dictionary=None, **kwargs):
+        self.dictionary = dictionary
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dictionary is not None:
+            kwargs['dictionary'] = self.dictionary
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return Compressed(value, self.dictionary)
+
+    def to_python(self, value):
+        if isinstance(value, Compressed):
+            return value.decompress()
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, Compressed):
+            return value
+        return compress(str(value), self.dictionary)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(bytes(value))
+        return value
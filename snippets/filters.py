@@ -0,0 +1,94 @@
+"""
+Filter backends for the snippet list views.
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .registry import LANGUAGE_CHOICES, STYLE_CHOICES
+from .search import get_search_backend
+
+
+class SnippetFilter(BaseFilterBackend):
+    """
+    Filter the list by `?language=`, `?style=`, `?owner=` (a username) and a
+    `?created_after=` / `?created_before=` range of ISO dates or datetimes.
+
+    Each filter has a composite index ending with the list ordering (`created`, `id`),
+    so a filtered page is still a single index range scan.
+    """
+    choice_params = {
+        'language': LANGUAGE_CHOICES,
+        'style': STYLE_CHOICES,
+    }
+    range_params = {
+        'created_after': 'created__gte',
+        'created_before': 'created__lt',
+    }
+
+    def get_filters(self, request, exclude=()):
+        """
+        Return the lookups requested by `request`, leaving out the parameters in `exclude`.
+        """
+        params = request.query_params
+        filters, errors = {}, {}
+        for param, choices in self.choice_params.items():
+            value = params.get(param)
+            if value and param not in exclude:
+                if value not in choices.labels:
+                    errors[param] = ['"%s" is not a valid choice.' % value]
+                filters[param] = value
+        owner = params.get('owner')
+        if owner and 'owner' not in exclude:
+            filters['owner__username'] = owner
+        for param, lookup in self.range_params.items():
+            value = params.get(param)
+            if value and param not in exclude:
+                parsed = self.parse_datetime(value)
+                if parsed is None:
+                    errors[param] = ['Enter a valid date or datetime.']
+                filters[lookup] = parsed
+        if errors:
+            raise ValidationError(errors)
+        return filters
+
+    def parse_datetime(self, value):
+        """
+        Parse an ISO date or datetime; dates and naive datetimes are in the current time zone.
+        """
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                date = parse_date(value)
+                parsed = None if date is None else datetime.combine(date, time.min)
+        except ValueError:
+            return None
+        if parsed is not None and settings.USE_TZ and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.get_filters(request)
+        return queryset.filter(**filters) if filters else queryset
+
+
+class SnippetSearchFilter(BaseFilterBackend):
+    """
+    Narrow the list to the snippets matching `?search=`, best matches first.
+    Pages of results are ordered by `search_rank`, then `id`.
+    """
+    search_param = 'search'
+
+    def get_search_query(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if not query:
+            return queryset
+        view.keyset_ordering = ('search_rank', 'id')
+        return get_search_backend().search(queryset, query).order_by('search_rank', 'id')
@@ -0,0 +1,373 @@
+"""
+Rendering of `Snippet` code into highlighted HTML, with a pluggable render cache.
+
+Snippets are rendered to an HTML fragment that links to a shared per-style
+stylesheet (see `style_css()`) rather than embedding it. Rendering is a pure
+function of its inputs, so the fragment is cached under a hash of (code,
+language, style, linenos). The cache backend is configured with the
+`SNIPPETS_RENDER_CACHE` setting:
+
+    SNIPPETS_RENDER_CACHE = {
+        'BACKEND': 'snippets.highlighting.LRURenderCache',
+        'OPTIONS': {'max_entries': 1024, 'max_bytes': 32 * 1024 * 1024},
+    }
+
+Use `snippets.highlighting.DjangoRenderCache` to share rendered HTML between
+workers through one of the entries in `CACHES`.
+"""
+import asyncio
+import functools
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from pygments import format, highlight
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+from . import instrumentation
+
+DEFAULT_RENDER_CACHE = {
+    'BACKEND': 'snippets.highlighting.LRURenderCache',
+    'OPTIONS': {},
+}
+
+
+PAGE_TEMPLATE = (
+    '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>%(title)s</title>\n'
+    '<link rel="stylesheet" href="%(stylesheet)s">\n</head>\n<body>\n%(heading)s%(body)s</body>\n</html>\n'
+)
+
+
+def render_key(code, language, style, linenos):
+    """
+    Return a content address for the given render inputs.
+    """
+    digest = hashlib.sha256()
+    for part in (language, style, 'table' if linenos else '', code):
+        data = part.encode('utf-8')
+        # Length-prefix every part so that no two input tuples share a key.
+        digest.update(b'%d:' % len(data))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class BaseRenderCache:
+    """
+    Interface of a render cache, mapping `render_key()` digests to HTML.
+    """
+
+    def get(self, key):
+        raise NotImplementedError('`get()` must be implemented.')
+
+    def set(self, key, html):
+        raise NotImplementedError('`set()` must be implemented.')
+
+    def clear(self):
+        raise NotImplementedError('`clear()` must be implemented.')
+
+
+class NullRenderCache(BaseRenderCache):
+    """
+    Render cache that never stores anything.
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, html):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRURenderCache(BaseRenderCache):
+    """
+    Per-process render cache with least-recently-used eviction.
+
+    The cache is bounded both by number of entries and by the total size of the
+    stored HTML; whichever limit is hit first evicts the oldest entries.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return None
+            return self._entries[key]
+
+    def set(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = html
+            self.size += len(html)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DjangoRenderCache(BaseRenderCache):
+    """
+    Render cache stored in one of the Django `CACHES`, shared by all workers.
+
+    Its keys start with `key_prefix` and the current generation, so that
+    `clear()` drops only them by starting a new one, and the alias may be
+    shared with other uses. Old entries are left for the backend to cull.
+    """
+
+    def __init__(self, alias='default', timeout=None, key_prefix='snippets:render:'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_generation(self):
+        key = self.key_prefix + 'generation'
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, uuid.uuid4().hex, None)
+            generation = self.cache.get(key)
+        return generation
+
+    def make_key(self, key):
+        return '%s%s:%s' % (self.key_prefix, self.get_generation(), key)
+
+    def get(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def set(self, key, html):
+        self.cache.set(self.make_key(key), html, self.timeout)
+
+    def clear(self):
+        self.cache.delete(self.key_prefix + 'generation')
+
+
+_render_cache = None
+
+
+def get_render_cache():
+    """
+    Return the render cache configured by `SNIPPETS_RENDER_CACHE`.
+    """
+    global _render_cache
+    if _render_cache is None:
+        config = getattr(settings, 'SNIPPETS_RENDER_CACHE', DEFAULT_RENDER_CACHE)
+        backend = import_string(config['BACKEND'])
+        _render_cache = backend(**config.get('OPTIONS', {}))
+    return _render_cache
+
+
+@receiver(setting_changed)
+def reset_render_cache(setting, **kwargs):
+    global _render_cache
+    if setting == 'SNIPPETS_RENDER_CACHE':
+        _render_cache = None
+
+
+def render(code, language, style, linenos=False):
+    """
+    Use the `Pygments` library to create a highlighted HTML fragment of the code.
+    """
+    with instrumentation.phase('highlight'):
+        lexer = get_lexer_by_name(language)
+        formatter = HtmlFormatter(style=style, linenos='table' if linenos else False)
+        return highlight(code, lexer, formatter)
+
+
+@functools.lru_cache(maxsize=None)
+def style_css(style):
+    """
+    Return the stylesheet for fragments rendered with `style`, built once per style.
+    """
+    return HtmlFormatter(style=style).get_style_defs('.highlight')
+
+
+def render_lines(code, language, style, linenos, start, stop):
+    """
+    Render lines `start` to `stop` (excluded) of the code as `render()` renders them,
+    lexing no further than they go.
+    """
+    with instrumentation.phase('highlight'):
+        lexer = get_lexer_by_name(language)
+        tokens = []
+        line = 0
+        for ttype, value in lexer.get_tokens(code):
+            newlines = value.count('\n')
+            if start <= line and line + newlines < stop:
+                tokens.append((ttype, value))
+            elif line + newlines >= start:
+                # The formatter highlights each line on its own: a token across the bounds is cut at them.
+                for index, part in enumerate(value.split('\n')):
+                    if start <= line + index < stop:
+                        if index < newlines:
+                            tokens.append((ttype, part + '\n'))
+                        elif part:
+                            tokens.append((ttype, part))
+            line += newlines
+            if line >= stop:
+                break
+        formatter = HtmlFormatter(style=style, linenos='table' if linenos else False, linenostart=start + 1)
+        return format(tokens, formatter)
+
+
+def render_lines_cached(code, language, style, linenos, start, stop):
+    """
+    Like `render_lines()`, but serve repeated inputs from the render cache.
+    """
+    cache = get_render_cache()
+    key = '%s:%d-%d' % (render_key(code, language, style, linenos), start, stop)
+    html = cache.get(key)
+    if html is None:
+        html = render_lines(code, language, style, linenos, start, stop)
+        cache.set(key, html)
+    return html
+
+
+def count_lines(code, language):
+    """
+    Return the number of lines the lexer of `language` sees in the code.
+    """
+    lexer = get_lexer_by_name(language)
+    # How Pygments normalizes newlines and strips the input before lexing it.
+    preprocess = getattr(lexer, '_preprocess_lexer_input', None)
+    return (preprocess(code) if preprocess is not None else code).count('\n')
+
+
+def render_page(body, title, stylesheet):
+    """
+    Wrap a rendered fragment into a complete HTML page linking to `stylesheet`.
+    """
+    title = escape(title)
+    return PAGE_TEMPLATE % {
+        'title': title,
+        'heading': '<h2>%s</h2>\n' % title if title else '',
+        'stylesheet': escape(stylesheet),
+        'body': body,
+    }
+
+
+def render_pager(page, count):
+    """
+    Return the links between the `count` pages of a snippet highlighted page by page, shown on page `page`.
+    """
+    links = []
+    if page > 1:
+        links.append('<a href="?page=%d" rel="prev">Previous</a>' % (page - 1))
+    links.append('Page %d of %d' % (page, count))
+    if page < count:
+        links.append('<a href="?page=%d" rel="next">Next</a>' % (page + 1))
+    return '<nav class="pages">%s</nav>\n' % ' | '.join(links)
+
+
+def render_preview(code, title=''):
+    """
+    Return a plain, escaped HTML page of the code, shown while highlighting is pending.
+    """
+    return (
+        '<!DOCTYPE html>\n<html>\n<head>\n<title>%(title)s</title>\n'
+        '<meta http-equiv="refresh" content="2">\n</head>\n'
+        '<body>\n<pre>%(code)s</pre>\n</body>\n</html>\n'
+    ) % {'title': escape(title), 'code': escape(code)}
+
+
+def get_cached(code, language, style, linenos=False):
+    """
+    Return the cached rendering of the given inputs, or `None`.
+    """
+    return get_render_cache().get(render_key(code, language, style, linenos))
+
+
+def render_cached(code, language, style, linenos=False):
+    """
+    Like `render()`, but serve repeated inputs from the render cache.
+    """
+    cache = get_render_cache()
+    key = render_key(code, language, style, linenos)
+    html = cache.get(key)
+    if html is None:
+        html = render(code, language, style, linenos)
+        cache.set(key, html)
+    return html
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    Return the process pool shared by bulk writes and async views, started on first use.
+    Its size is `SNIPPETS_RENDER_PROCESSES`, or the number of CPUs.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(getattr(settings, 'SNIPPETS_RENDER_PROCESSES', None))
+        return _render_pool
+
+
+async def render_async(code, language, style, linenos=False):
+    """
+    Like `render_cached()`, but render in the process pool without blocking the event loop.
+    """
+    key = render_key(code, language, style, linenos)
+    html = get_render_cache().get(key)
+    if html is None:
+        loop = asyncio.get_running_loop()
+        html = await loop.run_in_executor(get_render_pool(), render, code, language, style, linenos)
+        get_render_cache().set(key, html)
+    return html
+
+
+def get_code_size(code):
+    """
+    Return the size of the code in bytes of UTF-8, without encoding ASCII code.
+    """
+    return len(code) if code.isascii() else len(code.encode('utf-8'))
+
+
+def is_oversized(code):
+    """
+    Return whether the code is too large to highlight on save, and is highlighted page by page when viewed.
+    """
+    limit = getattr(settings, 'SNIPPETS_LAZY_HIGHLIGHT_SIZE', None)
+    return limit is not None and get_code_size(code) >= limit
+
+
+def is_async():
+    """
+    Return whether highlighting is deferred to the background worker.
+    """
+    return getattr(settings, 'SNIPPETS_HIGHLIGHT_MODE', 'sync') == 'async'
@@ -0,0 +1,761 @@
+"""
+Incremental re-highlighting of large snippets.
+
+Rendering a snippet of `SNIPPETS_INCREMENTAL_HIGHLIGHT_LINES` lines or more
+also records where the lexer could be resumed: its state stack at every line
+that starts a token. The record is stored with the snippet
+(`highlight_state`). When the code is edited, the lines from a checkpoint
+before the edit are lexed again, until the lexer reaches a line of the
+unchanged tail in the state it was in there before: the rest of the tokens
+are then the same. The formatter emits one line of HTML per line of code, so
+the lines lexed again are spliced into the previous HTML.
+
+A regular expression can read past the token it matches, so the checkpoint
+has to be far enough before the edit that nothing lexed before it read the
+edited lines. `analyze()` bounds how far each pattern of the lexer reads:
+across a few newlines, across blank lines, or, for patterns scanning for a
+closing delimiter, anywhere. Those are recorded when they fail to match
+after their opening delimiter (an unclosed string, say), unless they provably
+read no further than the end of the line: the edit may close it, which is
+checked before resuming.
+
+Lexers that do not run `RegexLexer`'s own tokenizer, or whose patterns
+cannot be bounded (back references, lookahead across lines), are not
+resumed. Whenever the previous state does not match the previous code and
+HTML, the snippet is rendered in full.
+"""
+import bisect
+import functools
+import hashlib
+import json
+import sys
+from collections import namedtuple
+
+import pygments
+from django.conf import settings
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexer import RegexLexer
+from pygments.lexers import get_lexer_by_name
+from pygments.token import Error, Whitespace, _TokenType
+
+from . import highlighting, instrumentation
+
+try:
+    from re import _compiler as sre_compile, _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_compile
+    import sre_constants
+    import sre_parse
+
+STATE_VERSION = 1
+
+NEWLINE = ord('\n')
+POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, POSSESSIVE_REPEAT}
+GREEDY_REPEATS = REPEATS - {sre_constants.MIN_REPEAT}
+ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+CHARACTERS = {sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN}
+SPACE_CATEGORIES = {sre_constants.CATEGORY_SPACE, sre_constants.CATEGORY_UNI_SPACE}
+NEWLINE_CATEGORIES = SPACE_CATEGORIES | {
+    sre_constants.CATEGORY_NOT_DIGIT, sre_constants.CATEGORY_UNI_NOT_DIGIT,
+    sre_constants.CATEGORY_NOT_WORD, sre_constants.CATEGORY_UNI_NOT_WORD,
+    sre_constants.CATEGORY_LINEBREAK, sre_constants.CATEGORY_UNI_LINEBREAK,
+}
+
+
+class Unbounded(Exception):
+    pass
+
+
+class Reach:
+    """
+    How far the patterns of a lexer read from where they are tried.
+
+    `steps`: the most newlines a failed attempt, or a match with what it looks at
+    past its end, reads across, a run of whitespace across blank lines counting once.
+    `back`: the most newlines a lookbehind reads back across.
+    `open`: whether a pattern scans for a closing delimiter across lines.
+    """
+
+    def __init__(self):
+        self.steps = 0
+        self.back = 0
+        self.open = False
+
+
+def matches_newline(op, av):
+    if op is sre_constants.LITERAL:
+        return av == NEWLINE
+    if op is sre_constants.NOT_LITERAL:
+        return av != NEWLINE
+    if op is sre_constants.IN:
+        negate = matched = False
+        for item_op, item_av in av:
+            if item_op is sre_constants.NEGATE:
+                negate = True
+            elif item_op is sre_constants.LITERAL:
+                matched |= item_av == NEWLINE
+            elif item_op is sre_constants.RANGE:
+                matched |= item_av[0] <= NEWLINE <= item_av[1]
+            elif item_op is sre_constants.CATEGORY:
+                matched |= item_av in NEWLINE_CATEGORIES
+            else:
+                matched = True
+        return matched != negate
+    return False
+
+
+def is_whitespace(body):
+    """
+    Return whether `body` matches a single whitespace character and nothing else.
+    """
+    if len(body) != 1:
+        return False
+    op, av = body[0]
+    if op is sre_constants.LITERAL:
+        return chr(av).isspace()
+    if op is sre_constants.IN:
+        return all((item_op is sre_constants.LITERAL and chr(item_av).isspace())
+                   or (item_op is sre_constants.CATEGORY and item_av in SPACE_CATEGORIES)
+                   for item_op, item_av in av)
+    return False
+
+
+def is_nullable(op, av):
+    if op in REPEATS:
+        return av[0] == 0 or all(is_nullable(*item) for item in av[2])
+    if op is sre_constants.SUBPATTERN:
+        return all(is_nullable(*item) for item in av[-1])
+    if op is ATOMIC_GROUP:
+        return all(is_nullable(*item) for item in av)
+    if op is sre_constants.BRANCH:
+        return any(all(is_nullable(*item) for item in branch) for branch in av[1])
+    return op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+
+def can_fail(op, av):
+    """
+    Return whether `op` may fail to match, at some position, without reading any character.
+    """
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return True
+    if op is sre_constants.SUBPATTERN:
+        return any(can_fail(*item) for item in av[-1])
+    return not is_nullable(op, av)
+
+
+def get_first(items):
+    """
+    Return the single character matchers a match of `items` can start with, and whether it can be empty.
+    """
+    matchers = []
+    for op, av in items:
+        if op in CHARACTERS:
+            matchers.append((op, av))
+            return matchers, False
+        if op is sre_constants.SUBPATTERN:
+            first, nullable = get_first(av[-1])
+        elif op is ATOMIC_GROUP:
+            first, nullable = get_first(av)
+        elif op is sre_constants.BRANCH:
+            first, nullable = [], False
+            for branch in av[1]:
+                branch_first, branch_nullable = get_first(branch)
+                first.extend(branch_first)
+                nullable |= branch_nullable
+        elif op in REPEATS:
+            first, nullable = get_first(av[2])
+            nullable |= av[0] == 0
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            first, nullable = [], True
+        else:
+            raise Unbounded(str(op))
+        matchers.extend(first)
+        if not nullable:
+            return matchers, False
+    return matchers, True
+
+
+def get_mandatory(items):
+    """
+    Return a single character matcher every match of `items` goes through, or `None`.
+    """
+    for op, av in items:
+        if is_nullable(op, av):
+            continue
+        if op in CHARACTERS:
+            return op, av
+        if op is sre_constants.SUBPATTERN:
+            return get_mandatory(av[-1])
+        if op in REPEATS:
+            return get_mandatory(av[2])
+        return None
+    return None
+
+
+def get_characters(op, av):
+    """
+    Return the characters a single character matcher matches, if it lists them.
+    """
+    if op is sre_constants.LITERAL:
+        return [chr(av)]
+    if op is sre_constants.IN and all(item_op in (sre_constants.LITERAL, sre_constants.RANGE) for item_op, _ in av):
+        characters = []
+        for item_op, item_av in av:
+            characters.extend(map(chr, [item_av] if item_op is sre_constants.LITERAL
+                                  else range(item_av[0], item_av[1] + 1)))
+        return characters
+    return None
+
+
+def overlap(matchers, others, flags, state):
+    """
+    Return whether a character may match one of `matchers` and one of `others`.
+    """
+    for a in matchers:
+        for b in others:
+            # Keyed by their reprs: parsed patterns are not hashable.
+            key = (repr(a), repr(b), flags)
+            if key not in _overlaps:
+                _overlaps[key] = overlaps(a, b, flags, state)
+            if _overlaps[key]:
+                return True
+    return False
+
+
+_overlaps = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_universe():
+    return ''.join(map(chr, range(sys.maxunicode + 1)))
+
+
+def overlaps(a, b, flags, state):
+    for listed, other in [(a, b), (b, a)]:
+        characters = get_characters(*listed)
+        if characters is not None:
+            match = sre_compile.compile(sre_parse.SubPattern(state, [other]), flags).match
+            return any(match(character) for character in characters)
+    both = [(sre_constants.ASSERT, (1, sre_parse.SubPattern(state, [a]))), b]
+    return sre_compile.compile(sre_parse.SubPattern(state, both), flags).search(get_universe()) is not None
+
+
+def scan(items, flags, after, reach, state):
+    """
+    Add how far `items`, followed by `after`, read to `reach`.
+    Raise `Unbounded` for constructs whose reach cannot be told.
+    """
+    for index, (op, av) in enumerate(items):
+        following = list(items[index + 1:]) + after
+        if op in CHARACTERS:
+            if matches_newline(op, av) or (op is sre_constants.ANY and flags & sre_constants.SRE_FLAG_DOTALL):
+                reach.steps += 1
+        elif op is sre_constants.AT:
+            pass
+        elif op is sre_constants.SUBPATTERN:
+            scan(av[-1], (flags | av[1]) & ~av[2], following, reach, state)
+        elif op is ATOMIC_GROUP:
+            scan(av, flags, following, reach, state)
+        elif op is sre_constants.BRANCH:
+            branches = []
+            for branch in av[1]:
+                branches.append(Reach())
+                scan(branch, flags, following, branches[-1], state)
+            reach.steps += max(branch.steps for branch in branches)
+            reach.back = max(reach.back, *(branch.back for branch in branches))
+            reach.open |= any(branch.open for branch in branches)
+        elif op in REPEATS:
+            scan_repeat(op, av, flags, following, reach, state)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            direction, body = av
+            inner = Reach()
+            scan(body, flags, [], inner, state)
+            if inner.open:
+                raise Unbounded('lookaround across lines')
+            if direction == 1:
+                reach.steps += inner.steps
+            else:
+                reach.back = max(reach.back, inner.steps)
+        else:
+            raise Unbounded(str(op))
+
+
+def scan_repeat(op, av, flags, following, reach, state):
+    low, high, body = av
+    inner = Reach()
+    scan(body, flags, [(op, av)] + following, inner, state)
+    reach.back = max(reach.back, inner.back)
+    if not inner.steps and not inner.open:
+        return
+    first, nullable = get_first(following)
+    # Where the repeat stops must not depend on how far an iteration that fails reads.
+    if inner.open:
+        if nullable or overlap(get_first(body)[0], first, flags, state):
+            raise Unbounded('repeat of a delimited pattern')
+        reach.open = True
+    elif high is not sre_constants.MAXREPEAT:
+        reach.steps += inner.steps * high
+    elif is_whitespace(body) or not any(can_fail(*item) for item in following):
+        # A run stops at the first character it does not match; a lazy one, at once.
+        reach.steps += 1
+    else:
+        if op in GREEDY_REPEATS:
+            mandatory = get_mandatory(following)
+            single = len(body) == 1 and body[0][0] in CHARACTERS
+            if (nullable or overlap(get_first(body)[0], first, flags, state)) and not (
+                    single and mandatory is not None and not overlap(body, [mandatory], flags, state)):
+                raise Unbounded('greedy repeat reading past its match')
+        reach.open = True
+
+
+def is_open(op, av, flags, state):
+    """
+    Return whether `op` holds a repeat that may read any number of lines when the rest of the pattern fails.
+    """
+    if op in REPEATS:
+        inner = Reach()
+        try:
+            scan(av[2], flags, [], inner, state)
+        except Unbounded:
+            return True
+        return inner.open or (av[1] is sre_constants.MAXREPEAT and inner.steps > 0 and not is_whitespace(av[2]))
+    if op is sre_constants.SUBPATTERN:
+        return any(is_open(*item, (flags | av[1]) & ~av[2], state) for item in av[-1])
+    if op is ATOMIC_GROUP:
+        return any(is_open(*item, flags, state) for item in av)
+    if op is sre_constants.BRANCH:
+        return any(is_open(*item, flags, state) for branch in av[1] for item in branch)
+    return False
+
+
+def truncate(items, flags, state):
+    """
+    Return `items` up to their first open repeat, or `None` if they have none.
+    """
+    for index, (op, av) in enumerate(items):
+        if op is sre_constants.SUBPATTERN:
+            inner = truncate(av[-1], (flags | av[1]) & ~av[2], state)
+            if inner is not None:
+                return list(items[:index]) + [(op, av[:-1] + (sre_parse.SubPattern(state, inner),))]
+        elif is_open(op, av, flags, state):
+            return list(items[:index])
+    return None
+
+
+def check_determined(items, flags, after, state):
+    """
+    Raise `Unbounded` unless `items`, followed by `after`, can match only one way from a position,
+    but for stopping short.
+    """
+    for index, (op, av) in enumerate(items):
+        following = list(items[index + 1:]) + after
+        if op is sre_constants.SUBPATTERN:
+            check_determined(av[-1], (flags | av[1]) & ~av[2], following, state)
+        elif op is sre_constants.BRANCH:
+            words = [''.join(chr(item_av) for _, item_av in branch).casefold()
+                     if all(item_op is sre_constants.LITERAL for item_op, _ in branch) else None
+                     for branch in av[1]]
+            if None in words:
+                firsts = [get_first(list(branch) + following)[0] for branch in av[1]]
+                if any(overlap(a, b, flags, state) for i, a in enumerate(firsts) for b in firsts[i + 1:]):
+                    raise Unbounded('ambiguous alternatives')
+            elif any(a != b and b.startswith(a) for a in words for b in words):
+                raise Unbounded('ambiguous alternatives')
+            for branch in av[1]:
+                check_determined(branch, flags, following, state)
+        elif op in REPEATS:
+            low, high, body = av
+            if low != high and op is not POSSESSIVE_REPEAT:
+                if overlap(get_first(body)[0], get_first(following)[0], flags, state):
+                    raise Unbounded('ambiguous repeat')
+            check_determined(body, flags, [(op, av)] + following, state)
+        elif op not in CHARACTERS and op not in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            raise Unbounded(str(op))
+
+
+def get_extent(items, flags, after, state):
+    """
+    Return `items` up to and including their first open repeat, made greedy, or `None` if they have none.
+
+    Where the match ends is then the farthest a failed match of the pattern
+    read, give or take what its other patterns read. Raise `Unbounded` if that
+    does not hold.
+    """
+    for index, (op, av) in enumerate(items):
+        following = list(items[index + 1:]) + after
+        if op is sre_constants.SUBPATTERN:
+            inner_flags = (flags | av[1]) & ~av[2]
+            inner = get_extent(av[-1], inner_flags, following, state)
+            if inner is not None:
+                return list(items[:index]) + [(op, av[:-1] + (sre_parse.SubPattern(state, inner),))]
+            check_determined(av[-1], inner_flags, following, state)
+        elif is_open(op, av, flags, state):
+            if op not in REPEATS:
+                raise Unbounded('alternatives of a delimited pattern')
+            reach = Reach()
+            scan(av[2], flags, [(op, av)], reach, state)
+            if reach.open:
+                raise Unbounded('repeat of a delimited pattern')
+            check_determined(av[2], flags, [(op, av)], state)
+            return list(items[:index]) + [(sre_constants.MAX_REPEAT, av)]
+        else:
+            check_determined([(op, av)], flags, following, state)
+    return None
+
+
+Entry = namedtuple('Entry', ['match', 'extent', 'rexmatch', 'index'])
+Analysis = namedtuple('Analysis', ['steps', 'back', 'entries'])
+
+
+@functools.lru_cache(maxsize=None)
+def analyze(lexer_class):
+    """
+    Return how far the patterns of `lexer_class` read, as an `Analysis`, or `None` if that cannot be bounded.
+
+    `entries` maps each state to an `Entry` for each of its patterns scanning
+    for a closing delimiter: after `match`, its opening one, a failed match read
+    anywhere, up to where `extent` ends if it is not `None`.
+    """
+    if lexer_class.get_tokens_unprocessed is not RegexLexer.get_tokens_unprocessed:
+        return None
+    steps = back = 0
+    entries = {}
+    for state, rules in lexer_class._tokens.items():
+        for index, (rexmatch, _, _) in enumerate(rules):
+            pattern = rexmatch.__self__
+            parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+            flags = parsed.state.flags
+            reach = Reach()
+            try:
+                scan(list(parsed), flags, [], reach, parsed.state)
+                if reach.open:
+                    entry = truncate(list(parsed), flags, parsed.state)
+            except Unbounded:
+                return None
+            steps = max(steps, reach.steps)
+            back = max(back, reach.back)
+            if reach.open:
+                try:
+                    extent = get_extent(list(parsed), flags, [], parsed.state)
+                except Unbounded:
+                    extent = None
+                entries.setdefault(state, []).append(Entry(
+                    compile_items(entry, flags, parsed.state),
+                    extent and compile_items(extent, flags, parsed.state), rexmatch, index))
+    return Analysis(max(steps, 1), back, entries)
+
+
+def compile_items(items, flags, state):
+    return sre_compile.compile(sre_parse.SubPattern(state, items), flags).match
+
+
+def is_large(code):
+    minimum = getattr(settings, 'SNIPPETS_INCREMENTAL_HIGHLIGHT_LINES', None)
+    return minimum is not None and code.count('\n') + 1 >= minimum
+
+
+def is_resumable(lexer):
+    return not lexer.filters and hasattr(lexer, '_preprocess_lexer_input') and analyze(type(lexer)) is not None
+
+
+def get_formatter_options(style, linenos):
+    # As in `highlighting.render()`.
+    return {'style': style, 'linenos': 'table' if linenos else False}
+
+
+def digest(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class Record:
+    """
+    The checkpoints of a text, and the patterns that failed to find their closing delimiter in it.
+
+    Checkpoints are stored as runs of lines sharing a state stack; failures as
+    `(line, column, state, rule index)`.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.stacks = []
+        self.failures = []
+
+    def add(self, line, stack):
+        self.lines.append(line)
+        self.stacks.append(stack)
+
+    def extend(self, other, start=0, stop=None, shift=0):
+        """
+        Add the checkpoints and failures of `other` from line `start` up to `stop`, moved by `shift` lines.
+        """
+        first = bisect.bisect_left(other.lines, start)
+        last = len(other.lines) if stop is None else bisect.bisect_left(other.lines, stop)
+        self.lines.extend(line + shift for line in other.lines[first:last])
+        self.stacks.extend(other.stacks[first:last])
+        self.failures.extend([line + shift, column, state, index] for line, column, state, index in other.failures
+                             if line >= start and (stop is None or line < stop))
+
+    def get(self, line):
+        index = bisect.bisect_left(self.lines, line)
+        if index < len(self.lines) and self.lines[index] == line:
+            return self.stacks[index]
+        return None
+
+    def before(self, line):
+        """
+        Return the last checkpoint at or before `line`, as `(line, stack)`.
+        """
+        index = bisect.bisect_right(self.lines, line) - 1
+        return self.lines[index], self.stacks[index]
+
+    def dump(self):
+        table, runs = [], []
+        for line, stack in zip(self.lines, self.stacks):
+            if stack not in table:
+                table.append(stack)
+            index = table.index(stack)
+            if runs and runs[-1][1] == line and runs[-1][2] == index:
+                runs[-1][1] = line + 1
+            else:
+                runs.append([line, line + 1, index])
+        return {'stacks': [list(stack) for stack in table], 'runs': runs, 'failures': sorted(self.failures)}
+
+    @classmethod
+    def load(cls, data):
+        table = [tuple(stack) for stack in data['stacks']]
+        record = cls()
+        for start, stop, index in data['runs']:
+            for line in range(start, stop):
+                record.add(line, table[index])
+        record.failures = data['failures']
+        return record
+
+
+def tokenize(lexer, text, record, pos=0, stack=('root',), line=0, stop=None):
+    """
+    Tokenize `text` from `pos`, the start of line `line`, with the lexer in state `stack`.
+
+    This is `RegexLexer.get_tokens_unprocessed()`, but for adding to `record`
+    a checkpoint at every line that starts a token, and the patterns that fail
+    after their opening delimiter. `stop(line, stack)` ends tokenizing at such
+    a line if it returns true.
+    """
+    entries = analyze(type(lexer)).entries
+    tokendefs = lexer._tokens
+    statestack = list(stack)
+    statetokens = tokendefs[statestack[-1]]
+    stateentries = entries.get(statestack[-1])
+    start = pos
+    while 1:
+        if pos == start or text[pos - 1] == '\n':
+            line += text.count('\n', start, pos)
+            start = pos
+            checkpoint = tuple(statestack)
+            if stop is not None and stop(line, checkpoint):
+                return
+            record.add(line, checkpoint)
+        if stateentries is not None:
+            for entry, extent, rexmatch, index in stateentries:
+                if entry(text, pos) and not rexmatch(text, pos):
+                    if extent is not None:
+                        m = extent(text, pos)
+                        if m is None or text.find('\n', pos, m.end()) < 0:
+                            # It read no further than patterns that do not scan.
+                            continue
+                    failure_line = line + text.count('\n', start, pos)
+                    column = pos - text.rfind('\n', 0, pos) - 1
+                    record.failures.append([failure_line, column, statestack[-1], index])
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if action is not None:
+                    if type(action) is _TokenType:
+                        yield pos, action, m.group()
+                    else:
+                        yield from action(lexer, m)
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    statetokens = tokendefs[statestack[-1]]
+                    stateentries = entries.get(statestack[-1])
+                break
+        else:
+            try:
+                if text[pos] == '\n':
+                    statestack = ['root']
+                    statetokens = tokendefs['root']
+                    stateentries = entries.get('root')
+                    yield pos, Whitespace, '\n'
+                    pos += 1
+                    continue
+                yield pos, Error, text[pos]
+                pos += 1
+            except IndexError:
+                break
+
+
+class LinesFormatter(HtmlFormatter):
+    """
+    Wrap already formatted lines the way `HtmlFormatter` wraps the lines it formats.
+    """
+
+    def __init__(self, lines, **options):
+        super().__init__(**options)
+        self.lines = lines
+
+    def _format_lines(self, tokensource):
+        for line in self.lines:
+            yield 1, line
+
+
+def format_tokens(tokens, options, **extra):
+    return pygments.format(((ttype, value) for _, ttype, value in tokens), HtmlFormatter(**options, **extra))
+
+
+def wrap_lines(lines, options):
+    return pygments.format(iter(()), LinesFormatter(lines, **options))
+
+
+def split_lines(html, count, options):
+    """
+    Return the HTML of each of the `count` lines wrapped in `html`, or `None` if it does not wrap them.
+    """
+    marked = wrap_lines(['\x00\n'] * count, options)
+    prefix, suffix = marked[:marked.find('\x00')], marked[marked.rfind('\x00') + 2:]
+    if count == 0 or not html.startswith(prefix) or not html.endswith(suffix):
+        return None
+    lines = [line + '\n' for line in html[len(prefix):len(html) - len(suffix)].split('\n')[:-1]]
+    return lines if len(lines) == count else None
+
+
+def make_state(text, html, record, language, style, linenos):
+    return json.dumps({
+        'version': STATE_VERSION,
+        'pygments': pygments.__version__,
+        'inputs': [language, style, linenos],
+        'text': digest(text),
+        'html': digest(html),
+        'record': record.dump(),
+    }, separators=(',', ':'))
+
+
+def render(code, language, style, linenos=False):
+    """
+    Render `code` as `highlighting.render()` does, and return the HTML with the state
+    `rerender()` resumes from, which is empty if the lexer cannot be resumed.
+    """
+    lexer = get_lexer_by_name(language)
+    if not is_resumable(lexer):
+        return highlighting.render(code, language, style, linenos), ''
+    with instrumentation.phase('highlight'):
+        text = lexer._preprocess_lexer_input(code)
+        record = Record()
+        html = format_tokens(tokenize(lexer, text, record), get_formatter_options(style, linenos))
+        return html, make_state(text, html, record, language, style, linenos)
+
+
+def find_restart(lines, head, steps, record):
+    """
+    Return the last checkpoint from which lexing does not depend on the lines from `head` on:
+    `steps` lines that are not blank lie between them.
+    """
+    line = head
+    while steps and line > 0:
+        line -= 1
+        if lines[line].strip():
+            steps -= 1
+    return record.before(line if not steps else 0)
+
+
+def rerender(previous_code, previous_html, previous_state, code, language, style, linenos=False):
+    """
+    Render `code`, an edit of `previous_code`, by lexing again only what the edit changed.
+
+    Returns `(html, state)` as `render()` does, or `None` if the previous state
+    does not describe `previous_code` and `previous_html` rendered with the same inputs.
+    """
+    try:
+        state = json.loads(previous_state)
+    except ValueError:
+        return None
+    lexer = get_lexer_by_name(language)
+    if (state.get('version') != STATE_VERSION or state['pygments'] != pygments.__version__
+            or state['inputs'] != [language, style, linenos] or not is_resumable(lexer)):
+        return None
+    previous_text = lexer._preprocess_lexer_input(previous_code)
+    if state['text'] != digest(previous_text) or state['html'] != digest(previous_html):
+        return None
+    options = get_formatter_options(style, linenos)
+    previous_lines = previous_text.split('\n')[:-1]
+    previous_html_lines = split_lines(previous_html, len(previous_lines), options)
+    if previous_html_lines is None:
+        return None
+
+    with instrumentation.phase('highlight'):
+        analysis = analyze(type(lexer))
+        text = lexer._preprocess_lexer_input(code)
+        lines = text.split('\n')[:-1]
+        # The edit replaced lines [head, len(lines) - tail) of the previous ones.
+        head = 0
+        limit = min(len(lines), len(previous_lines))
+        while head < limit and lines[head] == previous_lines[head]:
+            head += 1
+        tail = 0
+        while tail < limit - head and lines[-1 - tail] == previous_lines[-1 - tail]:
+            tail += 1
+        shift = len(lines) - len(previous_lines)
+        # Lookbehinds of the first line resumed from must only see unchanged lines.
+        unchanged_from = len(lines) - tail + analysis.back
+
+        previous_record = Record.load(state['record'])
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line) + 1)
+        start, stack = find_restart(lines, head, analysis.steps, previous_record)
+        # A delimiter the edit closes makes a pattern that failed before it match.
+        reopened = True
+        while reopened:
+            reopened = False
+            for line, column, name, index in previous_record.failures:
+                if line >= start:
+                    break
+                if lexer._tokens[name][index][0](text, offsets[line] + column):
+                    start, stack = find_restart(lines, line, analysis.steps, previous_record)
+                    reopened = True
+                    break
+
+        converged = []
+
+        def stop(line, stack):
+            if line >= unchanged_from and line > start and previous_record.get(line - shift) == stack:
+                converged.append(line)
+                return True
+            return False
+
+        record = Record()
+        record.extend(previous_record, stop=start)
+        tokens = list(tokenize(lexer, text, record, offsets[start], stack, start, stop))
+        html_lines = previous_html_lines[:start]
+        html_lines.extend(line + '\n' for line in format_tokens(tokens, options, nowrap=True).split('\n')[:-1])
+        if converged:
+            end = converged[0]
+            html_lines.extend(previous_html_lines[end - shift:])
+            record.extend(previous_record, start=end - shift, shift=shift)
+        html = wrap_lines(html_lines, options)
+        return html, make_state(text, html, record, language, style, linenos)
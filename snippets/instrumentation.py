@@ -0,0 +1,304 @@
+"""
+Per-request timings, query counts and response sizes.
+
+`InstrumentationMiddleware` times every request, and the phases recorded within
+it by `phase()`:
+
+    db            every query, through a wrapper on each database connection
+    auth          authentication of API views (`InstrumentedViewMixin`)
+    permissions   permission checks of API views, `IsOwnerOrReadOnly` included
+    serialize     `InstrumentedSerializerMixin` serializers and compiled ones
+    highlight     Pygments, in this process
+    render        rendering API responses
+
+Phases are inclusive: queries run while serializing count towards both 'db'
+and 'serialize'. The timings go out in a `Server-Timing` header, in a log
+record on the 'snippets.requests' logger, with the fields in its `metrics`
+attribute, and into per-route histograms that `metrics_view` serves in the
+Prometheus text format. Recording a phase costs a context variable lookup and
+two clock reads, so it can stay on in production (`SNIPPETS_INSTRUMENTATION`).
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.views.decorators.http import require_safe
+
+from . import responsecache
+
+logger = logging.getLogger('snippets.requests')
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = contextvars.ContextVar('snippets_timings', default=None)
+
+
+class Timings:
+    """
+    The phases of one request: their total durations in seconds, and how often each was entered.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        self.active = set()
+
+    def add(self, name, duration):
+        self.durations[name] += duration
+        self.counts[name] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def get_header(self, total):
+        parts = []
+        for name, duration in self.durations.items():
+            part = '%s;dur=%.2f' % (name, duration * 1000)
+            if name == 'db':
+                part += ';desc="%d queries"' % self.counts[name]
+            parts.append(part)
+        parts.append('total;dur=%.2f' % (total * 1000))
+        return ', '.join(parts)
+
+
+class phase:
+    """
+    Record the time spent in the block as `name` in the current request, if any.
+    A phase entered again within itself, e.g. by a nested serializer, counts once.
+    """
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        timings = _timings.get()
+        if timings is None or self.name in timings.active:
+            self.timings = None
+            return
+        self.timings = timings
+        timings.active.add(self.name)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.start)
+            self.timings.active.discard(self.name)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # First, so that the wrappers `connection.execute_wrapper()` pushes and pops stay on top.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.buckets[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Aggregates of the requests served by this process, per route.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latency = defaultdict(Histogram)
+        self.responses = Counter()
+        self.phases = Counter()
+        self.queries = Counter()
+        self.bytes = Counter()
+
+    def observe(self, route, method, status, total, timings, size):
+        with self.lock:
+            self.latency[route, method].observe(total)
+            self.responses[route, method, status] += 1
+            for name, duration in timings.durations.items():
+                self.phases[route, name] += duration
+            self.queries[route] += timings.counts['db']
+            self.bytes[route] += size
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.extend(['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind)])
+
+        def sample(name, labels, value):
+            label_text = ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for key, label in labels)
+            lines.append('%s{%s} %s' % (name, label_text, repr(float(value)) if isinstance(value, float) else value))
+
+        with self.lock:
+            family('snippets_request_duration_seconds', 'histogram', 'Request latency per route.')
+            for (route, method), histogram in sorted(self.latency.items()):
+                labels = [('route', route), ('method', method)]
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+                    cumulative += count
+                    sample('snippets_request_duration_seconds_bucket', labels + [('le', bound)], cumulative)
+                sample('snippets_request_duration_seconds_sum', labels, histogram.sum)
+                sample('snippets_request_duration_seconds_count', labels, histogram.count)
+            family('snippets_responses_total', 'counter', 'Responses per route and status code.')
+            for (route, method, status), count in sorted(self.responses.items()):
+                sample('snippets_responses_total', [('route', route), ('method', method), ('status', status)], count)
+            family('snippets_request_phase_seconds_total', 'counter', 'Time spent per route in each phase.')
+            for (route, name), duration in sorted(self.phases.items()):
+                sample('snippets_request_phase_seconds_total', [('route', route), ('phase', name)], duration)
+            family('snippets_queries_total', 'counter', 'Database queries per route.')
+            for route, count in sorted(self.queries.items()):
+                sample('snippets_queries_total', [('route', route)], count)
+            family('snippets_response_bytes_total', 'counter', 'Response body bytes sent per route.')
+            for route, size in sorted(self.bytes.items()):
+                sample('snippets_response_bytes_total', [('route', route)], size)
+        family('snippets_response_cache_total', 'counter', 'Response cache lookups per view and outcome.')
+        for key, count in sorted(responsecache.get_stats().items()):
+            if '.' in key:
+                view, outcome = key.split('.', 1)
+                sample('snippets_response_cache_total', [('view', view), ('outcome', outcome)], count)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match.route
+
+
+def count_bytes(chunks, finish):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        finish(size)
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'SNIPPETS_INSTRUMENTATION', True):
+            return self.get_response(request)
+        timings = Timings()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        response['Server-Timing'] = timings.get_header(timings.elapsed())
+        if response.streaming:
+            # Streamed bodies are produced after the view returns: record the request once sent.
+            response.streaming_content = count_bytes(
+                response.streaming_content, lambda size: self.finish(request, response, timings, size))
+        else:
+            self.finish(request, response, timings, len(response.content))
+        return response
+
+    def finish(self, request, response, timings, size):
+        total = timings.elapsed()
+        route = get_route(request)
+        metrics.observe(route, request.method, response.status_code, total, timings, size)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'queries': timings.counts['db'],
+            'bytes': size,
+            'phases': {name: round(duration * 1000, 2) for name, duration in timings.durations.items()},
+        }
+        logger.info('%s %s %s %.1fms', request.method, request.path, response.status_code, total * 1000,
+                    extra={'metrics': record})
+
+
+class InstrumentedViewMixin:
+    """
+    Record the authentication, permission checks and rendering of an API view.
+    """
+
+    def perform_authentication(self, request):
+        with phase('auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with phase('permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with phase('permissions'):
+            super().check_object_permissions(request, obj)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Render here rather than in the handler, so that the time is recorded.
+        with phase('render'):
+            response = super().finalize_response(request, response, *args, **kwargs)
+            if not getattr(response, 'is_rendered', True):
+                response.render()
+        return response
+
+
+class InstrumentedSerializerMixin:
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Serve the aggregated metrics of this process to staff and to `SNIPPETS_METRICS_ALLOWED_IPS`.
+    """
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.SNIPPETS_METRICS_ALLOWED_IPS):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
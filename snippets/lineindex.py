@@ -0,0 +1,82 @@
+"""
+Windows of lines of highlighted snippets, for `?lines=<first>-<last>` of the highlight views.
+
+The formatter emits one line of HTML per line of code (see `snippets.incremental`),
+so a window is a slice of the stored HTML, wrapped again with its own line numbers.
+Where each line starts in the HTML is indexed when it is stored
+(`Snippet.line_index`), so that a window reads two offsets of the index rather
+than scanning the document for its lines.
+"""
+import functools
+import os
+import re
+import struct
+
+from . import highlighting
+from .incremental import get_formatter_options, wrap_lines
+
+# The index is packed as little-endian 32-bit offsets, one per line and one past the last.
+OFFSET = struct.Struct('<I')
+LINES = re.compile(r'(\d+)(?:-(\d+))?')
+NEWLINE = re.compile('\n')
+
+
+@functools.lru_cache(maxsize=None)
+def get_wrapper(style, linenos):
+    """
+    Return the HTML the formatter puts right before the first line of code and after the last one.
+    """
+    options = get_formatter_options(style, linenos)
+    one, two = wrap_lines(['\x00\n'], options), wrap_lines(['\x00\n'] * 2, options)
+    # Line numbers come before the code: what precedes it regardless of their count is the same.
+    head = os.path.commonprefix([one[:one.find('\x00')][::-1], two[:two.find('\x00')][::-1]])[::-1]
+    return head, one[one.rfind('\x00') + 2:]
+
+
+def parse_lines(value):
+    """
+    Return the lines of a `<first>-<last>` (or `<line>`) range counted from 1, as
+    `(start, stop)` counted from 0 with `stop` excluded, or `None` if it is no range.
+    """
+    match = LINES.fullmatch(value)
+    if match is None:
+        return None
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    if not 1 <= first <= last:
+        return None
+    return first - 1, last
+
+
+def build(html, code, language, style, linenos):
+    """
+    Return the index of the lines of `html`, the rendering of the other arguments,
+    or `b''` if it does not wrap them as `highlighting.render()` does.
+    """
+    count = highlighting.count_lines(code, language)
+    head, tail = get_wrapper(style, linenos)
+    # The code is escaped, so the first occurrence of `head` is the formatter's.
+    start = html.find(head)
+    if start < 0 or not html.endswith(tail):
+        return b''
+    start, end = start + len(head), len(html) - len(tail)
+    offsets = [start]
+    offsets.extend(match.end() for match in NEWLINE.finditer(html, start, end))
+    if len(offsets) != count + 1 or offsets[-1] != end:
+        return b''
+    return struct.pack('<%dI' % len(offsets), *offsets)
+
+
+def get_line_count(index):
+    return len(index) // OFFSET.size - 1
+
+
+def render_window(html, index, start, stop, style, linenos):
+    """
+    Return lines `start` to `stop` (excluded) of `html`, as `highlighting.render_lines()` renders them.
+    """
+    stop = min(stop, get_line_count(index))
+    first, = OFFSET.unpack_from(index, start * OFFSET.size)
+    last, = OFFSET.unpack_from(index, stop * OFFSET.size)
+    lines = [line + '\n' for line in html[first:last].split('\n')[:-1]]
+    return wrap_lines(lines, dict(get_formatter_options(style, linenos), linenostart=start + 1))
@@ -0,0 +1,195 @@
+"""
+A reproducible load test of the snippets API, for catching performance regressions.
+
+Each scenario (list, detail, highlight, create, update) is a fixed sequence of
+requests, drawn from a seeded random generator, sent through the project's
+URLconf either in-process with the test client or over HTTP to a server on a
+local port. Per scenario, the report holds latency percentiles, throughput and
+queries per request, taken from the `Server-Timing` header of
+`snippets.instrumentation`. `compare()` checks a report against a baseline.
+"""
+import http.client
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import Client
+
+from .benchmarks import LANGUAGE_MIX, make_code, percentile
+
+SCENARIOS = ['list', 'detail', 'highlight', 'create', 'update']
+QUERIES = re.compile(r'(?:^|, )db;[^,]*desc="(\d+) queries"')
+JSON = 'application/json'
+
+
+def build_requests(scenario, count, rng, pks, own_pks):
+    """
+    Return `count` requests of `scenario` as `(method, path, body, accept)`; writes go to `own_pks`.
+    """
+    requests = []
+    for _ in range(count):
+        if scenario == 'list':
+            path = rng.choice(['/snippets/', '/snippets/?page_size=50',
+                               '/snippets/?language=%s' % rng.choice(LANGUAGE_MIX)[0]])
+            requests.append(('GET', path, None, JSON))
+        elif scenario == 'detail':
+            requests.append(('GET', '/snippets/%d/' % rng.choice(pks), None, JSON))
+        elif scenario == 'highlight':
+            requests.append(('GET', '/snippets/%d/highlight/' % rng.choice(pks), None, 'text/html'))
+        elif scenario == 'create':
+            language = rng.choice(LANGUAGE_MIX)[0]
+            body = {'title': 'Load test', 'code': make_code(rng, language), 'language': language}
+            requests.append(('POST', '/snippets/', body, JSON))
+        elif scenario == 'update':
+            body = {'code': make_code(rng, 'python')}
+            requests.append(('PATCH', '/snippets/%d/' % rng.choice(own_pks), body, JSON))
+        else:
+            raise ValueError('Unknown scenario %r' % scenario)
+    return requests
+
+
+class InProcessTransport:
+    """
+    Send requests through the test client, one per thread, logged in as `user`.
+    """
+    name = 'in-process'
+
+    def __init__(self, user):
+        self.user = user
+        self.local = threading.local()
+        self.session = None
+
+    def start(self):
+        # Log in once: threads logging in together would write the session table at the same time.
+        client = Client()
+        client.force_login(self.user)
+        self.session = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def stop(self):
+        pass
+
+    def get_client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+            self.local.client.cookies[settings.SESSION_COOKIE_NAME] = self.session
+        return self.local.client
+
+    def request(self, method, path, body, accept):
+        data = None if body is None else json.dumps(body)
+        response = self.get_client().generic(method, path, data or '', content_type=JSON, HTTP_ACCEPT=accept)
+        return response.status_code, response.get('Server-Timing', '')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPTransport:
+    """
+    Serve the project's WSGI application on a local port, and send requests to it over HTTP.
+    """
+    name = 'http'
+    # `setup_test_environment()` only allows this host.
+    host = 'testserver'
+
+    def __init__(self, user):
+        self.user = user
+        self.server = None
+
+    def start(self):
+        self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        self.server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        client = Client()
+        client.force_login(self.user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        # Unsafe requests of a logged in session need a CSRF token, as a browser would hold.
+        status, headers, _ = self.send('GET', '/api-auth/login/', None, 'text/html', {})
+        token = re.search(r'%s=([^;]+)' % re.escape(settings.CSRF_COOKIE_NAME), headers.get('Set-Cookie', '')).group(1)
+        cookies = {settings.SESSION_COOKIE_NAME: session, settings.CSRF_COOKIE_NAME: token}
+        self.headers = {'Cookie': '; '.join('%s=%s' % cookie for cookie in cookies.items()), 'X-CSRFToken': token}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send(self, method, path, body, accept, headers):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2])
+        try:
+            headers = dict(headers, Host=self.host, Accept=accept)
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = JSON
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            content = response.read()
+            return response.status, response.headers, content
+        finally:
+            connection.close()
+
+    def request(self, method, path, body, accept):
+        status, headers, _ = self.send(method, path, body, accept, self.headers)
+        return status, headers.get('Server-Timing', '')
+
+
+def run(transport, requests, concurrency):
+    """
+    Send `requests` through `transport` from `concurrency` threads, and summarize the responses.
+    """
+    def send(request):
+        start = time.perf_counter()
+        status, server_timing = transport.request(*request)
+        elapsed = (time.perf_counter() - start) * 1000
+        match = QUERIES.search(server_timing)
+        return elapsed, status, int(match.group(1)) if match else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - start
+    timings = [timing for timing, _, _ in outcomes]
+    queries = [count for _, _, count in outcomes if count is not None]
+    return {
+        'requests': len(requests),
+        'errors': sum(1 for _, status, _ in outcomes if status >= 400),
+        'throughput': round(len(requests) / elapsed, 1),
+        'p50': round(percentile(timings, 50), 2),
+        'p95': round(percentile(timings, 95), 2),
+        'p99': round(percentile(timings, 99), 2),
+        # Medians and maxima are stable across runs, whatever the caches served; means are not.
+        'queries': statistics.median(queries) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return the regressions of `report` against `baseline`: a p95 latency or throughput worse
+    by more than `tolerance` (a fraction), or more queries per request, at the median or at most.
+    """
+    regressions = []
+    for transport, scenarios in report['results'].items():
+        for scenario, result in scenarios.items():
+            base = baseline.get('results', {}).get(transport, {}).get(scenario)
+            if base is None:
+                continue
+            label = '%s %s' % (transport, scenario)
+            # Below a millisecond, differences are noise.
+            if result['p95'] > base['p95'] * (1 + tolerance) and result['p95'] - base['p95'] > 1:
+                regressions.append('%s: p95 %.2f ms, baseline %.2f ms' % (label, result['p95'], base['p95']))
+            if result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append('%s: %.1f req/s, baseline %.1f req/s' % (
+                    label, result['throughput'], base['throughput']))
+            for key, description in [('queries', 'median queries'), ('max_queries', 'most queries')]:
+                if None not in (result.get(key), base.get(key)) and result[key] > base[key]:
+                    regressions.append('%s: %s per request %s, baseline %s' % (
+                        label, description, result[key], base[key]))
+    return regressions
@@ -0,0 +1,87 @@
+import json
+import os
+import random
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets import loadtest
+from snippets.benchmarks import benchmark_database, seed_realistic
+from snippets.highlighting import get_render_cache
+from snippets.models import Snippet
+
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'benchmark_baseline.json')
+
+
+class Command(BaseCommand):
+    help = ('Load test the list, detail, highlight, create and update endpoints in-process and over '
+            'HTTP, and compare the latency, throughput and queries per request with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--snippets', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scenario', action='append', choices=loadtest.SCENARIOS,
+                            help='Run only this scenario; repeatable.')
+        parser.add_argument('--transport', action='append', choices=['in-process', 'http'],
+                            help='Run only over this transport; repeatable.')
+        parser.add_argument('--baseline', default=BASELINE, help='Baseline report to compare with.')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this report as the baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Latency and throughput change, as a fraction, reported as a regression.')
+
+    def get_config(self, options):
+        return {name: options[name] for name in ('users', 'snippets', 'requests', 'concurrency', 'seed')}
+
+    def handle(self, *args, **options):
+        config = self.get_config(options)
+        scenarios = options['scenario'] or loadtest.SCENARIOS
+        names = options['transport'] or ['in-process', 'http']
+        report = {'config': config, 'results': {}}
+        for transport_class in [loadtest.InProcessTransport, loadtest.HTTPTransport]:
+            if transport_class.name not in names:
+                continue
+            # A fresh database per transport, so that both see the same data and requests.
+            with benchmark_database():
+                owners = seed_realistic(options['snippets'], options['users'], seed=options['seed'])
+                pks = list(Snippet.objects.order_by('pk').values_list('pk', flat=True))
+                own_pks = [pk for pk in pks if pk % len(owners) == pks[0] % len(owners)]
+                for cache in caches.all():
+                    cache.clear()
+                get_render_cache().clear()
+                transport = transport_class(owners[0])
+                transport.start()
+                try:
+                    rng = random.Random(options['seed'])
+                    results = report['results'][transport.name] = {}
+                    for scenario in scenarios:
+                        requests = loadtest.build_requests(scenario, options['requests'], rng, pks, own_pks)
+                        results[scenario] = loadtest.run(transport, requests, options['concurrency'])
+                        self.write_result(transport.name, scenario, results[scenario])
+                finally:
+                    transport.stop()
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write('Saved the baseline to %s' % options['baseline'])
+            return
+        if not os.path.exists(options['baseline']):
+            return
+        with open(options['baseline']) as file:
+            baseline = json.load(file)
+        if baseline.get('config') != config:
+            self.stderr.write('The baseline was run with %s; comparing anyway.' % baseline.get('config'))
+        regressions = loadtest.compare(report, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Regressions against %s:\n  %s' % (options['baseline'], '\n  '.join(regressions)))
+        self.stdout.write('No regressions against %s' % options['baseline'])
+
+    def write_result(self, transport, scenario, result):
+        self.stdout.write(
+            '%-10s %-9s %7.1f req/s  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  queries %s (max %s)  %d errors' % (
+                transport, scenario, result['throughput'], result['p50'], result['p95'], result['p99'],
+                result['queries'], result['max_queries'], result['errors']))
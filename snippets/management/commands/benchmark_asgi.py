@@ -0,0 +1,78 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from snippets.benchmarks import benchmark_database, seed, summarize_latency
+from snippets.models import RENDER_PENDING, Snippet
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of concurrent requests to the sync endpoints through the WSGI '
+            'handler (one thread per concurrent request) and to the async ones through the ASGI handler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Snippets to seed.')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--pending', type=float, default=0.05,
+                            help='Share of requests for highlights that are still pending.')
+
+    def get_paths(self, prefix, count, pending):
+        rng = random.Random(0)
+        pks = list(Snippet.objects.values_list('pk', flat=True)[:1000])
+        pending_pks = list(Snippet.objects.filter(render_status=RENDER_PENDING).values_list('pk', flat=True))
+        paths = []
+        for _ in range(count):
+            roll = rng.random()
+            if roll < pending:
+                paths.append('%s/snippets/%d/highlight/' % (prefix, rng.choice(pending_pks)))
+            elif roll < 0.5:
+                paths.append('%s/snippets/%d/' % (prefix, rng.choice(pks)))
+            else:
+                paths.append('%s/snippets/?page_size=20' % prefix)
+        return paths
+
+    def run_wsgi(self, paths, concurrency):
+        def fetch(path):
+            start = time.perf_counter()
+            response = Client().get(path, HTTP_ACCEPT='application/json, text/html')
+            assert response.status_code == 200, (path, response.status_code)
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(fetch, paths))
+
+    async def run_asgi(self, paths, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(path):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await AsyncClient().get(path, Accept='application/json, text/html')
+                assert response.status_code == 200, (path, response.status_code)
+                return (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*[fetch(path) for path in paths])
+
+    def handle(self, *args, **options):
+        count, concurrency = options['requests'], options['concurrency']
+        # Measure the views, not the response cache in front of them.
+        with override_settings(SNIPPETS_RESPONSE_CACHE=None):
+            with benchmark_database():
+                seed(options['rows'])
+                # Distinct code, so that every pending highlight is a render cache miss.
+                for snippet in Snippet.objects.all()[:count]:
+                    Snippet.objects.filter(pk=snippet.pk).update(
+                        code='%s\n# %d\n' % (snippet.code * 20, snippet.pk), render_status=RENDER_PENDING)
+                for label, prefix, run in [('wsgi, sync views', '', self.run_wsgi),
+                                           ('asgi, async views', '/async', async_to_sync(self.run_asgi))]:
+                    paths = self.get_paths(prefix, count, options['pending'])
+                    start = time.perf_counter()
+                    timings = run(paths, concurrency)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write('%-18s %7.1f req/s  %s' % (label, count / elapsed, summarize_latency(timings)))
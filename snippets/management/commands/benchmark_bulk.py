@@ -0,0 +1,47 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from snippets.benchmarks import SAMPLE_CODE, benchmark_database
+from snippets.highlighting import get_render_cache
+from snippets.models import Snippet
+
+
+class Command(BaseCommand):
+    help = 'Compare importing snippets one POST at a time with the bulk endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--batch', type=int, default=1000, help='Items per bulk request.')
+
+    def handle(self, *args, **options):
+        rows, batch = options['rows'], options['batch']
+        # Distinct code, so that every item is a render cache miss.
+        items = [{'title': 'Snippet %d' % index, 'code': '%s\nprint(%d)\n' % (SAMPLE_CODE, index)}
+                 for index in range(rows)]
+        with benchmark_database():
+            client = Client()
+            client.force_login(User.objects.create_user('benchmark'))
+
+            get_render_cache().clear()
+            start = time.perf_counter()
+            for item in items:
+                client.post('/snippets/', json.dumps(item), content_type='application/json')
+            single = time.perf_counter() - start
+            Snippet.objects.all().delete()
+
+            get_render_cache().clear()
+            start = time.perf_counter()
+            for offset in range(0, rows, batch):
+                response = client.post('/snippets/bulk/', json.dumps(items[offset:offset + batch]),
+                                       content_type='application/json')
+                assert response.status_code == 201, response.content[:500]
+            bulk = time.perf_counter() - start
+            assert Snippet.objects.exclude(highlighted='').count() == rows
+
+        self.stdout.write('%d snippets' % rows)
+        self.stdout.write('  one by one  %8.2f s  %8.0f rows/s' % (single, rows / single))
+        self.stdout.write('  bulk        %8.2f s  %8.0f rows/s  (%.1fx)' % (bulk, rows / bulk, single / bulk))
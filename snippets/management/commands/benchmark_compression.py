@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from snippets import compression
+from snippets.benchmarks import benchmark_database, measure, seed_realistic, summarize
+from snippets.models import Snippet
+
+
+class Command(BaseCommand):
+    help = ('Compare the size of highlighted HTML as text, deflated and deflated with the preset dictionary, '
+            'and the latency of reading snippets with and without decompressing it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snippets', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_realistic(options['snippets'], seed=options['seed'])
+            stored = list(Snippet.objects.values_list('highlighted', flat=True))
+            texts = [value.decompress() for value in stored]
+            small = [index for index, text in enumerate(texts) if len(text) < 4096]
+            sizes = [
+                ('text', [len(text.encode('utf-8')) for text in texts]),
+                ('deflated', [len(compression.compress(text)) for text in texts]),
+                ('deflated, dictionary', [len(value) for value in stored]),
+            ]
+            self.stdout.write('%d snippets, %d under 4 KB of HTML' % (len(texts), len(small)))
+            for label, lengths in sizes:
+                self.stdout.write('  %-24s %12d bytes  %10d under 4 KB' % (
+                    label, sum(lengths), sum(lengths[index] for index in small)))
+
+            timings = [
+                ('load, HTML unread', lambda: [snippet.pk for snippet in Snippet.objects.all()]),
+                ('load, HTML read', lambda: [snippet.highlighted for snippet in Snippet.objects.all()]),
+                ('list columns only', lambda: list(Snippet.objects.only('id', 'title', 'code', 'language'))),
+                ('decompress', lambda: [value.decompress() for value in stored]),
+            ]
+            for label, function in timings:
+                self.stdout.write('  %-24s %s' % (label, summarize(measure(function, options['repeat']))))
@@ -0,0 +1,51 @@
+import gzip
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from snippets.benchmarks import benchmark_database, seed_realistic
+from snippets.models import Snippet
+
+
+class Command(BaseCommand):
+    help = ('Compare the bytes sent and the CPU time per request of cached highlight pages and snippet lists, '
+            'sent as is, compressed once when cached, and gzipped on every request as GZipMiddleware would.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snippets', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=500)
+
+    def fetch(self, client, urls, accept_encoding, compress=None):
+        sent = 0
+        start = time.process_time()
+        for url in urls:
+            response = client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+            content = compress(response.content) if compress else response.content
+            sent += len(content)
+        return sent, (time.process_time() - start) * 1000 / len(urls)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_realistic(options['snippets'], seed=options['seed'])
+            caches['responses'].clear()
+            client = Client()
+            pks = list(Snippet.objects.order_by('pk').values_list('pk', flat=True)[:options['requests']])
+            workloads = [
+                ('highlight', ['/snippets/%d/highlight/' % pk for pk in pks]),
+                ('list', ['/snippets/?format=json&page=%d' % (index % 20 + 1) for index in range(len(pks))]),
+            ]
+            for label, urls in workloads:
+                # Fill the cache, with every encoding, before measuring.
+                self.fetch(client, urls, '')
+                self.stdout.write('%s, %d requests' % (label, len(urls)))
+                for name, accept_encoding, compress in [
+                    ('identity', '', None),
+                    ('gzip per request', '', lambda content: gzip.compress(content, compresslevel=6)),
+                    ('gzip, precompressed', 'gzip', None),
+                    ('br, precompressed', 'br, gzip', None),
+                ]:
+                    sent, cpu = self.fetch(client, urls, accept_encoding, compress)
+                    self.stdout.write('  %-22s %12d bytes  %8.3f ms CPU per request' % (name, sent, cpu))
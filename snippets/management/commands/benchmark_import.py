@@ -0,0 +1,60 @@
+import statistics
+import subprocess
+import sys
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from snippets.registry import registry
+
+# Django imports models through `importlib.import_module()`, which `-X importtime`
+# does not report, so the probe times that function instead.
+PROBE = """
+import importlib, time
+import_module = importlib.import_module
+def timed_import(name, package=None):
+    start = time.perf_counter()
+    module = import_module(name, package)
+    if name == 'snippets.models':
+        print('models', time.perf_counter() - start)
+    return module
+importlib.import_module = timed_import
+start = time.perf_counter()
+import django
+django.setup()
+print('setup', time.perf_counter() - start)
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure the cold import time of snippets.models and the cost of building the registry.'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to start.')
+
+    def cold_import(self, runs):
+        """
+        Return the import time of `snippets.models` and of `django.setup()` per run, in ms.
+        """
+        times = {'models': [], 'setup': []}
+        env = {'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE, 'PATH': ''}
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-c', PROBE], cwd=settings.BASE_DIR,
+                                    env=env, capture_output=True, text=True, check=True)
+            for line in result.stdout.splitlines():
+                name, seconds = line.split()
+                times[name].append(float(seconds) * 1000)
+        return times['models'], times['setup']
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+        models_times, setup_times = self.cold_import(runs)
+        self.stdout.write('import snippets.models:  median %7.1f ms  min %7.1f ms' % (
+            statistics.median(models_times), min(models_times)))
+        self.stdout.write('django.setup():          median %7.1f ms  min %7.1f ms' % (
+            statistics.median(setup_times), min(setup_times)))
+        for label, use_snapshot in (('registry from snapshot', True), ('registry from scan', False)):
+            seconds = min(timeit.repeat(lambda: registry.load(use_snapshot), number=1, repeat=runs))
+            self.stdout.write('%-24s min %7.1f ms' % (label + ':', seconds * 1000))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from snippets import highlighting, incremental
+from snippets.benchmarks import CODE_LINES, measure, summarize
+
+EDITS = [
+    ('change a middle line', lambda lines: lines[:len(lines) // 2] + ['x = 1'] + lines[len(lines) // 2 + 1:]),
+    ('insert a first line', lambda lines: ['// first'] + lines),
+    ('append a line', lambda lines: lines + ['end']),
+    ('open a comment at the middle', lambda lines: lines[:len(lines) // 2] + ['/* open'] + lines[len(lines) // 2:]),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare highlighting edits of large snippets in full with incremental re-highlighting.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=20000, help='Lines of code per snippet.')
+        parser.add_argument('--language', action='append', dest='languages',
+                            help='Language to benchmark; repeat for several. Defaults to all sampled ones.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        count, repeat = options['lines'], options['repeat']
+        for language in options['languages'] or sorted(CODE_LINES):
+            sample = CODE_LINES[language]
+            lines = [sample[index % len(sample)].format(n=index) for index in range(count)]
+            code = '\n'.join(lines) + '\n'
+            html, state = incremental.render(code, language, 'friendly')
+            if not state:
+                self.stdout.write('%-12s not resumable, edits are highlighted in full' % language)
+                continue
+            self.stdout.write('%-12s %d lines, state %d bytes' % (language, count, len(state)))
+            for label, edit in EDITS:
+                edited = '\n'.join(edit(lines)) + '\n'
+                full = measure(lambda: highlighting.render(edited, language, 'friendly'), repeat)
+                partial = measure(lambda: incremental.rerender(code, html, state, edited, language, 'friendly'), repeat)
+                self.stdout.write('  %-30s full %s' % (label, summarize(full)))
+                self.stdout.write('  %-30s incr %s' % ('', summarize(partial)))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from snippets.benchmarks import benchmark_database, measure, seed, summarize
+from snippets.models import Snippet
+from snippets.pagination import SnippetPagination
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET and keyset pagination of snippets on page 1 and on a deep page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Snippets to seed.')
+        parser.add_argument('--page', type=int, default=10000, help='Deep page to fetch, 2 or more: page 1 is always fetched.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def fetch(self, paginator, params):
+        request = Request(APIRequestFactory().get('/snippets/', params))
+        return lambda: paginator.paginate_queryset(Snippet.objects.all(), request)
+
+    def handle(self, *args, **options):
+        page, repeat = options['page'], options['repeat']
+        # The deep page is reached with the cursor of the last row of the page before it.
+        if page < 2:
+            raise CommandError('--page must be 2 or more: page 1 is always fetched, and has no cursor.')
+        if (page - 1) * SnippetPagination.page_size >= options['rows']:
+            raise CommandError('--page %d is past the last page of %d rows.' % (page, options['rows']))
+        with benchmark_database():
+            self.stdout.write('Seeding %d snippets...' % options['rows'])
+            seed(options['rows'])
+
+            keyset = SnippetPagination()
+            # The cursor a client would hold after walking to the page before `page`.
+            offset = (page - 1) * keyset.page_size
+            last = Snippet.objects.order_by('created', 'id')[offset - 1]
+            keyset.base_url = 'http://testserver/snippets/'
+            keyset.ordering = SnippetPagination.ordering
+            cursor = keyset.encode_cursor(keyset.get_position(last), reverse=False).split('cursor=')[1]
+
+            cases = [
+                ('offset, page 1', PageNumberPagination(), {}),
+                ('offset, page %d' % page, PageNumberPagination(), {'page': page}),
+                ('keyset, page 1', SnippetPagination(), {}),
+                ('keyset, page %d' % page, SnippetPagination(), {'cursor': cursor}),
+                ('keyset, page %d, no count' % page, SnippetPagination(), {'cursor': cursor, 'count': 'false'}),
+            ]
+            for label, paginator, params in cases:
+                timings = measure(self.fetch(paginator, params), repeat)
+                self.stdout.write('%-28s %s' % (label, summarize(timings)))
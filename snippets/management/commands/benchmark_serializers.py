@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from snippets.benchmarks import benchmark_database, measure, seed, summarize
+from snippets.compiled import CompiledSerializer
+from snippets.models import Snippet
+from snippets.serializers import SnippetHyperlinkedModelSerializer, UserHyperlinkedModelSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF serializers with their compiled form on list pages, and check the output is identical.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per page.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        with benchmark_database():
+            seed(rows, users=rows // 10)
+            # Ownerless snippets exercise the serializer's handling of a missing `owner.username`.
+            Snippet.objects.filter(pk__in=Snippet.objects.values('pk')[:rows // 10]).update(owner=None)
+            request = Request(APIRequestFactory().get('/snippets/'))
+            context = {'request': request, 'format': None}
+
+            cases = [
+                (SnippetHyperlinkedModelSerializer, Snippet.objects.all()),
+                (UserHyperlinkedModelSerializer, User.objects.all()),
+            ]
+            for serializer_class, queryset in cases:
+                queryset = queryset.order_by('pk')[:rows]
+
+                def serialize():
+                    page = list(serializer_class.setup_eager_loading(queryset))
+                    return serializer_class(page, many=True, context=context).data
+
+                def compiled():
+                    plan = CompiledSerializer(serializer_class(context=context))
+                    return plan.render(plan.prepare(queryset))
+
+                if JSONRenderer().render(serialize()) != JSONRenderer().render(compiled()):
+                    raise CommandError('%s: compiled output differs.' % serializer_class.__name__)
+                baseline, timings = measure(serialize, repeat), measure(compiled, repeat)
+                self.stdout.write('%s, %d rows (output identical)' % (serializer_class.__name__, rows))
+                self.stdout.write('  serializer  %s' % summarize(baseline))
+                self.stdout.write('  compiled    %s  (%.1fx)' % (summarize(timings), min(baseline) / min(timings)))
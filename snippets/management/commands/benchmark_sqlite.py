@@ -0,0 +1,85 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import Client, override_settings
+
+from snippets.benchmarks import benchmark_database, seed, summarize_latency
+from snippets.models import Snippet
+
+PROFILES = [
+    # label, SNIPPETS_SQLITE_PROFILE, CONN_MAX_AGE, SNIPPETS_WRITE_QUEUE
+    ('default', 'default', 0, False),
+    ('production', 'production', 600, True),
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of a concurrent mix of snippet reads and writes with the default '
+            'SQLite settings and with the production profile (WAL, persistent connections, write queue).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Snippets to seed.')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--writes', type=float, default=0.2, help='Share of requests creating a snippet.')
+
+    def get_requests(self, count, writes):
+        rng = random.Random(0)
+        pks = list(Snippet.objects.values_list('pk', flat=True)[:1000])
+        return [('post', None) if rng.random() < writes else ('get', rng.choice(pks)) for _ in range(count)]
+
+    def run(self, requests, concurrency):
+        owner = User.objects.get(username='benchmark-0')
+        # Log in up front, so that the session writes do not count as requests.
+        clients = queue.SimpleQueue()
+        for _ in range(concurrency):
+            client = Client()
+            client.force_login(owner)
+            clients.put(client)
+        local = threading.local()
+        errors = []
+
+        def fetch(request):
+            method, pk = request
+            if not hasattr(local, 'client'):
+                local.client = clients.get()
+            start = time.perf_counter()
+            try:
+                if method == 'post':
+                    response = local.client.post('/snippets/', {'code': 'print(%d)' % start})
+                    assert response.status_code == 201, response.status_code
+                else:
+                    response = local.client.get('/snippets/%d/' % pk)
+                    assert response.status_code == 200, response.status_code
+            except OperationalError as exc:
+                # "database is locked": the writer waited out the busy timeout.
+                errors.append(exc)
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(fetch, requests)), errors
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        for label, profile, max_age, write_queue in PROFILES:
+            # Measure the database, not the response cache in front of it.
+            with override_settings(SNIPPETS_SQLITE_PROFILE=profile, SNIPPETS_WRITE_QUEUE=write_queue,
+                                   SNIPPETS_RESPONSE_CACHE=None):
+                with benchmark_database():
+                    connection.settings_dict['CONN_MAX_AGE'] = max_age
+                    try:
+                        seed(options['rows'])
+                        requests = self.get_requests(count, options['writes'])
+                        start = time.perf_counter()
+                        timings, errors = self.run(requests, options['concurrency'])
+                        elapsed = time.perf_counter() - start
+                    finally:
+                        connection.settings_dict['CONN_MAX_AGE'] = 0
+                    self.stdout.write('%-11s %7.1f req/s  %s  %d errors' % (
+                        label, count / elapsed, summarize_latency(timings), len(errors)))
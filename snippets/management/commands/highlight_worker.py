@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from snippets import worker
+
+
+class Command(BaseCommand):
+    help = "Render snippets left pending by SNIPPETS_HIGHLIGHT_MODE = 'async'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Size of the rendering process pool (default: number of CPUs).')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of snippets claimed per batch.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+        parser.add_argument('--requeue', action='store_true',
+                            help='Requeue snippets left rendering by a stopped worker before starting.')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            count = worker.requeue_stale()
+            self.stdout.write('Requeued %d snippets.' % count)
+        rendered = worker.run(
+            processes=options['processes'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
+        self.stdout.write(self.style.SUCCESS('Rendered %d snippets.' % rendered))
@@ -0,0 +1,35 @@
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets import profiling
+
+
+class Command(BaseCommand):
+    help = ('Ask the running workers to profile themselves, for a number of seconds or for the next '
+            'requests to a route. Results appear in SNIPPETS_PROFILE_DIR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, help='Profile every request for this long, up to SNIPPETS_PROFILE_MAX_SECONDS.')
+        parser.add_argument('--route', help="URL name ('snippet-list') or view and action ('SnippetViewSet.create').")
+        parser.add_argument('--requests', type=int, help='Profile the next requests to --route.')
+        parser.add_argument('--pid', type=int, action='append', default=[],
+                            help='Signal this worker to start at once, rather than on its next request.')
+
+    def handle(self, *args, **options):
+        seconds, route, requests = options['seconds'], options['route'], options['requests']
+        if not seconds and not route:
+            raise CommandError('Give --seconds, or --route with --requests.')
+        if requests and not route:
+            raise CommandError('--requests needs a --route.')
+        if (seconds is not None and not seconds > 0) or (requests is not None and requests < 1):
+            raise CommandError('--seconds and --requests must be positive.')
+        if not settings.SNIPPETS_PROFILING:
+            self.stderr.write('SNIPPETS_PROFILING is off in these settings; workers need it on to profile.')
+        session = profiling.write_control(seconds=seconds, route=route, requests=requests)
+        for pid in options['pid']:
+            os.kill(pid, signal.SIGUSR2)
+        self.stdout.write('Requested session %s; results: %s' % (
+            session, os.path.join(settings.SNIPPETS_PROFILE_DIR, '%s-<pid>.{collapsed,prof}' % session)))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from snippets.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the snippet search index from the snippets table.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write('Rebuilt the %s index.' % backend.__class__.__name__)
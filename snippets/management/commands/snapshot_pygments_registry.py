@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from snippets import registry
+
+
+class Command(BaseCommand):
+    help = 'Write the snapshot of Pygments lexers and styles used to build snippet choices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='Snapshot path (default: SNIPPETS_REGISTRY_SNAPSHOT).')
+
+    def handle(self, *args, **options):
+        path = options['output'] or registry.get_snapshot_path()
+        data = registry.write_snapshot(path)
+        self.stdout.write(self.style.SUCCESS('Wrote %d languages and %d styles for Pygments %s to %s.' % (
+            len(data['languages']), len(data['styles']), data['pygments'], path)))
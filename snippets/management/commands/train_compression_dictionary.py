@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from pygments.lexers import get_lexer_for_filename
+from pygments.util import ClassNotFound
+
+from snippets import compression, highlighting
+from snippets.models import RENDER_DONE, Snippet
+
+
+class Command(BaseCommand):
+    help = ('Train a preset dictionary for compressing highlighted HTML, on the highlighted snippets '
+            'or on source files, and write it as its next version.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Source file or directory to highlight and train on; repeatable. '
+                                 'Defaults to the highlighted snippets in the database.')
+        parser.add_argument('--limit', type=int, default=1000, help='Most documents to train on.')
+        parser.add_argument('--size', type=int, default=compression.DICTIONARY_SIZE)
+        parser.add_argument('--name', default='highlighted', help='Dictionary name.')
+
+    def get_files(self, paths):
+        for path in paths:
+            if os.path.isfile(path):
+                yield path
+            for directory, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    yield os.path.join(directory, filename)
+
+    def render_files(self, paths, limit):
+        documents = []
+        for path in self.get_files(paths):
+            try:
+                lexer = get_lexer_for_filename(path)
+                with open(path, encoding='utf-8') as file:
+                    code = file.read()
+            except (ClassNotFound, UnicodeDecodeError):
+                continue
+            # As the snippets are highlighted; every fifth with line numbers.
+            documents.append(highlighting.render(code, lexer.aliases[0], 'friendly', len(documents) % 5 == 0))
+            if len(documents) == limit:
+                break
+        return documents
+
+    def handle(self, *args, **options):
+        if options['paths']:
+            documents = self.render_files(options['paths'], options['limit'])
+        else:
+            snippets = Snippet.objects.filter(render_status=RENDER_DONE).order_by('-updated').only('highlighted')
+            documents = [snippet.highlighted for snippet in snippets[:options['limit']]]
+        if not documents:
+            raise CommandError('Nothing to train on.')
+        dictionary = compression.train(documents, options['size'])
+        version = compression.get_latest_version(options['name']) + 1
+        path = compression.get_dictionary_path(options['name'], version)
+        with open(path, 'wb') as file:
+            file.write(dictionary)
+        compression.get_latest_version.cache_clear()
+        self.stdout.write(self.style.SUCCESS('Wrote %d bytes trained on %d documents to %s.' % (
+            len(dictionary), len(documents), path)))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0002_auto_20190826_0458'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='render_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('rendering', 'Rendering'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='done', max_length=10),
+        ),
+    ]
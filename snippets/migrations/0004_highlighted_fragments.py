@@ -0,0 +1,32 @@
+from django.db import migrations
+from pygments import highlight
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+
+def render(code, language, style, linenos):
+    # snippets.highlighting.render as of this migration, frozen so that later changes to it cannot change this one.
+    lexer = get_lexer_by_name(language)
+    formatter = HtmlFormatter(style=style, linenos='table' if linenos else False)
+    return highlight(code, lexer, formatter)
+
+
+def render_fragments(apps, schema_editor):
+    """
+    Re-render stored highlights as fragments, now that the stylesheet is served separately.
+    """
+    Snippet = apps.get_model('snippets', 'Snippet')
+    rows = Snippet.objects.filter(render_status='done').values_list('pk', 'code', 'language', 'style', 'linenos')
+    for pk, code, language, style, linenos in rows.iterator():
+        Snippet.objects.filter(pk=pk).update(highlighted=render(code, language, style, linenos))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0003_snippet_render_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_fragments, migrations.RunPython.noop),
+    ]
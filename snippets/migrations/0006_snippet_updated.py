@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:53
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created(apps, schema_editor):
+    """
+    Existing snippets were last written when they were created, as far as anyone knows.
+    """
+    Snippet = apps.get_model('snippets', 'Snippet')
+    Snippet.objects.update(updated=F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0005_snippet_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(copy_created, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0007_snippet_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['language', 'created', 'id'], name='snippet_language_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['style', 'created', 'id'], name='snippet_style_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['owner', 'created', 'id'], name='snippet_owner_created_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:59
+
+import sqlite3
+
+from django.db import migrations, models
+
+# The search index as of this migration, frozen here so that later changes to
+# snippets.search cannot change what the migration does.
+INSTALL = [
+    "CREATE VIRTUAL TABLE snippets_snippet_fts USING fts5(title, code, content='snippets_snippet', "
+    "content_rowid='id', tokenize='{tokenize}')",
+    "CREATE TRIGGER snippets_snippet_fts_insert AFTER INSERT ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_delete AFTER DELETE ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_update AFTER UPDATE OF title, code ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts) VALUES ('rebuild')",
+]
+UNINSTALL = [
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_insert',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_delete',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_update',
+    'DROP TABLE IF EXISTS snippets_snippet_fts',
+]
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Substring matches where SQLite has the trigram tokenizer, word prefixes otherwise.
+    tokenize = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+    for statement in INSTALL:
+        schema_editor.execute(statement.format(tokenize=tokenize))
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in UNINSTALL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0008_snippet_filter_indexes'),
+    ]
+
+    # SQLite adds the column by remaking the table, which drops the search index triggers.
+    operations = [
+        migrations.RunPython(uninstall, install),
+        migrations.AddField(
+            model_name='snippet',
+            name='highlight_state',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,135 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:12
+
+import functools
+import os
+import re
+import sqlite3
+import struct
+
+import pygments
+from django.db import migrations, models
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+# The search index as of this migration, frozen here so that later changes to
+# snippets.search cannot change what the migration does.
+INSTALL = [
+    "CREATE VIRTUAL TABLE snippets_snippet_fts USING fts5(title, code, content='snippets_snippet', "
+    "content_rowid='id', tokenize='{tokenize}')",
+    "CREATE TRIGGER snippets_snippet_fts_insert AFTER INSERT ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_delete AFTER DELETE ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_update AFTER UPDATE OF title, code ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts) VALUES ('rebuild')",
+]
+UNINSTALL = [
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_insert',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_delete',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_update',
+    'DROP TABLE IF EXISTS snippets_snippet_fts',
+]
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Substring matches where SQLite has the trigram tokenizer, word prefixes otherwise.
+    tokenize = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+    for statement in INSTALL:
+        schema_editor.execute(statement.format(tokenize=tokenize))
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in UNINSTALL:
+        schema_editor.execute(statement)
+
+
+# snippets.lineindex.build() as of this migration, frozen with what it uses so
+# that rows are indexed in the format this migration adds, whatever it becomes.
+NEWLINE = re.compile('\n')
+
+
+class LinesFormatter(HtmlFormatter):
+
+    def __init__(self, lines, **options):
+        super().__init__(**options)
+        self.lines = lines
+
+    def _format_lines(self, tokensource):
+        for line in self.lines:
+            yield 1, line
+
+
+def wrap_lines(lines, style, linenos):
+    return pygments.format(iter(()), LinesFormatter(lines, style=style, linenos='table' if linenos else False))
+
+
+@functools.lru_cache(maxsize=None)
+def get_wrapper(style, linenos):
+    one, two = wrap_lines(['\x00\n'], style, linenos), wrap_lines(['\x00\n'] * 2, style, linenos)
+    head = os.path.commonprefix([one[:one.find('\x00')][::-1], two[:two.find('\x00')][::-1]])[::-1]
+    return head, one[one.rfind('\x00') + 2:]
+
+
+def count_lines(code, language):
+    lexer = get_lexer_by_name(language)
+    preprocess = getattr(lexer, '_preprocess_lexer_input', None)
+    return (preprocess(code) if preprocess is not None else code).count('\n')
+
+
+def build(html, code, language, style, linenos):
+    """
+    Return the little-endian 32-bit offsets of each line of `html` and one past the last, or `b''`.
+    """
+    count = count_lines(code, language)
+    head, tail = get_wrapper(style, linenos)
+    start = html.find(head)
+    if start < 0 or not html.endswith(tail):
+        return b''
+    start, end = start + len(head), len(html) - len(tail)
+    offsets = [start]
+    offsets.extend(match.end() for match in NEWLINE.finditer(html, start, end))
+    if len(offsets) != count + 1 or offsets[-1] != end:
+        return b''
+    return struct.pack('<%dI' % len(offsets), *offsets)
+
+
+def build_line_indexes(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    snippets = Snippet.objects.filter(render_status='done').only('code', 'language', 'style', 'linenos', 'highlighted')
+    batch = []
+    for snippet in snippets.iterator():
+        snippet.line_index = build(snippet.highlighted, snippet.code, snippet.language, snippet.style,
+                                   snippet.linenos)
+        batch.append(snippet)
+        if len(batch) == 500:
+            Snippet.objects.bulk_update(batch, ['line_index'])
+            batch = []
+    Snippet.objects.bulk_update(batch, ['line_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0010_snippet_lazy_render_status'),
+    ]
+
+    # SQLite adds the column by remaking the table, which drops the search index triggers.
+    operations = [
+        migrations.RunPython(uninstall, install),
+        migrations.AddField(
+            model_name='snippet',
+            name='line_index',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(install, uninstall),
+        migrations.RunPython(build_line_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:16
+
+import hashlib
+import os
+import sqlite3
+import zlib
+
+from django.db import migrations
+
+import snippets.fields
+
+# The search index as of this migration, frozen here so that later changes to
+# snippets.search cannot change what the migration does.
+INSTALL = [
+    "CREATE VIRTUAL TABLE snippets_snippet_fts USING fts5(title, code, content='snippets_snippet', "
+    "content_rowid='id', tokenize='{tokenize}')",
+    "CREATE TRIGGER snippets_snippet_fts_insert AFTER INSERT ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_delete AFTER DELETE ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); END",
+    "CREATE TRIGGER snippets_snippet_fts_update AFTER UPDATE OF title, code ON snippets_snippet BEGIN "
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rowid, title, code) "
+    "VALUES ('delete', old.id, old.title, old.code); "
+    "INSERT INTO snippets_snippet_fts(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO snippets_snippet_fts(snippets_snippet_fts) VALUES ('rebuild')",
+]
+UNINSTALL = [
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_insert',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_delete',
+    'DROP TRIGGER IF EXISTS snippets_snippet_fts_update',
+    'DROP TABLE IF EXISTS snippets_snippet_fts',
+]
+
+
+def install(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Substring matches where SQLite has the trigram tokenizer, word prefixes otherwise.
+    tokenize = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+    for statement in INSTALL:
+        schema_editor.execute(statement.format(tokenize=tokenize))
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in UNINSTALL:
+        schema_editor.execute(statement)
+
+
+# snippets.compression as of this migration, frozen, with the preset dictionary
+# pinned by version and checked against its digest: rows are written in the
+# format their header names, whatever the module and the latest dictionary become.
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dictionaries',
+                               'highlighted-%d.zdict')
+DICTIONARY_VERSION = 1
+DICTIONARY_SHA256 = 'af53854b412991e1511404f87df1e92a5b6aae581a493acc20993b621da64b3b'
+PLAIN = 0
+DEFLATE = 1
+MIN_SIZE = 64
+LEVEL = 6
+
+
+def get_dictionary(version):
+    with open(DICTIONARY_PATH % version, 'rb') as file:
+        return file.read()
+
+
+def get_pinned_dictionary():
+    dictionary = get_dictionary(DICTIONARY_VERSION)
+    if hashlib.sha256(dictionary).hexdigest() != DICTIONARY_SHA256:
+        raise RuntimeError('%s has changed: dictionaries must not be edited, only added as new versions.' % (
+            DICTIONARY_PATH % DICTIONARY_VERSION))
+    return dictionary
+
+
+def compress(text, dictionary):
+    if not text:
+        return b''
+    data = text.encode('utf-8')
+    if len(data) < MIN_SIZE:
+        return bytes([PLAIN, 0]) + data
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return bytes([PLAIN, 0]) + data
+    return bytes([DEFLATE, DICTIONARY_VERSION]) + compressed
+
+
+def decompress(value):
+    # Rows written since may name later dictionaries in their header.
+    if not value:
+        return ''
+    format, version = value[0], value[1]
+    if format == PLAIN:
+        return value[2:].decode('utf-8')
+    if format != DEFLATE:
+        raise ValueError('Unknown compressed format %d' % format)
+    options = {'zdict': get_dictionary(version)} if version else {}
+    return zlib.decompressobj(-15, **options).decompress(value[2:]).decode('utf-8')
+
+
+def convert(schema_editor, function):
+    # The rows are read and written as stored: the field would decompress and compress them.
+    connection = schema_editor.connection
+    table = connection.ops.quote_name('snippets_snippet')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT id, highlighted FROM %s' % table)
+        rows = [(function(value), pk) for pk, value in cursor.fetchall()]
+        cursor.executemany('UPDATE %s SET highlighted = %%s WHERE id = %%s' % table, rows)
+
+
+def compress_rows(apps, schema_editor):
+    dictionary = get_pinned_dictionary()
+    convert(schema_editor, lambda value: value if isinstance(value, bytes) else compress(value, dictionary))
+
+
+def decompress_rows(apps, schema_editor):
+    convert(schema_editor, lambda value: decompress(bytes(value)) if isinstance(value, (bytes, memoryview)) else value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0011_snippet_line_index'),
+    ]
+
+    # SQLite changes the column type by remaking the table, which drops the search index triggers.
+    operations = [
+        migrations.RunPython(uninstall, install),
+        migrations.AlterField(
+            model_name='snippet',
+            name='highlighted',
+            field=snippets.fields.CompressedTextField(dictionary='highlighted'),
+        ),
+        migrations.RunPython(install, uninstall),
+        migrations.RunPython(compress_rows, decompress_rows),
+    ]
@@ -0,0 +1,190 @@
+"""
+Mixins for the generic views and viewsets in `snippets.views`.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+from . import conditional, dbrouters, encoding, responsecache
+from .compiled import NotCompilable, compile_serializer
+
+
+def get_readable_attrs(serializer):
+    """
+    Return the attribute path read by each readable field of `serializer`,
+    or `None` if some field reads the whole object (e.g. a `SerializerMethodField`).
+    """
+    paths = []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*':
+            # Identity fields only read their lookup field.
+            if not hasattr(field, 'lookup_field'):
+                return None
+            paths.append([field.lookup_field])
+        else:
+            paths.append(field.source_attrs)
+    return paths
+
+
+def get_columns(serializer, model, ordering=()):
+    """
+    Return the `only()` arguments covering every column `serializer` renders,
+    plus those in `ordering`, or `None` if they cannot be determined.
+    """
+    paths = get_readable_attrs(serializer)
+    if paths is None:
+        return None
+    columns = {model._meta.pk.name}
+    columns.update(field.lstrip('-') for field in ordering)
+    for attrs in paths:
+        name = model._meta.pk.name if attrs[0] == 'pk' else attrs[0]
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if model_field.many_to_one:
+            related = model_field.related_model._meta
+            if len(attrs) == 2 and not related.get_field(attrs[1]).is_relation:
+                columns.add('%s__%s' % (name, attrs[1]))
+            else:
+                columns.add(name)
+        elif model_field.concrete:
+            columns.add(name)
+        # Reverse and many-to-many relations are prefetched with their own queries.
+    return columns
+
+
+def prepare_queryset(queryset, serializer, defer=False, ordering=()):
+    """
+    Apply the select/prefetch plan `serializer` declares (see `EagerLoadingMixin`)
+    for the fields it renders and, with `defer`, load only the columns it renders
+    and those in `ordering`, which the paginator reads.
+    """
+    paths = get_readable_attrs(serializer)
+    setup_eager_loading = getattr(serializer, 'setup_eager_loading', None)
+    if setup_eager_loading is not None:
+        sources = None if paths is None else {attrs[0] for attrs in paths}
+        queryset = setup_eager_loading(queryset, sources)
+    if defer:
+        columns = get_columns(serializer, queryset.model, ordering)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+    return queryset
+
+
+class EagerQuerysetMixin:
+    """
+    Prepare the view's queryset for its serializer with `prepare_queryset()`.
+
+    List requests only load the columns that get rendered, so heavy columns
+    such as `highlighted` stay in the database.
+    """
+
+    def list(self, request, *args, **kwargs):
+        self.defer_columns = True
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        ordering = getattr(self.paginator, 'ordering', ())
+        return prepare_queryset(queryset, self.get_serializer(), getattr(self, 'defer_columns', False), ordering)
+
+
+class CompiledListMixin:
+    """
+    Render list responses from `.values()` rows with the compiled form of the
+    serializer (see `snippets.compiled`), if `SNIPPETS_COMPILED_SERIALIZERS` is set.
+    """
+
+    def get_compiled_serializer(self):
+        if not getattr(settings, 'SNIPPETS_COMPILED_SERIALIZERS', False):
+            return None
+        try:
+            return compile_serializer(self.get_serializer())
+        except NotCompilable:
+            return None
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        # Count the rows without the joins `.values()` adds for related columns.
+        self.count_queryset = self.filter_queryset(self.get_queryset())
+        # Filters may page by another ordering, e.g. search ranks.
+        ordering = getattr(self, 'keyset_ordering', getattr(self.paginator, 'ordering', ()))
+        queryset = compiled.prepare(self.count_queryset, ordering)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.render(page))
+        return Response(compiled.render(queryset))
+
+
+class ConditionalMixin:
+    """
+    Answer conditional GETs of `retrieve()` and `list()` with 304 Not Modified
+    before anything is serialized, using the versions in `snippets.conditional`.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = conditional.make_etag(request, instance.pk, instance.updated.isoformat())
+        response = get_conditional_response(request, etag=etag, last_modified=conditional.timestamp(instance.updated))
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return conditional.set_validators(response, etag, instance.updated)
+
+    def list(self, request, *args, **kwargs):
+        latest, count = conditional.get_table_version(self.queryset.model)
+        etag = conditional.make_etag(request, latest and latest.isoformat(), count)
+        # Deleting rows does not move the latest `updated`, so If-Modified-Since is not trusted here.
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return conditional.set_validators(response, etag, latest)
+
+
+class ResponseCacheMixin:
+    """
+    Serve the GET responses of a viewset's `list` and `retrieve` actions from
+    `snippets.responsecache`, tagged with `get_cache_tags()`, compressed once
+    when stored in the encodings `Accept-Encoding` negotiates.
+    """
+    cache_tag = None
+
+    def get_cache_tags(self):
+        if self.action == 'list':
+            return [self.cache_tag + 's']
+        return ['%s:%s' % (self.cache_tag, self.kwargs[self.lookup_url_kwarg or self.lookup_field])]
+
+    def serve_cached(self, request, handler, *args, **kwargs):
+        """
+        Return the cached response to `request`, or the one `handler` returns, stored once rendered.
+        """
+        # A client pinned to the primary must read its own writes, which the cache may not have seen.
+        if responsecache.get_cache() is None or request.method not in ('GET', 'HEAD') or dbrouters.is_pinned():
+            return handler(request, *args, **kwargs)
+        key = responsecache.make_key(request, self.get_cache_tags())
+        response = responsecache.get_response(request, key)
+        if response is None:
+            responsecache.record(self.basename, 'miss')
+            self.response_cache_key = key
+            return handler(request, *args, **kwargs)
+        responsecache.record(self.basename, 'hit')
+        return get_conditional_response(request, etag=response.get('ETag')) or response
+
+    def list(self, request, *args, **kwargs):
+        return self.serve_cached(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.serve_cached(request, super().retrieve, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'response_cache_key', None)
+        if key is not None and responsecache.is_cacheable(request, response):
+            response.render()
+            response = encoding.apply(request, response, responsecache.set_response(key, response))
+        return response
@@ -1,34 +1,192 @@
+import time
+
+import pygments
+from django.conf import settings
 from django.db import models
-from pygments import highlight
-from pygments.formatters.html import HtmlFormatter
-from pygments.lexers import get_all_lexers, get_lexer_by_name
-from pygments.styles import get_all_styles
+from django.urls import reverse
+
+from . import highlighting, incremental, lineindex
+from .fields import CompressedTextField
+from .registry import LANGUAGE_CHOICES, STYLE_CHOICES
 
-LEXERS = [item for item in get_all_lexers() if item[1]]
-LANGUAGE_CHOICES = sorted([(item[1][0], item[0]) for item in LEXERS])
-STYLE_CHOICES = sorted([(item, item) for item in get_all_styles()])
+RENDER_PENDING = 'pending'
+RENDER_RENDERING = 'rendering'
+RENDER_DONE = 'done'
+RENDER_FAILED = 'failed'
+RENDER_LAZY = 'lazy'
+RENDER_STATUS_CHOICES = [
+    (RENDER_PENDING, 'Pending'),
+    (RENDER_RENDERING, 'Rendering'),
+    (RENDER_DONE, 'Done'),
+    (RENDER_FAILED, 'Failed'),
+    (RENDER_LAZY, 'Highlighted on view'),
+]
 
 
 class Snippet(models.Model):
     owner = models.ForeignKey('auth.User', related_name='snippets', null=True, blank=True, on_delete=models.SET_NULL)
     created = models.DateTimeField(auto_now_add=True)
+    # Bumped by every write, including those that bypass save(); versions the snippet for conditional GETs.
+    updated = models.DateTimeField(auto_now=True, db_index=True)
     title = models.CharField(max_length=100, blank=True, default='')
     code = models.TextField()
     linenos = models.BooleanField(default=False)
     language = models.CharField(choices=LANGUAGE_CHOICES, default='python', max_length=100)
     style = models.CharField(choices=STYLE_CHOICES, default='friendly', max_length=100)
-    highlighted = models.TextField()
+    highlighted = CompressedTextField(dictionary='highlighted')
+    render_status = models.CharField(choices=RENDER_STATUS_CHOICES, default=RENDER_DONE, max_length=10, db_index=True)
+    # Where lexing `code` can be resumed, for re-highlighting an edit of a large snippet (see snippets.incremental).
+    highlight_state = models.TextField(blank=True, default='')
+    # Where each line starts in `highlighted`, for serving windows of its lines (see snippets.lineindex).
+    line_index = models.BinaryField(blank=True, default=b'')
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(fields=['created', 'id'], name='snippet_created_id_idx'),
+            # Filtered lists: an equality prefix, then the list ordering.
+            models.Index(fields=['language', 'created', 'id'], name='snippet_language_created_idx'),
+            models.Index(fields=['style', 'created', 'id'], name='snippet_style_created_idx'),
+            models.Index(fields=['owner', 'created', 'id'], name='snippet_owner_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the owner as loaded, so that signal receivers can tell an owner change.
+        instance._loaded_owner_id = instance.__dict__.get('owner_id')
+        # And the code, so that `save()` can re-highlight only what an edit changed.
+        instance._loaded_code = instance.__dict__.get('code')
+        return instance
 
     def save(self, *args, **kwargs):
         """
         Use the `Pygments` library to create a highlighted HTML representation of the code snippet.
+        Identical inputs are served from the render cache instead of being highlighted again.
+
+        With `SNIPPETS_HIGHLIGHT_MODE = 'async'` a cache miss is not rendered here: the snippet
+        is marked pending and left for the `highlight_worker` command.
+
+        Snippets of `SNIPPETS_INCREMENTAL_HIGHLIGHT_LINES` lines or more are
+        rendered with `snippets.incremental`, an edit re-highlighting only the
+        lines it changed.
+
+        Snippets of `SNIPPETS_LAZY_HIGHLIGHT_SIZE` bytes or more are not rendered
+        on save at all, but a page at a time when viewed (see `get_highlighted()`).
         """
-        lexer = get_lexer_by_name(self.language)
-        linenos = 'table' if self.linenos else False
-        options = {'title': self.title} if self.title else {}
-        formatter = HtmlFormatter(style=self.style, linenos=linenos, full=True, **options)
-        self.highlighted = highlight(self.code, lexer, formatter)
+        inputs = self.get_render_inputs()
+        if highlighting.is_oversized(self.code):
+            self.set_lazy()
+        elif highlighting.is_async():
+            self.set_highlighted(highlighting.get_cached(*inputs))
+        elif incremental.is_large(self.code):
+            self.set_highlighted(*self.render_incremental(inputs))
+        else:
+            self.set_highlighted(highlighting.render_cached(*inputs))
         super(Snippet, self).save(*args, **kwargs)
+        self._loaded_code = self.code
+
+    def get_render_inputs(self):
+        return (self.code, self.language, self.style, self.linenos)
+
+    def render_incremental(self, inputs):
+        """
+        Return the highlighted HTML of `inputs` with its incremental state, by resuming
+        from the loaded ones if they are current, and put the HTML in the render cache.
+        """
+        # Deferred columns are not loaded just for this.
+        loaded = self.__dict__
+        result = None
+        if (self.render_status == RENDER_DONE and loaded.get('highlight_state') and loaded.get('highlighted')
+                and getattr(self, '_loaded_code', None) is not None):
+            result = incremental.rerender(self._loaded_code, self.highlighted, self.highlight_state, *inputs)
+        if result is None:
+            result = incremental.render(*inputs)
+        highlighting.get_render_cache().set(highlighting.render_key(*inputs), result[0])
+        return result
+
+    def set_highlighted(self, html, state=''):
+        """
+        Store rendered HTML, or mark the snippet pending if `html` is `None`.
+        """
+        self.highlight_state = state
+        if html is None:
+            self.highlighted = ''
+            self.line_index = b''
+            self.render_status = RENDER_PENDING
+        else:
+            self.highlighted = html
+            self.line_index = lineindex.build(html, *self.get_render_inputs())
+            self.render_status = RENDER_DONE
+
+    def set_lazy(self):
+        """
+        Mark the snippet as highlighted page by page when viewed, storing no HTML.
+        """
+        self.highlighted = ''
+        self.highlight_state = ''
+        self.line_index = b''
+        self.render_status = RENDER_LAZY
+
+    def wait_for_highlight(self, timeout, interval=0.05):
+        """
+        Wait up to `timeout` seconds for a pending render to finish.
+        Returns `True` once `highlighted` holds the rendered HTML.
+        """
+        deadline = time.monotonic() + timeout
+        while self.render_status in (RENDER_PENDING, RENDER_RENDERING):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+            self.refresh_from_db(fields=['highlighted', 'line_index', 'render_status', 'updated'])
+        return self.render_status == RENDER_DONE
+
+    def get_stylesheet_url(self):
+        # Versioned by Pygments release, so the stylesheet can be cached indefinitely.
+        return '%s?v=%s' % (reverse('snippet-style', kwargs={'style': self.style}), pygments.__version__)
+
+    def get_page_count(self):
+        """
+        Return the number of pages of `SNIPPETS_HIGHLIGHT_PAGE_LINES` lines a lazily highlighted snippet has.
+        """
+        lines = highlighting.count_lines(self.code, self.language)
+        return max(1, -(-lines // settings.SNIPPETS_HIGHLIGHT_PAGE_LINES))
+
+    def render_highlighted_page(self, page):
+        """
+        Return the highlighted HTML fragment of page `page` of a lazily highlighted snippet,
+        with links to the pages around it.
+        """
+        start = (page - 1) * settings.SNIPPETS_HIGHLIGHT_PAGE_LINES
+        body = highlighting.render_lines_cached(*self.get_render_inputs(), start,
+                                                start + settings.SNIPPETS_HIGHLIGHT_PAGE_LINES)
+        return highlighting.render_pager(page, self.get_page_count()) + body
+
+    def get_line_count(self):
+        if self.render_status == RENDER_DONE and self.line_index:
+            return lineindex.get_line_count(self.line_index)
+        return highlighting.count_lines(self.code, self.language)
+
+    def render_highlighted_lines(self, start, stop):
+        """
+        Return the highlighted HTML fragment of lines `start` to `stop` (excluded), numbered from `start + 1`.
+        """
+        if self.render_status == RENDER_DONE and self.line_index:
+            return lineindex.render_window(self.highlighted, self.line_index, start, stop, self.style, self.linenos)
+        return highlighting.render_lines_cached(*self.get_render_inputs(), start, stop)
+
+    def get_highlighted(self, timeout=0, page=1, lines=None):
+        """
+        Return the highlighted HTML page, or a plain escaped preview while it is still being rendered.
+        A lazily highlighted snippet is rendered here, page `page` of it. With `lines`, a
+        `(start, stop)` pair, only those lines are.
+        """
+        if self.render_status == RENDER_LAZY or self.wait_for_highlight(timeout):
+            if lines is not None:
+                body = self.render_highlighted_lines(*lines)
+            elif self.render_status == RENDER_LAZY:
+                body = self.render_highlighted_page(page)
+            else:
+                body = self.highlighted
+            return highlighting.render_page(body, self.title, self.get_stylesheet_url())
+        return highlighting.render_preview(self.code, self.title)
@@ -0,0 +1,165 @@
+"""
+Keyset pagination for the snippet and user listings.
+
+Pages are addressed by an opaque cursor holding the ordering key of the row
+next to the page, so every page is an index range scan instead of an OFFSET
+scan, whatever its depth.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by `ordering`, which must end with a unique field.
+
+    `?count=false` skips the COUNT(*) query for clients that do not need the total.
+    """
+    ordering = ('created', 'id')
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    include_count = True
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        if self.get_include_count(request):
+            # Views paginating `.values()` rows can offer a cheaper queryset to count.
+            self.count = self.get_count(getattr(view, 'count_queryset', queryset))
+        else:
+            self.count = None
+
+        position, self.reverse = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position, self.reverse))
+        ordering = self.reversed_ordering() if self.reverse else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        fields = [('next', self.get_next_link()), ('previous', self.get_previous_link())]
+        if self.count is not None:
+            fields.insert(0, ('count', self.count))
+        return Response(OrderedDict(fields + [('results', data)]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'keyset_ordering', self.ordering)
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ('0', 'false', 'no', 'off')
+
+    def get_count(self, queryset):
+        return queryset.count()
+
+    def reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def keyset_filter(self, position, reverse=False):
+        """
+        Match the rows after `position` in `ordering`, or before it if `reverse` is set.
+
+        For an ordering (a, b) after (x, y) this is `a >= x AND (a > x OR b > y)`:
+        the leading range is what lets the database use an index on (a, b).
+        """
+        after = None
+        fields = [field.lstrip('-') for field in self.ordering]
+        for field, ordering_field, value in reversed(list(zip(fields, self.ordering, position))):
+            lookup = 'lt' if ordering_field.startswith('-') != reverse else 'gt'
+            strict = Q(**{'%s__%s' % (field, lookup): value})
+            after = strict if after is None else strict | (Q(**{field: value}) & after)
+            leading = Q(**{'%s__%se' % (field, lookup): value})
+        return leading & after if len(fields) > 1 else after
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            values = [row[field.lstrip('-')] for field in self.ordering]
+        else:
+            values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_ordering_field(self, queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        """
+        Return the position and direction of the request's cursor, its values converted by
+        their ordering fields in `queryset`; raise `NotFound` if it was not encoded by us.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            position, reverse = payload['p'], bool(payload['r'])
+            if not isinstance(position, list) or len(position) != len(self.ordering) or None in position:
+                raise ValueError('Malformed position')
+            fields = [self.get_ordering_field(queryset, field.lstrip('-')) for field in self.ordering]
+            position = [field.to_python(value) for field, value in zip(fields, position)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # An empty page reached backwards: continue from the start.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+
+class SnippetPagination(KeysetPagination):
+    ordering = ('created', 'id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
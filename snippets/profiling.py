@@ -0,0 +1,304 @@
+"""
+Opt-in profiling of live worker processes, without a restart.
+
+A profiling session runs in one process, either for a number of seconds, or
+for the next N requests to a route, named by its URL name ('snippet-list') or
+by view class and action ('SnippetViewSet.create'). While it runs, a sampler
+thread records the stacks of the threads being profiled every
+`SNIPPETS_PROFILE_INTERVAL` seconds, and each profiled request also runs under
+cProfile. When it ends, the session writes to `SNIPPETS_PROFILE_DIR`:
+
+    <session>-<pid>.collapsed   folded stacks, for flamegraph.pl or speedscope
+    <session>-<pid>.prof        merged cProfile stats, for pstats or snakeviz
+
+Sessions are started by `manage.py profile_workers`, which leaves a control
+file in that directory: every worker picks it up on its next request, or at
+once on SIGUSR2. Staff can also start one in the process serving them, and
+download the results, at /profile/. Nothing runs unless `SNIPPETS_PROFILING`
+is set.
+"""
+import cProfile
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.urls import Resolver404, resolve
+from rest_framework import serializers
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+CONTROL_FILE = 'control.json'
+# Seconds between checks of the control file by request threads.
+CONTROL_CHECK_INTERVAL = 1.0
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return '%s:%s' % (frame.f_globals.get('__name__', '?'), getattr(code, 'co_qualname', code.co_name))
+
+
+def collapse(frame):
+    """
+    Return the stack of `frame` in the folded format, outermost frame first.
+    """
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def get_duration(seconds):
+    """
+    Return how long a session asked to run for `seconds` runs: `SNIPPETS_PROFILE_MAX_SECONDS` at most.
+    """
+    limit = settings.SNIPPETS_PROFILE_MAX_SECONDS
+    return min(seconds or limit, limit)
+
+
+class Session:
+    """
+    A profiling session of this process: for `seconds`, or for the next `requests` requests to `route`.
+    """
+
+    def __init__(self, id=None, seconds=None, route=None, requests=None):
+        self.id = id or uuid.uuid4().hex[:12]
+        self.route = route
+        self.remaining = requests
+        self.deadline = time.monotonic() + get_duration(seconds)
+        self.stacks = Counter()
+        self.stats = None
+        # Idents of the threads serving profiled requests; every thread when no route is given.
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        # Set once the results are written.
+        self.finished = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name='snippets-profiler', daemon=True)
+
+    def start(self):
+        self.sampler.start()
+
+    def matches(self, request):
+        if self.route is None:
+            return True
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        names = {match.url_name, match.view_name}
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is not None:
+            action = getattr(match.func, 'actions', {}).get(request.method.lower(), request.method.lower())
+            names.add('%s.%s' % (view_class.__name__, action))
+        return self.route in names
+
+    def sample(self):
+        interval = settings.SNIPPETS_PROFILE_INTERVAL
+        me = threading.get_ident()
+        while not self.done.wait(interval):
+            if time.monotonic() > self.deadline:
+                self.finish()
+                return
+            frames = sys._current_frames()
+            with self.lock:
+                if self.done.is_set():
+                    return
+                for ident, frame in frames.items():
+                    if ident != me and (self.route is None or ident in self.threads):
+                        self.stacks[collapse(frame)] += 1
+
+    def profile(self, get_response, request):
+        """
+        Serve `request` under cProfile, and count it against the session.
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return get_response(request)
+                self.remaining -= 1
+            self.threads.add(ident)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread.
+            profile = None
+        try:
+            return get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self.lock:
+                self.threads.discard(ident)
+                if profile is not None:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile)
+                    else:
+                        self.stats.add(profile)
+                last = self.remaining == 0 and not self.threads
+            if last:
+                self.finish()
+
+    def get_paths(self):
+        base = os.path.join(settings.SNIPPETS_PROFILE_DIR, '%s-%d' % (self.id, os.getpid()))
+        return base + '.collapsed', base + '.prof'
+
+    def finish(self):
+        global _session
+        with _session_lock:
+            if self.done.is_set():
+                return
+            self.done.set()
+            if _session is self:
+                _session = None
+        collapsed_path, profile_path = self.get_paths()
+        os.makedirs(settings.SNIPPETS_PROFILE_DIR, exist_ok=True)
+        with self.lock:
+            with open(collapsed_path, 'w') as collapsed:
+                for stack, count in sorted(self.stacks.items()):
+                    collapsed.write('%s %d\n' % (stack, count))
+            if self.stats is not None:
+                self.stats.dump_stats(profile_path)
+        self.finished.set()
+
+    def describe(self):
+        return {'id': self.id, 'route': self.route, 'remaining_requests': self.remaining,
+                'remaining_seconds': round(max(0, self.deadline - time.monotonic()), 1)}
+
+
+_session = None
+# Reentrant: SIGUSR2 may arrive while the main thread holds it.
+_session_lock = threading.RLock()
+_control = {'checked': 0.0, 'seen': None}
+
+
+def get_session():
+    return _session
+
+
+def start_session(**kwargs):
+    """
+    Start a profiling session in this process, unless one is running; return the running one.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session(**kwargs)
+            _session.start()
+        return _session
+
+
+def write_control(seconds=None, route=None, requests=None):
+    """
+    Ask every worker sharing `SNIPPETS_PROFILE_DIR` to start a session; return its id.
+    """
+    os.makedirs(settings.SNIPPETS_PROFILE_DIR, exist_ok=True)
+    control = {'id': uuid.uuid4().hex[:12], 'seconds': seconds, 'route': route, 'requests': requests,
+               'created': time.time()}
+    path = os.path.join(settings.SNIPPETS_PROFILE_DIR, CONTROL_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(control, file)
+    os.replace(path + '.tmp', path)
+    return control['id']
+
+
+def check_control(force=False):
+    """
+    Start the session the control file asks for, if this process has not run it yet.
+    """
+    now = time.monotonic()
+    if not force and now - _control['checked'] < CONTROL_CHECK_INTERVAL:
+        return
+    _control['checked'] = now
+    try:
+        with open(os.path.join(settings.SNIPPETS_PROFILE_DIR, CONTROL_FILE)) as file:
+            control = json.load(file)
+    except (OSError, ValueError):
+        return
+    # Workers started after the session ended must not run it again.
+    expires = control['created'] + get_duration(control['seconds'])
+    if control['id'] == _control['seen'] or time.time() > expires:
+        return
+    _control['seen'] = control['id']
+    start_session(id=control['id'], seconds=control['seconds'], route=control['route'],
+                  requests=control['requests'])
+
+
+def install_signal_handler():
+    """
+    Check the control file on SIGUSR2, so that idle workers start a session at once.
+    """
+    if hasattr(signal, 'SIGUSR2') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, lambda signum, frame: check_control(force=True))
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SNIPPETS_PROFILING:
+            return self.get_response(request)
+        check_control()
+        session = _session
+        if session is None or not session.matches(request):
+            return self.get_response(request)
+        return session.profile(self.get_response, request)
+
+
+class SessionSerializer(serializers.Serializer):
+    """
+    The parameters of a session started at /profile/.
+    """
+    seconds = serializers.FloatField(required=False, allow_null=True)
+    route = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    requests = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+
+    def validate_seconds(self, value):
+        # Written so as to reject NaN too.
+        if value is not None and not value > 0:
+            raise serializers.ValidationError('Ensure this value is greater than 0.')
+        return value
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """
+    GET: the running session of this process and the result files.
+    POST: start a session in this process, for `seconds`, or for the next `requests` to `route`.
+    """
+    if not settings.SNIPPETS_PROFILING:
+        raise Http404
+    if request.method == 'POST':
+        serializer = SessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        start_session(seconds=data.get('seconds'), route=data.get('route') or None, requests=data.get('requests'))
+    session = get_session()
+    directory = settings.SNIPPETS_PROFILE_DIR
+    files = sorted(name for name in os.listdir(directory) if name != CONTROL_FILE) if os.path.isdir(directory) else []
+    return Response({'session': session and session.describe(), 'files': files})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_file(request, name):
+    if not settings.SNIPPETS_PROFILING or os.path.basename(name) != name or not name.endswith(('.collapsed', '.prof')):
+        raise Http404
+    path = os.path.join(settings.SNIPPETS_PROFILE_DIR, name)
+    if not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
@@ -0,0 +1,131 @@
+"""
+Lazily built registry of the Pygments lexers and styles a snippet may use.
+
+Listing lexers and styles makes Pygments scan every installed plugin, so
+nothing is listed at import time. The registry is built on first use, from the
+JSON snapshot written by `manage.py snapshot_pygments_registry` when it matches
+the installed Pygments release, and by scanning Pygments otherwise.
+"""
+import collections.abc
+import json
+import os
+import threading
+
+import pygments
+from django.conf import settings
+
+DEFAULT_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pygments_registry.json')
+
+
+def scan():
+    """
+    List the available lexers and styles by querying Pygments and its plugins.
+    """
+    from pygments.lexers import get_all_lexers
+    from pygments.styles import get_all_styles
+
+    languages = sorted([(item[1][0], item[0]) for item in get_all_lexers() if item[1]])
+    styles = sorted([(item, item) for item in get_all_styles()])
+    return {'pygments': pygments.__version__, 'languages': languages, 'styles': styles}
+
+
+def get_snapshot_path():
+    return getattr(settings, 'SNIPPETS_REGISTRY_SNAPSHOT', DEFAULT_SNAPSHOT)
+
+
+def read_snapshot(path):
+    """
+    Return the registry stored at `path`, or `None` if it is missing or stale.
+    """
+    try:
+        with open(path) as snapshot:
+            data = json.load(snapshot)
+    except (OSError, ValueError):
+        return None
+    if data.get('pygments') != pygments.__version__:
+        return None
+    return data
+
+
+def write_snapshot(path, data=None):
+    data = scan() if data is None else data
+    with open(path, 'w') as snapshot:
+        json.dump(data, snapshot, indent=1)
+        snapshot.write('\n')
+    return data
+
+
+class Registry:
+    """
+    Lexer and style choices, loaded once per process on first access.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._lock = threading.Lock()
+
+    def load(self, use_snapshot=True):
+        path = get_snapshot_path() if use_snapshot else None
+        data = read_snapshot(path) if path else None
+        if data is None:
+            data = scan()
+        return {
+            key: [tuple(choice) for choice in data[key]]
+            for key in ('languages', 'styles')
+        }
+
+    def get(self, key):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self.load()
+        return self._data[key]
+
+    def reset(self):
+        self._data = None
+
+
+registry = Registry()
+
+
+class LazyChoices(collections.abc.Sequence):
+    """
+    A sequence of `(value, label)` choices that is only built when first used.
+
+    Besides the usual sequence protocol, it offers `values` and `labels` for
+    constant time lookups of a single choice.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    @property
+    def choices(self):
+        return registry.get(self.key)
+
+    @property
+    def labels(self):
+        if getattr(self, '_labels_for', None) is not self.choices:
+            self._labels = dict(self.choices)
+            self._labels_for = self.choices
+        return self._labels
+
+    @property
+    def values(self):
+        return self.labels.keys()
+
+    def __getitem__(self, index):
+        return self.choices[index]
+
+    def __len__(self):
+        return len(self.choices)
+
+    def __iter__(self):
+        return iter(self.choices)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.key)
+
+
+LANGUAGE_CHOICES = LazyChoices('languages')
+STYLE_CHOICES = LazyChoices('styles')
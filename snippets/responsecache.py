@@ -0,0 +1,137 @@
+"""
+Cache of fully rendered API responses, invalidated by tag.
+
+Entries are keyed by the request (absolute URL with query and format suffix,
+negotiated media type, auth state) and by the current generation of each tag
+the response depends on, such as `snippet:<pk>` or `snippets` for the list.
+Writes invalidate a tag by dropping its generation, so every entry stored
+under it stops being found; stale entries are left for the backend to cull.
+
+The cache is the `SNIPPETS_RESPONSE_CACHE` alias of `CACHES`, which bounds
+its size (`MAX_ENTRIES`) and lifetime (`TIMEOUT`). Entries hold their content
+compressed too, and are served in the encoding each request accepts (see
+`snippets.encoding`).
+"""
+import hashlib
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.http import HttpResponse
+
+from . import dbrouters, encoding
+
+TAG_PREFIX = 'snippets:tag:'
+# Versioned with the layout of entries, which a shared cache may still hold from a previous release.
+KEY_PREFIX = 'snippets:response:2:'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    alias = getattr(settings, 'SNIPPETS_RESPONSE_CACHE', None)
+    return None if alias is None else caches[alias]
+
+
+def record(view_name, outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+        _stats['%s.%s' % (view_name, outcome)] += 1
+
+
+def get_stats():
+    """
+    Return the hit and miss counters of this process, in total and per view.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_generations(cache, tags):
+    keys = [TAG_PREFIX + tag for tag in tags]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def make_key(request, tags):
+    """
+    Return the cache key of the response to `request`, which depends on `tags`.
+    """
+    cache = get_cache()
+    parts = [
+        request.build_absolute_uri(),
+        getattr(request, 'accepted_media_type', ''),
+        'auth' if request.user.is_authenticated else 'anon',
+    ] + get_generations(cache, tags)
+    return KEY_PREFIX + hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def get_response(request, key):
+    """
+    Return the cached response under `key`, in the encoding `request` accepts, or `None`.
+    """
+    entry = get_cache().get(key)
+    if entry is None:
+        return None
+    status, content, headers, variants = entry
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    return encoding.apply(request, response, variants)
+
+
+def is_cacheable(request, response):
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.streaming:
+        return False
+    if response.cookies:
+        return False
+    # The browsable API embeds the user and a CSRF token.
+    renderer = getattr(request, 'accepted_renderer', None)
+    return getattr(renderer, 'format', None) != 'api'
+
+
+def set_response(key, response):
+    """
+    Cache `response` under `key`, and return its content in each encoding it is stored in.
+    """
+    if len(response.content) > settings.SNIPPETS_RESPONSE_CACHE_MAX_SIZE:
+        return {}
+    variants = encoding.encode(response.content)
+    # A response read from a lagging replica may miss a write whose invalidation
+    # has already happened, so it is only kept until the replica has caught up.
+    timeout = settings.SNIPPETS_REPLICA_MAX_LAG if dbrouters.get_replica() is not None else DEFAULT_TIMEOUT
+    get_cache().set(key, (response.status_code, response.content, list(response.items()), variants), timeout)
+    return variants
+
+
+def invalidate(*tags):
+    """
+    Drop every cached response depending on one of `tags`, once the current transaction commits.
+    """
+    cache = get_cache()
+    if cache is None or not tags:
+        return
+    keys = [TAG_PREFIX + tag for tag in tags]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def snippet_tags(*pks):
+    return ['snippet:%s' % pk for pk in pks]
+
+
+def user_tags(*pks):
+    return ['user:%s' % pk for pk in pks if pk is not None]
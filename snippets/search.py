@@ -0,0 +1,165 @@
+"""
+Full-text search over snippet titles and code.
+
+`get_search_backend()` returns the backend configured by
+`SNIPPETS_SEARCH_BACKEND`. A backend narrows a snippet queryset to the rows
+matching a query and annotates them with `search_rank`, lower ranking first.
+
+`SQLiteFTS5Backend` keeps an FTS5 index as an external content table over
+`snippets_snippet`, maintained by triggers on insert, delete and title/code
+updates, so bulk writes and `QuerySet.update()` are indexed too. It uses the
+trigram tokenizer (substring matches) where SQLite supports it, and word
+prefixes otherwise. `DatabaseSearchBackend` works anywhere, with no index.
+"""
+import sqlite3
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_SEARCH_BACKEND = 'snippets.search.SQLiteFTS5Backend'
+
+
+def split_terms(query):
+    return [term for term in query.split() if term]
+
+
+def contains(terms):
+    """
+    Match rows containing every one of `terms` in their title or code.
+    """
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(code__icontains=term)
+    return condition
+
+
+class BaseSearchBackend:
+    """
+    Subclasses implement `search()`; backends indexing outside the database
+    also implement `index()` and `remove()`, which `snippets.signals` calls.
+    """
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index(self, snippets):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Unindexed `icontains` matching; every match ranks the same.
+    """
+
+    def search(self, queryset, query):
+        return queryset.filter(contains(split_terms(query))).annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    table = 'snippets_snippet_fts'
+    content_table = 'snippets_snippet'
+    # bm25() weights of the title and code columns.
+    weights = (10.0, 1.0)
+
+    @property
+    def trigram(self):
+        return sqlite3.sqlite_version_info >= (3, 34, 0)
+
+    def get_min_term_length(self):
+        # The trigram tokenizer cannot match anything shorter than a trigram.
+        return 3 if self.trigram else 1
+
+    def install(self, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        names = {'table': self.table, 'content': self.content_table}
+        tokenize = 'trigram' if self.trigram else 'unicode61'
+        statements = [
+            "CREATE VIRTUAL TABLE %(table)s USING fts5(title, code, content='%(content)s', "
+            "content_rowid='id', tokenize='" + tokenize + "')",
+            "CREATE TRIGGER %(table)s_insert AFTER INSERT ON %(content)s BEGIN "
+            "INSERT INTO %(table)s(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+            "CREATE TRIGGER %(table)s_delete AFTER DELETE ON %(content)s BEGIN "
+            "INSERT INTO %(table)s(%(table)s, rowid, title, code) VALUES ('delete', old.id, old.title, old.code); END",
+            "CREATE TRIGGER %(table)s_update AFTER UPDATE OF title, code ON %(content)s BEGIN "
+            "INSERT INTO %(table)s(%(table)s, rowid, title, code) VALUES ('delete', old.id, old.title, old.code); "
+            "INSERT INTO %(table)s(rowid, title, code) VALUES (new.id, new.title, new.code); END",
+            "INSERT INTO %(table)s(%(table)s, rank) VALUES ('rank', 'bm25(" + '%s, %s' % self.weights + ")')",
+            "INSERT INTO %(table)s(%(table)s) VALUES ('rebuild')",
+        ]
+        for statement in statements:
+            schema_editor.execute(statement % names)
+
+    def uninstall(self, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for suffix in ('insert', 'delete', 'update'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_%s' % (self.table, suffix))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % self.table)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(self.table))
+
+    def get_match(self, terms):
+        """
+        Return the FTS5 query matching every one of `terms`: as substrings with
+        the trigram tokenizer, else as word prefixes.
+        """
+        phrases = ['"%s"' % term.replace('"', '""') for term in terms]
+        if not self.trigram:
+            phrases = [phrase + '*' for phrase in phrases]
+        return ' AND '.join(phrases)
+
+    def search(self, queryset, query):
+        if connection.vendor != 'sqlite':
+            return DatabaseSearchBackend().search(queryset, query)
+        terms = split_terms(query)
+        indexed = [term for term in terms if len(term) >= self.get_min_term_length()]
+        short = [term for term in terms if len(term) < self.get_min_term_length()]
+        if not indexed:
+            return DatabaseSearchBackend().search(queryset, query)
+        queryset = queryset.extra(
+            tables=[self.table],
+            where=['%s.rowid = %s.id' % (self.table, self.content_table), '%s MATCH %%s' % self.table],
+            params=[self.get_match(indexed)],
+        ).annotate(search_rank=RawSQL('%s.rank' % self.table, (), output_field=FloatField()))
+        return queryset.filter(contains(short)) if short else queryset
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Return the search backend configured by `SNIPPETS_SEARCH_BACKEND`.
+    """
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(settings, 'SNIPPETS_SEARCH_BACKEND', DEFAULT_SEARCH_BACKEND))()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    global _backend
+    if setting == 'SNIPPETS_SEARCH_BACKEND':
+        _backend = None
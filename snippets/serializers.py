@@ -1,15 +1,137 @@
+from collections import OrderedDict
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from rest_framework import serializers
-from snippets.models import Snippet, LEXERS, LANGUAGE_CHOICES, STYLE_CHOICES
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from snippets.highlighting import get_code_size
+from snippets.instrumentation import InstrumentedSerializerMixin
+from snippets.models import Snippet
+from snippets.registry import LANGUAGE_CHOICES, STYLE_CHOICES
+
+
+class RegistryChoiceField(serializers.ChoiceField):
+    """
+    A `ChoiceField` over `LazyChoices`, validated with a single dict lookup.
+    The choices are shared by every instance instead of being copied into each one.
+    """
+
+    def __init__(self, choices, **kwargs):
+        self.registry_choices = choices
+        super().__init__(choices, **kwargs)
+
+    def _get_choices(self):
+        return self.registry_choices.labels
+
+    def _set_choices(self, choices):
+        pass
+
+    choices = property(_get_choices, _set_choices)
+    grouped_choices = property(_get_choices)
+
+    def to_internal_value(self, data):
+        if data == '' and self.allow_blank:
+            return ''
+        if str(data) not in self.registry_choices.labels:
+            self.fail('invalid_choice', input=data)
+        return str(data)
+
+    def to_representation(self, value):
+        return value
+
+
+class CodeField(serializers.CharField):
+    """
+    The code of a Snippet, limited to `SNIPPETS_MAX_CODE_SIZE` bytes of UTF-8, or to
+    the `max_code_size` of the serializer context.
+    """
+    default_error_messages = {
+        'max_size': 'Ensure the code has no more than {max_size} bytes; upload larger code to /snippets/upload/.',
+    }
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('style', {'base_template': 'textarea.html'})
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        max_size = self.context.get('max_code_size', settings.SNIPPETS_MAX_CODE_SIZE)
+        if get_code_size(value) > max_size:
+            self.fail('max_size', max_size=max_size)
+        return value
+
+
+class EagerLoadingMixin:
+    """
+    Declares the related objects a serializer reads, so that views can load them
+    together with the main queryset instead of with one query per object.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, sources=None):
+        """
+        Load the declared related objects; with `sources`, only those of the
+        attributes being rendered.
+        """
+        def rendered(lookup):
+            path = getattr(lookup, 'prefetch_through', lookup)
+            return sources is None or path.split('__')[0] in sources
+
+        select_related = [lookup for lookup in cls.select_related_fields if rendered(lookup)]
+        prefetch_related = [lookup for lookup in cls.prefetch_related_fields if rendered(lookup)]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+class SparseFieldsetMixin:
+    """
+    Render only the fields named in a comma separated `?fields=` query parameter.
+    Only applies to safe requests, so that writes still validate every field.
+    Unknown names are answered with a 400 that lists the valid ones.
+    """
+    fields_query_param = 'fields'
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.get_requested_fields()
+        if requested:
+            unknown = requested - set(fields)
+            if unknown:
+                raise ValidationError({self.fields_query_param: [
+                    'Unknown fields: %s. Valid fields are: %s.' % (', '.join(sorted(unknown)), ', '.join(fields))
+                ]})
+            fields = OrderedDict((name, field) for name, field in fields.items() if name in requested)
+        return fields
+
+    def get_requested_fields(self):
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        value = getattr(request, 'query_params', request.GET).get(self.fields_query_param)
+        if not value:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def prefetch_snippet_ids():
+    # Only primary keys are rendered for a user's snippets.
+    return Prefetch('snippets', queryset=Snippet.objects.only('id', 'owner'))
 
 
 class SnippetSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     title = serializers.CharField(required=False, allow_blank=True, max_length=100)
-    code = serializers.CharField(style={'base_template': 'textarea.html'})
+    code = CodeField()
     linenos = serializers.BooleanField(required=False)
-    language = serializers.ChoiceField(choices=LANGUAGE_CHOICES, default='python')
-    style = serializers.ChoiceField(choices=STYLE_CHOICES, default='friendly')
+    language = RegistryChoiceField(choices=LANGUAGE_CHOICES, default='python')
+    style = RegistryChoiceField(choices=STYLE_CHOICES, default='friendly')
 
 
     def create(self, validated_data):
@@ -32,36 +154,48 @@ class SnippetSerializer(serializers.Serializer):
         return instance
 
 
-class SnippetModelSerializer(serializers.ModelSerializer):
+class SnippetModelSerializer(InstrumentedSerializerMixin, EagerLoadingMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
+    code = CodeField()
+    language = RegistryChoiceField(choices=LANGUAGE_CHOICES, required=False)
+    style = RegistryChoiceField(choices=STYLE_CHOICES, required=False)
+    select_related_fields = ['owner']
 
     class Meta:
         model = Snippet
-        fields = ['id', 'title', 'code', 'linenos', 'language', 'style', 'owner']
+        fields = ['id', 'title', 'code', 'linenos', 'language', 'style', 'owner', 'render_status']
+        read_only_fields = ['render_status']
 
 
-class UserModelSerializer(serializers.ModelSerializer):
+class UserModelSerializer(InstrumentedSerializerMixin, EagerLoadingMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     snippets = serializers.PrimaryKeyRelatedField(many=True, queryset=Snippet.objects.all())
+    prefetch_related_fields = [prefetch_snippet_ids()]
 
     class Meta:
         model = User
         fields = ['id', 'username', 'snippets']
 
 
-class SnippetHyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer):
+class SnippetHyperlinkedModelSerializer(InstrumentedSerializerMixin, EagerLoadingMixin, SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
     highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight')
+    code = CodeField()
+    language = RegistryChoiceField(choices=LANGUAGE_CHOICES, required=False)
+    style = RegistryChoiceField(choices=STYLE_CHOICES, required=False)
+    select_related_fields = ['owner']
     # highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight', format='html')
 
     class Meta:
         model = Snippet
-        fields = ['url', 'id', 'highlight', 'title', 'code', 'linenos', 'language', 'style', 'owner']
+        fields = ['url', 'id', 'highlight', 'title', 'code', 'linenos', 'language', 'style', 'owner', 'render_status']
+        read_only_fields = ['render_status']
 
 
-class UserHyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer):
+class UserHyperlinkedModelSerializer(InstrumentedSerializerMixin, EagerLoadingMixin, SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     # snippets = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     # snippets = serializers.PrimaryKeyRelatedField(many=True, queryset=Snippet.objects.all())
     snippets = serializers.HyperlinkedRelatedField(many=True, view_name='snippet-detail', read_only=True)
+    prefetch_related_fields = [prefetch_snippet_ids()]
 
     class Meta:
         model = User
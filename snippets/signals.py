@@ -0,0 +1,64 @@
+"""
+Keep the versions in `snippets.conditional`, the responses cached by
+`snippets.responsecache` and the search index current.
+
+Writes through the ORM invalidate the cached table version in this process;
+other processes see them once their cached copy expires. Cached responses are
+invalidated in the shared response cache.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import conditional, responsecache
+from .search import get_search_backend
+from .models import Snippet
+
+
+@receiver(post_save, sender=Snippet)
+def snippet_saved(sender, instance, created, **kwargs):
+    conditional.invalidate(Snippet)
+    tags = responsecache.snippet_tags(instance.pk) + ['snippets']
+    loaded_owner_id = getattr(instance, '_loaded_owner_id', None)
+    if created or loaded_owner_id != instance.owner_id:
+        # The users list and the old and new owners' pages list the snippet.
+        tags += ['users'] + responsecache.user_tags(loaded_owner_id, instance.owner_id)
+    instance._loaded_owner_id = instance.owner_id
+    responsecache.invalidate(*tags)
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Snippet)
+def snippet_deleted(sender, instance, **kwargs):
+    conditional.invalidate(Snippet)
+    responsecache.invalidate(
+        'snippets', 'users', *responsecache.snippet_tags(instance.pk) + responsecache.user_tags(instance.owner_id))
+    get_search_backend().remove([instance.pk])
+
+
+def touch_snippets(user):
+    """
+    Snippets render their owner's username, so a change to the owner is a change to them.
+    """
+    pks = list(Snippet.objects.filter(owner=user).values_list('pk', flat=True))
+    if pks:
+        Snippet.objects.filter(owner=user).update(updated=timezone.now())
+        conditional.invalidate(Snippet)
+        responsecache.invalidate('snippets', *responsecache.snippet_tags(*pks))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only update `last_login`.
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    responsecache.invalidate('users', *responsecache.user_tags(instance.pk))
+    if not created:
+        touch_snippets(instance)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    responsecache.invalidate('users', *responsecache.user_tags(instance.pk))
+    touch_snippets(instance)
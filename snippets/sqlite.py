@@ -0,0 +1,41 @@
+"""
+SQLite tuning profiles, applied to every new connection.
+
+`SNIPPETS_SQLITE_PROFILE` names one of `PROFILES`. The 'production' profile
+switches the database to write-ahead logging, so that readers no longer block
+the writer; with WAL, `synchronous = NORMAL` only syncs at checkpoints and is
+still safe against corruption. Pair it with `CONN_MAX_AGE`, so that the
+pragmas and page cache survive between requests, and with the write queue of
+`snippets.writer`.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        # Negative sizes are in KiB: 64 MiB of page cache per connection.
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+
+def get_pragmas():
+    return PROFILES[getattr(settings, 'SNIPPETS_SQLITE_PROFILE', 'default')]
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = get_pragmas()
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
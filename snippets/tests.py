@@ -1,3 +1,1166 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import pstats
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from snippets import (
+    compression, dbrouters, encoding, highlighting, incremental, instrumentation, loadtest, profiling, responsecache,
+    worker,
+)
+from snippets.benchmarks import CODE_LINES, SAMPLE_CODE, seed_realistic
+from snippets.compiled import compile_serializer
+from snippets.models import Snippet
+from snippets.serializers import SnippetHyperlinkedModelSerializer, UserHyperlinkedModelSerializer
+from snippets.writer import WriteQueue
+
+
+class QueryCountMixin:
+    """
+    Assertions on the number of queries a list endpoint runs per page.
+    """
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueriesPerPage(self, url, num=None, page_sizes=(1, 5, 20)):
+        """
+        Assert that a page of `url` runs the same number of queries (`num`, if given)
+        whatever its size.
+        """
+        # Warm per-process caches, such as the table version behind list ETags.
+        self.count_queries(url)
+        counts = {size: self.count_queries(url, {'page_size': size}) for size in page_sizes}
+        self.assertEqual(len(set(counts.values())), 1, 'Query count depends on page size: %s' % counts)
+        if num is not None:
+            self.assertEqual(counts[page_sizes[0]], num)
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class ListQueryCountTests(QueryCountMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(3):
+            owner = User.objects.create_user('user-%d' % index)
+            for number in range(10):
+                Snippet.objects.create(owner=owner, title='Snippet %d' % number, code='print(%d)' % number)
+
+    def test_snippet_list(self):
+        # COUNT(*) and the page with its owners joined in.
+        self.assertQueriesPerPage('/snippets/', num=2)
+
+    def test_user_list(self):
+        # COUNT(*), the page, and the prefetched snippets of every user on it.
+        self.assertQueriesPerPage('/users/', num=3)
+
+
+class RenderCacheTests(TestCase):
+
+    def test_lru(self):
+        cache = highlighting.LRURenderCache(max_entries=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('c', 'C')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get('a'), cache.get('c'), len(cache)], ['A', 'C', 2])
+
+        cache = highlighting.LRURenderCache(max_bytes=4)
+        cache.set('a', 'AA')
+        cache.set('b', 'BB')
+        cache.set('c', 'CC')
+        cache.set('d', 'DDDDD')
+        self.assertEqual([cache.get(key) for key in 'abcd'], [None, 'BB', 'CC', None])
+        self.assertEqual(cache.size, 4)
+
+    def test_content_addressed(self):
+        inputs = [('print(1)', 'python', 'friendly', False), ('print(1)', 'python', 'friendly', True),
+                  ('print(1)', 'python3', 'friendly', False), ('print(2)', 'python', 'friendly', False)]
+        self.assertEqual(highlighting.render_key(*inputs[0]), highlighting.render_key(*inputs[0]))
+        self.assertEqual(len({highlighting.render_key(*key) for key in inputs}), len(inputs))
+
+        owner = User.objects.create_user('owner')
+        with self.settings(SNIPPETS_RENDER_CACHE={'BACKEND': 'snippets.highlighting.LRURenderCache'}), \
+                mock.patch.object(highlighting, 'render', wraps=highlighting.render) as render:
+            first = Snippet.objects.create(owner=owner, title='First', code='print(1)')
+            second = Snippet.objects.create(owner=owner, title='Second', code='print(1)')
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(first.highlighted, second.highlighted)
+            Snippet.objects.create(owner=owner, code='print(1)', linenos=True)
+            self.assertEqual(render.call_count, 2)
+
+    def test_django_cache_clear(self):
+        caches['default'].set('unrelated', 1)
+        cache = highlighting.DjangoRenderCache()
+        cache.set('key', '<pre></pre>')
+        self.assertEqual(highlighting.DjangoRenderCache().get('key'), '<pre></pre>')
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(caches['default'].get('unrelated'), 1)
+
+
+@override_settings(SNIPPETS_HIGHLIGHT_MODE='async', SNIPPETS_HIGHLIGHT_WAIT=0, SNIPPETS_RESPONSE_CACHE=None,
+                   SNIPPETS_RENDER_CACHE={'BACKEND': 'snippets.highlighting.NullRenderCache'})
+class WorkerTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.snippets = [Snippet.objects.create(owner=self.owner, code='print(%d)' % number) for number in range(3)]
+
+    def test_claims_once(self):
+        self.assertEqual({snippet.render_status for snippet in self.snippets}, {'pending'})
+        claimed = worker.claim_pending(2)
+        self.assertEqual([row['id'] for row in claimed], [snippet.pk for snippet in self.snippets[:2]])
+        self.assertEqual([row['id'] for row in worker.claim_pending(10)], [self.snippets[2].pk])
+        self.assertEqual(worker.claim_pending(10), [])
+        self.assertEqual(Snippet.objects.filter(render_status='rendering').count(), 3)
+
+    def test_edit_wins_over_render(self):
+        snippet = self.snippets[0]
+        worker.claim_pending(10)
+        snippet.code = 'print("edited")'
+        snippet.save()
+        self.assertFalse(worker.store(snippet.pk, '<div class="highlight">stale</div>'))
+        snippet.refresh_from_db()
+        self.assertEqual((snippet.render_status, snippet.highlighted), ('pending', ''))
+        self.assertEqual([row['code'] for row in worker.claim_pending(10)], ['print("edited")'])
+
+    def test_pending_to_done(self):
+        url = '/snippets/%d/highlight/' % self.snippets[0].pk
+        response = self.client.get(url)
+        self.assertContains(response, '<meta http-equiv="refresh"')
+        with ThreadPoolExecutor(1) as executor:
+            self.assertEqual(worker.render_batch(executor, worker.claim_pending(10)), 3)
+        self.assertEqual(Snippet.objects.filter(render_status='done').count(), 3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<div class="highlight">')
+        self.assertNotContains(response, 'http-equiv')
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class StylesheetTests(TestCase):
+
+    def test_fragment_links_stylesheet(self):
+        snippet = Snippet.objects.create(code='print(1)', style='monokai')
+        self.assertTrue(snippet.highlighted.startswith('<div class="highlight">'))
+        self.assertNotIn('<style', snippet.highlighted)
+        response = self.client.get('/snippets/%d/highlight/' % snippet.pk)
+        self.assertContains(response, '<link rel="stylesheet" href="%s">' % snippet.get_stylesheet_url())
+        self.assertTrue(snippet.get_stylesheet_url().startswith('/styles/monokai.css?v='))
+
+    def test_stylesheet(self):
+        response = self.client.get('/styles/monokai.css')
+        self.assertEqual(response['Content-Type'], 'text/css; charset=utf-8')
+        self.assertEqual(response.content.decode('utf-8'), highlighting.style_css('monokai'))
+        self.assertIn('.highlight .k', highlighting.style_css('monokai'))
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get('/styles/monokai.css', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get('/styles/friendly.css')['ETag'], response['ETag'])
+        self.assertEqual(self.client.get('/styles/klingon.css').status_code, 404)
+        self.assertEqual(self.client.post('/styles/monokai.css').status_code, 405)
+
+
+class RegistryTests(TestCase):
+
+    def test_invalid_choices(self):
+        self.client.force_login(User.objects.create_user('owner'))
+        for data in [{'language': 'klingon'}, {'style': 'klingon'}, {'language': 'monokai'}]:
+            response = self.client.post('/snippets/', dict(data, code='print(1)'))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.json()), list(data))
+        with self.assertRaises(ValidationError):
+            Snippet(code='print(1)', language='klingon').full_clean()
+        Snippet(code='print(1)', language='rust', style='monokai').full_clean(exclude=['highlighted'])
+        self.assertFalse(Snippet.objects.exists())
+
+    def test_models_import_lazily(self):
+        # A fresh interpreter: this one has loaded the lexers already.
+        script = (
+            'import sys, django; django.setup(); import snippets.models; '
+            'from snippets.registry import registry; '
+            'print(registry._data is None, len([name for name in sys.modules if name.startswith("pygments.lexers.")]))'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='tutorial.settings')
+        output = subprocess.run([sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR, check=True,
+                                capture_output=True, text=True).stdout.split()
+        self.assertEqual(output[0], 'True')
+        # Only the name mapping, and the plain text lexer Pygments imports itself.
+        self.assertLessEqual(int(output[1]), 2)
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        for number in range(5):
+            Snippet.objects.create(owner=owner, title='Snippet %d' % number, code='print(%d)' % number)
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_links(self):
+        page = self.get('/snippets/', {'page_size': 2})
+        self.assertEqual(page['count'], 5)
+        self.assertIsNone(page['previous'])
+        pages = [page]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        self.assertEqual([[item['title'] for item in page['results']] for page in pages],
+                         [['Snippet 0', 'Snippet 1'], ['Snippet 2', 'Snippet 3'], ['Snippet 4']])
+        previous = self.get(pages[-1]['previous'])
+        self.assertEqual([item['title'] for item in previous['results']], ['Snippet 2', 'Snippet 3'])
+        self.assertEqual(self.get(previous['previous'])['results'], pages[0]['results'])
+        self.assertIsNone(self.get(previous['previous'])['previous'])
+
+        page = self.get('/snippets/', {'page_size': 2, 'count': 'false'})
+        self.assertNotIn('count', page)
+        self.assertIn('count=false', page['next'])
+        self.assertEqual(self.get(page['next'])['results'], pages[1]['results'])
+
+    def test_invalid_cursors(self):
+        def encode(payload):
+            return urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+        cursors = ['zzzz', encode([1, 2]), encode({'p': ['2020-01-01T00:00:00+00:00', 1]})] + [
+            encode({'p': position, 'r': 0}) for position in [
+                ['garbage', 1], [{}, 1], ['2020-01-01T00:00:00', 'abc'], ['x'], [None, 1], [[], []]]]
+        for url in ['/snippets/', '/users/']:
+            for cursor in cursors:
+                response = self.client.get(url, {'cursor': cursor}, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 404, (url, cursor))
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+        response = self.client.get('/users/', {'cursor': encode({'p': ['1'], 'r': 0})}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class SparseFieldsetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        for number in range(3):
+            Snippet.objects.create(owner=owner, title='Snippet %d' % number, code='print(%d)' % number)
+
+    def get_list(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], ' '.join(query['sql'] for query in queries)
+
+    def test_fields(self):
+        for compiled in (True, False):
+            with self.settings(SNIPPETS_COMPILED_SERIALIZERS=compiled):
+                results, sql = self.get_list('/snippets/')
+                self.assertEqual(set(results[0]), {'url', 'id', 'highlight', 'title', 'code', 'linenos', 'language',
+                                                   'style', 'owner', 'render_status'})
+                self.assertNotIn('"highlighted"', sql)
+                self.assertNotIn('"highlight_state"', sql)
+
+                results, sql = self.get_list('/snippets/', {'fields': 'id, title,'})
+                self.assertEqual([set(item) for item in results], [{'id', 'title'}] * 3)
+                self.assertNotIn('"code"', sql)
+                self.assertNotIn('"highlighted"', sql)
+
+                results, _ = self.get_list('/users/', {'fields': 'username'})
+                self.assertEqual(results, [{'username': 'owner'}])
+
+    def test_unknown_fields(self):
+        for compiled in (True, False):
+            with self.settings(SNIPPETS_COMPILED_SERIALIZERS=compiled):
+                for url, fields in [('/snippets/', 'id, title,klingon'), ('/snippets/', 'titel'),
+                                    ('/users/', 'username,email')]:
+                    response = self.client.get(url, {'fields': fields}, HTTP_ACCEPT='application/json')
+                    self.assertEqual(response.status_code, 400)
+                    [message] = response.json()['fields']
+                    self.assertIn('Unknown fields: %s.' % fields.split(',')[-1], message)
+                    self.assertIn('Valid fields are: url, id, ', message)
+
+    def test_writes_ignore_fields(self):
+        self.client.force_login(User.objects.get(username='owner'))
+        response = self.client.post('/snippets/?fields=id', {'code': 'print(4)'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('code', response.json())
+        self.assertEqual(self.client.post('/snippets/?fields=id', {'title': 'No code'}).status_code, 400)
+
+
+class CompiledSerializerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        User.objects.create_user('nobody')
+        Snippet.objects.create(owner=owner, title='Linenos', code='print(1)', linenos=True, style='monokai')
+        Snippet.objects.create(owner=owner, title='Unicode \u00e9', code='x = "\u00e9"', language='rust')
+        Snippet.objects.create(owner=None, title='Orphan', code='print(3)')
+
+    def assertSameOutput(self, serializer_class, queryset, format=None):
+        request = Request(APIRequestFactory().get('/snippets/'))
+        context = {'request': request, 'format': format}
+        expected = serializer_class(queryset, many=True, context=context).data
+        compiled = compile_serializer(serializer_class(context=context))
+        rendered = compiled.render(compiled.prepare(queryset, ('id',)))
+        self.assertEqual([list(item.items()) for item in rendered], [list(item.items()) for item in expected])
+        return rendered
+
+    def test_matches_serializer(self):
+        snippets = self.assertSameOutput(SnippetHyperlinkedModelSerializer, Snippet.objects.order_by('id'))
+        self.assertEqual([item.get('owner') for item in snippets], ['owner', 'owner', None])
+        # The serializer skips the owner of an orphan, as a missing source.
+        self.assertNotIn('owner', snippets[2])
+        self.assertTrue(snippets[0]['highlight'].startswith('http://testserver/'))
+        self.assertTrue(snippets[0]['highlight'].endswith('/%d/highlight/' % snippets[0]['id']))
+        self.assertSameOutput(SnippetHyperlinkedModelSerializer, Snippet.objects.order_by('id'), format='json')
+        users = self.assertSameOutput(UserHyperlinkedModelSerializer, User.objects.order_by('id'))
+        self.assertEqual([len(user['snippets']) for user in users], [2, 0])
+        self.assertEqual(users[0]['snippets'][0], snippets[0]['url'])
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        for number in range(5):
+            Snippet.objects.create(owner=owner, title='Snippet %d' % number, code='print(%d)' % number)
+
+    def get_list(self):
+        return self.client.get('/snippets/', {'page_size': 100}, HTTP_ACCEPT='application/json').json()['results']
+
+    def test_json_array(self):
+        response = self.client.get('/snippets/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), self.get_list())
+
+    def test_ndjson(self):
+        with self.settings(SNIPPETS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/snippets/export.ndjson')
+            lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in lines], self.get_list())
+
+    def test_empty(self):
+        Snippet.objects.all().delete()
+        response = self.client.get('/snippets/export/', {'format': 'json'})
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+        self.assertEqual(self.client.get('/snippets/export.xml').status_code, 404)
+
+
+class BulkTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.client.force_login(self.owner)
+
+    def bulk(self, method, items):
+        return getattr(self.client, method)('/snippets/bulk/', json.dumps(items), content_type='application/json')
+
+    def test_create(self):
+        items = [{'title': 'Snippet %d' % number, 'code': 'print(%d)' % (number % 2)} for number in range(40)]
+        response = self.bulk('post', items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['title'] for item in response.json()], [item['title'] for item in items])
+        single = Snippet.objects.create(owner=self.owner, code='print(1)')
+        for snippet in Snippet.objects.filter(code='print(1)'):
+            self.assertEqual(snippet.highlighted, single.highlighted)
+            self.assertEqual(snippet.owner, self.owner)
+        self.assertEqual(Snippet.objects.get(pk=response.json()[3]['id']).title, 'Snippet 3')
+
+    def test_invalid_items_write_nothing(self):
+        response = self.bulk('post', [{'code': 'a = 1'}, {'code': 'b = 2', 'language': 'cobol-85'}, {}])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn('language', errors[1])
+        self.assertIn('code', errors[2])
+        self.assertFalse(Snippet.objects.exists())
+
+    def test_update_and_delete(self):
+        mine = Snippet.objects.create(owner=self.owner, code='a = 1')
+        theirs = Snippet.objects.create(owner=User.objects.create_user('other'), code='b = 2')
+        response = self.bulk('patch', [{'id': mine.pk, 'code': 'a = 2'}, {'id': theirs.pk, 'code': 'b = 3'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('detail', response.json()[1])
+
+        response = self.bulk('patch', [{'id': mine.pk, 'code': 'a = 2'}])
+        self.assertEqual(response.status_code, 200)
+        mine.refresh_from_db()
+        self.assertEqual(mine.code, 'a = 2')
+        self.assertIn('2', mine.highlighted)
+
+        self.assertEqual(self.bulk('delete', [mine.pk, mine.pk + 100]).status_code, 400)
+        self.assertEqual(self.bulk('delete', [mine.pk]).status_code, 204)
+        self.assertEqual(list(Snippet.objects.all()), [theirs])
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.snippet = Snippet.objects.create(owner=self.owner, code='print(1)')
+
+    def assertRevalidates(self, url, accept='application/json'):
+        """
+        Assert that `url` answers 304 to its own validators until the snippet changes.
+        """
+        response = self.client.get(url, HTTP_ACCEPT=accept)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.snippet.title = 'Changed'
+        self.snippet.save()
+        response = self.client.get(url, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail(self):
+        self.assertRevalidates('/snippets/%d/' % self.snippet.pk)
+
+    def test_highlight(self):
+        self.assertRevalidates('/snippets/%d/highlight/' % self.snippet.pk, accept='text/html')
+
+    def test_list(self):
+        # With the table version cached, a 304 costs no queries.
+        response = self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(
+                '/snippets/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Snippet.objects.create(owner=self.owner, code='print(2)')
+        self.assertEqual(self.client.get(
+            '/snippets/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_owner_rename(self):
+        url = '/snippets/%d/' % self.snippet.pk
+        etag = self.client.get(url, HTTP_ACCEPT='application/json')['ETag']
+        self.owner.username = 'renamed'
+        self.owner.save()
+        response = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['owner'], 'renamed')
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['responses'].clear()
+        responsecache.reset_stats()
+        self.owner = User.objects.create_user('owner')
+        self.snippet = Snippet.objects.create(owner=self.owner, code='print(1)')
+        self.other = Snippet.objects.create(owner=self.owner, code='print(2)')
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def assertCached(self, url, cached=True):
+        before = responsecache.get_stats().get('hit', 0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(responsecache.get_stats().get('hit', 0) - before, int(cached))
+        if cached:
+            self.assertEqual(len(queries), 0)
+        return response
+
+    def test_invalidation(self):
+        detail, other, highlight = ['/snippets/%d/' % self.snippet.pk, '/snippets/%d/' % self.other.pk,
+                                    '/snippets/%d/highlight/' % self.snippet.pk]
+        urls = [detail, other, '/snippets/', '/users/']
+        for url in urls:
+            self.assertCached(url, cached=False)
+            self.assertEqual(self.assertCached(url).content, self.get(url).content)
+        self.client.get(highlight)
+        self.assertEqual(self.client.get(highlight)['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(responsecache.get_stats()['snippet.hit'], 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet.title = 'Changed'
+            self.snippet.save()
+        self.assertEqual(self.assertCached(detail, cached=False).json()['title'], 'Changed')
+        self.assertCached('/snippets/', cached=False)
+        self.assertCached(other)
+        self.assertCached('/users/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.owner = User.objects.create_user('new-owner')
+            self.other.save()
+        self.assertCached('/users/', cached=False)
+        self.assertCached(detail)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with self.settings(CACHES={'default': settings.CACHES['default'], 'responses': backend}):
+                url = '/snippets/%d/' % self.snippet.pk
+                self.assertCached(url, cached=False)
+                self.assertCached(url)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.snippet.delete()
+                self.assertEqual(self.get(url).status_code, 404)
+
+
+class EncodingTests(TestCase):
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.owner = User.objects.create_user('owner')
+        self.snippet = Snippet.objects.create(owner=self.owner, code=SAMPLE_CODE)
+        self.url = '/snippets/%d/highlight/' % self.snippet.pk
+
+    def test_negotiation(self):
+        plain = self.client.get(self.url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        for _ in range(2):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.content), plain.content)
+            self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertNotIn('Content-Encoding', self.client.get(self.url))
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0, *').get('Content-Encoding'),
+                         'br' if encoding.brotli else None)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='br;q=0, gzip')['Content-Encoding'], 'gzip')
+        with self.settings(SNIPPETS_RESPONSE_CACHE=None):
+            self.assertNotIn('Content-Encoding', self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip'))
+
+    @skipUnless(encoding.brotli, 'brotli is not installed')
+    def test_brotli(self):
+        plain = self.client.get(self.url, HTTP_ACCEPT_ENCODING='identity')
+        for _ in range(2):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(encoding.brotli.decompress(response.content), plain.content)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='br;q=0, gzip')['Content-Encoding'], 'gzip')
+
+    def test_choose(self):
+        self.assertEqual(encoding.parse_accept_encoding('gzip;q=0.5, BR , x;q=1.0.0'), {'gzip': 0.5, 'br': 1.0, 'x': 0.0})
+        variants = {'br': b'', 'gzip': b''}
+        request = type('Request', (), {})()
+        with self.settings(SNIPPETS_RESPONSE_ENCODINGS=['br', 'gzip']):
+            for header, expected in [('gzip, br', 'br' if encoding.brotli else 'gzip'), ('br;q=0.1, gzip', 'gzip'),
+                                     ('br;q=0, gzip', 'gzip'), ('*;q=0', None), ('deflate', None)]:
+                request.META = {'HTTP_ACCEPT_ENCODING': header}
+                self.assertEqual(encoding.choose(request, variants), expected)
+        self.assertEqual(encoding.encode(b'x' * 100), {})
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner')
+        cls.code_match = Snippet.objects.create(owner=owner, title='Numbers', code='def fibonacci(n): pass')
+        cls.title_match = Snippet.objects.create(owner=owner, title='Fibonacci', code='print(1)')
+        for number in range(5):
+            Snippet.objects.create(owner=owner, title='Other %d' % number, code='print(%d)' % number)
+
+    def search(self, query, **params):
+        params['search'] = query
+        response = self.client.get('/snippets/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, query, **params):
+        return [item['id'] for item in self.search(query, **params)['results']]
+
+    def test_ranking(self):
+        # Substring matches, with title matches ranked first.
+        self.assertEqual(self.ids('bonacc'), [self.title_match.pk, self.code_match.pk])
+        self.assertEqual(self.ids('fibonacci pass'), [self.code_match.pk])
+        self.assertEqual(self.search('bonacc')['count'], 2)
+
+    def test_pages(self):
+        page = self.search('print', page_size=2)
+        self.assertEqual(page['count'], 6)
+        ids = [item['id'] for item in page['results']]
+        while page['next']:
+            page = self.client.get(page['next'], HTTP_ACCEPT='application/json').json()
+            ids += [item['id'] for item in page['results']]
+        self.assertEqual(sorted(ids), sorted(Snippet.objects.filter(code__contains='print').values_list('id', flat=True)))
+
+    def test_short_terms(self):
+        self.assertEqual(self.ids('fi (n'), [self.code_match.pk])
+
+    def test_index_follows_writes(self):
+        self.title_match.title = 'Renamed'
+        self.title_match.save()
+        self.assertEqual(self.ids('bonacc'), [self.code_match.pk])
+        Snippet.objects.filter(pk=self.code_match.pk).update(code='lambda: None')
+        self.assertEqual(self.ids('bonacc'), [])
+        self.code_match.delete()
+        self.assertEqual(self.ids('lambda'), [])
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class FilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        for number, (language, owner) in enumerate([('python', cls.alice), ('python', bob), ('c', bob)]):
+            Snippet.objects.create(owner=owner, code='x = %d' % number, language=language)
+
+    def ids(self, **params):
+        response = self.client.get('/snippets/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_filters(self):
+        python = list(Snippet.objects.filter(language='python').values_list('id', flat=True))
+        self.assertEqual(self.ids(language='python'), python)
+        self.assertEqual(self.ids(language='python', owner='bob'), python[1:])
+        self.assertEqual(self.ids(created_after='2000-01-01', created_before='2000-01-02'), [])
+        self.assertEqual(len(self.ids(created_after=Snippet.objects.first().created.isoformat())), 3)
+        response = self.client.get('/snippets/', {'language': 'klingon', 'created_after': 'soon'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(set(response.json()), {'language', 'created_after'})
+
+    @skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans.')
+    def test_query_plans_use_indexes(self):
+        queries = {
+            'snippet_language_created_idx': Snippet.objects.filter(language='python'),
+            'snippet_style_created_idx': Snippet.objects.filter(style='friendly'),
+            'snippet_owner_created_idx': Snippet.objects.filter(owner=self.alice),
+            'snippet_created_id_idx': Snippet.objects.filter(created__gte=Snippet.objects.first().created),
+        }
+        for index, queryset in queries.items():
+            plan = queryset.order_by('created', 'id')[:10].explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan, 'Sorting %s needs a temporary index: %s' % (index, plan))
+
+    def test_facets(self):
+        response = self.client.get('/snippets/facets/', {'language': 'c'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'language': {'python': 2, 'c': 1}, 'style': {'friendly': 1}})
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class AsyncViewTests(TransactionTestCase):
+    """
+    The async views read through worker threads with their own connections, which only see committed data.
+    """
+
+    def request(self, method, url, **headers):
+        async def request():
+            return await getattr(AsyncClient(), method)(url, **headers)
+        return async_to_sync(request)()
+
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.snippet = Snippet.objects.create(owner=owner, title='One', code='print(1)')
+        Snippet.objects.create(owner=owner, title='Two', code='print(2)')
+
+    def test_matches_sync_views(self):
+        for sync_url, async_url in [('/snippets/?page_size=1', '/async/snippets/?page_size=1'),
+                                    ('/snippets/%d/' % self.snippet.pk, '/async/snippets/%d/' % self.snippet.pk)]:
+            expected = self.client.get(sync_url, HTTP_ACCEPT='application/json').json()
+            response = self.request('get', async_url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            data.pop('next', None)
+            expected.pop('next', None)
+            self.assertEqual(data, expected)
+
+    def test_list_errors_and_revalidation(self):
+        for params in ['language=klingon', 'cursor=zzzz', 'created_after=yesterday']:
+            expected = self.client.get('/snippets/?' + params, HTTP_ACCEPT='application/json')
+            self.assertIn(expected.status_code, (400, 404))
+            response = self.request('get', '/async/snippets/?' + params)
+            self.assertEqual((response.status_code, response.json()), (expected.status_code, expected.json()))
+
+        response = self.request('get', '/async/snippets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+        self.assertEqual(self.request('get', '/async/snippets/', **{'If-None-Match': response['ETag']}).status_code, 304)
+        Snippet.objects.filter(pk=self.snippet.pk).delete()
+        response = self.request('get', '/async/snippets/', **{'If-None-Match': response['ETag']})
+        self.assertEqual((response.status_code, response.json()['count']), (200, 1))
+
+    def test_highlight_renders_pending_snippets(self):
+        Snippet.objects.filter(pk=self.snippet.pk).update(highlighted='', render_status='pending')
+        url = '/async/snippets/%d/highlight/' % self.snippet.pk
+        response = self.request('get', url)
+        self.assertContains(response, '<div class="highlight">')
+        # Django 3.2's AsyncClient takes header names as they are sent.
+        self.assertEqual(self.request('get', url, **{'If-None-Match': response['ETag']}).status_code, 304)
+        self.assertEqual(self.request('post', url).status_code, 405)
+
+
+class WriteQueueTests(TransactionTestCase):
+
+    def test_groups_concurrent_writes(self):
+        batches = []
+
+        class RecordingQueue(WriteQueue):
+            def run_batch(self, jobs):
+                batches.append(len(jobs))
+                super().run_batch(jobs)
+
+        write_queue = RecordingQueue()
+        self.addCleanup(write_queue.stop)
+        owner = User.objects.create_user('owner')
+        running, gate = threading.Event(), threading.Event()
+
+        def hold():
+            running.set()
+            return gate.wait()
+
+        def fail():
+            Snippet.objects.create(owner=owner, code='rolled back')
+            raise ValueError
+
+        # Hold the writer, so that the following writes queue up behind it.
+        first = write_queue.submit(hold)
+        running.wait()
+        futures = [write_queue.submit(Snippet.objects.create, owner=owner, code='x = %d' % number)
+                   for number in range(20)]
+        failing = write_queue.submit(fail)
+        gate.set()
+
+        self.assertTrue(first.result())
+        self.assertEqual([future.result().code for future in futures], ['x = %d' % number for number in range(20)])
+        self.assertRaises(ValueError, failing.result)
+        self.assertEqual(batches, [1, 21])
+        self.assertEqual(Snippet.objects.count(), 20)
+
+    def test_viewset_writes(self):
+        owner = User.objects.create_user('owner')
+        self.client.force_login(owner)
+        with self.settings(SNIPPETS_WRITE_QUEUE=True, SNIPPETS_RESPONSE_CACHE=None):
+            response = self.client.post('/snippets/', {'code': 'print(1)'})
+            self.assertEqual(response.status_code, 201)
+            url = '/snippets/%d/' % response.json()['id']
+            response = self.client.patch(url, json.dumps({'code': 'print(2)'}), content_type='application/json')
+            self.assertEqual(Snippet.objects.get().code, 'print(2)')
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Snippet.objects.exists())
+
+
+@override_settings(SNIPPETS_READ_REPLICAS=['replica'], SNIPPETS_RESPONSE_CACHE=None)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    A second SQLite file stands in for a replica, holding different rows than the primary to tell them apart.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory.name, 'replica.sqlite3'),
+        }
+        self.addCleanup(self.remove_replica)
+        call_command('migrate', database='replica', verbosity=0)
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        owner = User.objects.using('replica').create(pk=self.owner.pk, username='owner', password=self.owner.password)
+        Snippet.objects.using('replica').create(pk=1000, owner=owner, title='Replica', code='print(0)')
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def get_titles(self, client):
+        response = client.get('/snippets/', HTTP_ACCEPT='application/json')
+        return [snippet['title'] for snippet in response.json()['results']]
+
+    def test_reads_own_writes(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.get_titles(self.client), ['Replica'])
+
+        response = self.client.post('/snippets/', {'title': 'Primary', 'code': 'print(1)'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(dbrouters.PIN_COOKIE, response.cookies)
+        # The writer reads the primary until the replica has caught up; other clients read the replica.
+        self.assertEqual(self.get_titles(self.client), ['Primary'])
+        self.assertEqual(self.get_titles(Client()), ['Replica'])
+        self.assertEqual(Client().get('/snippets/%d/' % response.json()['id']).status_code, 404)
+
+        self.client.cookies[dbrouters.PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.get_titles(self.client), ['Replica'])
+
+    def test_async_views(self):
+        async def get_titles():
+            response = await AsyncClient().get('/async/snippets/')
+            return [snippet['title'] for snippet in response.json()['results']]
+        self.assertEqual(async_to_sync(get_titles)(), ['Replica'])
+
+    def test_unrouted_queries_use_primary(self):
+        self.assertFalse(Snippet.objects.exists())
+        with self.settings(SNIPPETS_READ_REPLICAS=[]):
+            self.assertEqual(self.get_titles(self.client), [])
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.metrics.reset()
+        self.owner = User.objects.create_user('owner')
+        self.snippet = Snippet.objects.create(owner=self.owner, title='One', code='print(1)')
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('snippets.requests', 'INFO') as logs:
+            response = self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+        phases = {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+        self.assertGreaterEqual(set(phases), {'db', 'auth', 'permissions', 'serialize', 'render', 'total'})
+        metrics = logs.records[0].metrics
+        self.assertIn('desc="%d queries"' % metrics['queries'], phases['db'])
+        self.assertEqual((metrics['route'], metrics['status'], metrics['bytes']),
+                         ('snippet-list', 200, len(response.content)))
+
+    def test_streamed_bytes(self):
+        with self.assertLogs('snippets.requests', 'INFO') as logs:
+            response = self.client.get('/snippets/export.ndjson')
+            content = b''.join(response.streaming_content)
+        self.assertEqual(logs.records[0].metrics['bytes'], len(content))
+
+    def test_metrics(self):
+        self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+        self.client.get('/snippets/%d/' % self.snippet.pk, HTTP_ACCEPT='application/json')
+        self.client.get('/snippets/0/', HTTP_ACCEPT='application/json')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('snippets_request_duration_seconds_count{route="snippet-list",method="GET"} 1', body)
+        self.assertIn('snippets_request_duration_seconds_bucket{route="snippet-detail",method="GET",le="+Inf"} 2',
+                      body)
+        self.assertIn('snippets_responses_total{route="snippet-detail",method="GET",status="404"} 1', body)
+        self.assertIn('snippets_request_phase_seconds_total{route="snippet-list",phase="serialize"}', body)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='192.0.2.1').status_code, 403)
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SNIPPETS_PROFILING=True, SNIPPETS_PROFILE_DIR=directory.name,
+                                              SNIPPETS_PROFILE_INTERVAL=0.001, SNIPPETS_RESPONSE_CACHE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiling._control.update(checked=0.0, seen=None)
+        self.owner = User.objects.create_user('owner', is_staff=True)
+
+    def test_next_requests_to_route(self):
+        profiling.write_control(route='SnippetViewSet.create', requests=1)
+        self.client.force_login(self.owner)
+        # Picked up by the next request, which does not match the route.
+        self.client.get('/snippets/', HTTP_ACCEPT='application/json')
+        session = profiling.get_session()
+        self.assertEqual(session.remaining, 1)
+        self.client.post('/snippets/', {'code': 'print(1)'})
+        self.assertTrue(session.finished.wait(5))
+        self.assertIsNone(profiling.get_session())
+        stats = pstats.Stats(session.get_paths()[1])
+        self.assertTrue(any(function == 'perform_create' for _, _, function in stats.stats))
+
+    def test_duration(self):
+        session = profiling.start_session(seconds=0.2)
+        spin(0.1)
+        self.assertTrue(session.finished.wait(5))
+        with open(session.get_paths()[0]) as collapsed:
+            stacks = collapsed.read()
+        self.assertIn('snippets.tests:spin', stacks)
+
+    def test_endpoint(self):
+        self.assertEqual(self.client.post('/profile/', {'seconds': 60}).status_code, 403)
+        self.client.force_login(self.owner)
+        session_id = self.client.post('/profile/', {'seconds': 60}).json()['session']['id']
+        profiling.get_session().finish()
+        files = self.client.get('/profile/').json()['files']
+        self.assertIn('%s-%d.collapsed' % (session_id, os.getpid()), files)
+        response = self.client.get('/profile/%s' % files[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/profile/..%2Fdb.sqlite3').status_code, 404)
+
+    def test_limits(self):
+        with self.settings(SNIPPETS_PROFILE_MAX_SECONDS=30):
+            session = profiling.Session(seconds=1e9)
+            self.assertLessEqual(session.deadline - time.monotonic(), 30)
+            self.assertEqual(profiling.get_duration(None), 30)
+            self.assertEqual(profiling.get_duration(5), 5)
+            # A control file older than the longest session is not run.
+            profiling.write_control(seconds=1e9)
+            with open(os.path.join(settings.SNIPPETS_PROFILE_DIR, profiling.CONTROL_FILE)) as file:
+                control = json.load(file)
+            control['created'] -= 31
+            with open(os.path.join(settings.SNIPPETS_PROFILE_DIR, profiling.CONTROL_FILE), 'w') as file:
+                json.dump(control, file)
+            profiling.check_control(force=True)
+            self.assertIsNone(profiling.get_session())
+
+        self.client.force_login(self.owner)
+        for data in [{'seconds': 'abc'}, {'seconds': 0}, {'seconds': -1}, {'seconds': 'nan'}, {'requests': 'x'},
+                     {'requests': 0, 'route': 'snippet-list'}]:
+            response = self.client.post('/profile/', data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertEqual(list(response.json()), list(data)[:1])
+        self.assertIsNone(profiling.get_session())
+        with self.assertRaises(CommandError):
+            call_command('profile_workers', seconds=-1)
+
+
+class LoadTestTests(TransactionTestCase):
+
+    def test_scenarios(self):
+        owners = seed_realistic(20, users=2)
+        pks = list(Snippet.objects.values_list('pk', flat=True))
+        own_pks = list(Snippet.objects.filter(owner=owners[0]).values_list('pk', flat=True))
+        transport = loadtest.InProcessTransport(owners[0])
+        transport.start()
+        rng = random.Random(0)
+        for scenario in loadtest.SCENARIOS:
+            result = loadtest.run(transport, loadtest.build_requests(scenario, 5, rng, pks, own_pks), 2)
+            self.assertEqual(result['errors'], 0, scenario)
+            self.assertGreater(result['queries'], 0, scenario)
+
+    @override_settings(SESSION_COOKIE_NAME='snippets_session', CSRF_COOKIE_NAME='snippets_csrf')
+    def test_http_transport_cookie_names(self):
+        owners = seed_realistic(5, users=1)
+        own_pks = list(Snippet.objects.values_list('pk', flat=True))
+        transport = loadtest.HTTPTransport(owners[0])
+        transport.start()
+        try:
+            requests = loadtest.build_requests('create', 2, random.Random(0), own_pks, own_pks)
+            requests += loadtest.build_requests('update', 2, random.Random(0), own_pks, own_pks)
+            self.assertEqual(loadtest.run(transport, requests, 1)['errors'], 0)
+        finally:
+            transport.stop()
+        self.assertEqual(Snippet.objects.filter(owner=owners[0]).count(), 7)
+
+    def test_compare(self):
+        result = {'p50': 5.0, 'p95': 10.0, 'p99': 20.0, 'throughput': 100.0, 'queries': 3}
+        baseline = {'results': {'http': {'list': result}}}
+        slower = dict(result, p95=14.0, queries=4)
+        self.assertEqual(loadtest.compare({'results': {'http': {'list': result}}}, baseline, 0.25), [])
+        self.assertEqual(len(loadtest.compare({'results': {'http': {'list': slower}}}, baseline, 0.25)), 2)
+
+
+class IncrementalHighlightTests(TestCase):
+
+    def test_edits_match_full_render(self):
+        edits = [
+            lambda lines: lines[:30] + ['"""', '/* <!--'] + lines[30:],
+            lambda lines: lines[:60] + ['"""', '*/ -->'] + lines[60:],
+            lambda lines: lines[:31] + lines[32:],
+            lambda lines: lines[:10] + ['x = "unclosed'] + lines[11:],
+            lambda lines: lines + ['`'],
+            lambda lines: lines[1:],
+        ]
+        for language in ['python', 'javascript', 'java', 'html', 'sql']:
+            for linenos in (False, True):
+                sample = CODE_LINES[language]
+                lines = [sample[index % len(sample)].format(n=index) for index in range(120)]
+                code = '\n'.join(lines) + '\n'
+                html, state = incremental.render(code, language, 'friendly', linenos)
+                self.assertEqual(html, highlighting.render(code, language, 'friendly', linenos))
+                self.assertEqual(state == '', language == 'sql')
+                for edit in edits:
+                    lines = edit(lines)
+                    edited = '\n'.join(lines) + '\n'
+                    expected = highlighting.render(edited, language, 'friendly', linenos)
+                    if not state:
+                        self.assertIsNone(incremental.rerender(code, html, state, edited, language, 'friendly', linenos))
+                        code, html = edited, expected
+                        continue
+                    html, state = incremental.rerender(code, html, state, edited, language, 'friendly', linenos)
+                    self.assertEqual(html, expected, language)
+                    code = edited
+                self.assertIsNone(incremental.rerender(code, html + ' ', state, code, language, 'friendly', linenos))
+
+    @override_settings(SNIPPETS_INCREMENTAL_HIGHLIGHT_LINES=50)
+    def test_partial_update(self):
+        owner = User.objects.create_user('owner')
+        self.client.force_login(owner)
+        lines = ['value_%d = %d' % (index, index) for index in range(100)]
+        pk = self.client.post('/snippets/', {'code': '\n'.join(lines)}).json()['id']
+        self.assertTrue(Snippet.objects.get(pk=pk).highlight_state)
+        lines[50] = 'text = """'
+        response = self.client.patch('/snippets/%d/' % pk, json.dumps({'code': '\n'.join(lines)}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        snippet = Snippet.objects.get(pk=pk)
+        self.assertEqual(snippet.highlighted, highlighting.render(snippet.code, 'python', 'friendly', False))
+        self.assertIn('<span class="s2">value_99 = 99', snippet.highlighted)
+        self.assertTrue(snippet.highlight_state)
+
+
+@override_settings(SNIPPETS_MAX_BODY_SIZE=4096, SNIPPETS_MAX_CODE_SIZE=1024, SNIPPETS_MAX_UPLOAD_SIZE=64 * 1024,
+                   SNIPPETS_LAZY_HIGHLIGHT_SIZE=16 * 1024, SNIPPETS_HIGHLIGHT_PAGE_LINES=500,
+                   SNIPPETS_RESPONSE_CACHE=None)
+class UploadTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('owner'))
+
+    def post_json(self, path, data):
+        return self.client.post(path, json.dumps(data), content_type='application/json')
+
+    def test_limits(self):
+        self.assertEqual(self.post_json('/snippets/', {'code': 'x' * 5000}).status_code, 413)
+        response = self.post_json('/snippets/', {'code': 'é' * 600})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('/snippets/upload/', response.json()['code'][0])
+        self.assertEqual(self.post_json('/snippets/', {'code': 'x' * 1000}).status_code, 201)
+        response = self.client.post('/snippets/upload/', 'x' * (64 * 1024 + 1), content_type='text/plain')
+        self.assertEqual(response.status_code, 413)
+
+    def test_upload(self):
+        code = ''.join('value_%d = %d\n' % (index, index) for index in range(100))
+        response = self.client.post('/snippets/upload/?title=Raw&language=python',
+                                    code, content_type='text/plain; charset=utf-16')
+        self.assertEqual(response.status_code, 201)
+        snippet = Snippet.objects.get(pk=response.json()['id'])
+        self.assertEqual((snippet.title, snippet.code.strip(), snippet.render_status), ('Raw', code.strip(), 'done'))
+
+        response = self.client.put('/snippets/%d/code/' % snippet.pk, 'print(1)', content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        snippet.refresh_from_db()
+        self.assertEqual((snippet.title, snippet.code), ('Raw', 'print(1)'))
+
+        upload = tempfile.NamedTemporaryFile(suffix='.js')
+        upload.write(b'let x = 1;\n' * 2000)
+        upload.seek(0)
+        response = self.client.post('/snippets/upload/', {'code': upload, 'language': 'javascript'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['language'], 'javascript')
+        self.assertEqual(response.json()['render_status'], 'lazy')
+
+    def test_lazy_pages(self):
+        lines = ['value_%d = "%s"' % (index, 'x' * 20) for index in range(1200)]
+        lines[499] = 'text = """'
+        code = '\n'.join(lines)
+        response = self.client.post('/snippets/upload/', code, content_type='text/plain')
+        pk = response.json()['id']
+        snippet = Snippet.objects.get(pk=pk)
+        self.assertEqual((snippet.render_status, snippet.highlighted), ('lazy', ''))
+        self.assertEqual(snippet.get_page_count(), 3)
+
+        full = highlighting.render(code, 'python', 'friendly')
+        pages = [highlighting.render_lines(code, 'python', 'friendly', False, start, start + 500)
+                 for start in range(0, 1500, 500)]
+        strip = lambda html: html.replace('<div class="highlight"><pre><span></span>', '').replace('</pre></div>\n', '')
+        self.assertEqual(''.join(strip(page) for page in pages), strip(full))
+        for page in (1, 2, 3):
+            response = self.client.get('/snippets/%d/highlight/?page=%d' % (pk, page))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(pages[page - 1], response.content.decode())
+        self.assertIn('rel="next"', self.client.get('/snippets/%d/highlight/' % pk).content.decode())
+        for page in ('0', '4', 'last'):
+            self.assertEqual(self.client.get('/snippets/%d/highlight/?page=%s' % (pk, page)).status_code, 404)
+
+
+@override_settings(SNIPPETS_RESPONSE_CACHE=None)
+class LineWindowTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('owner'))
+        sample = CODE_LINES['java']
+        self.code = '\n'.join(sample[index % len(sample)].format(n=index) for index in range(300))
+
+    def get_window(self, pk, lines):
+        response = self.client.get('/snippets/%d/highlight/?lines=%s' % (pk, lines))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_windows(self):
+        for linenos in (False, True):
+            pk = self.client.post('/snippets/', {'code': self.code, 'language': 'java', 'linenos': linenos}).json()['id']
+            snippet = Snippet.objects.get(pk=pk)
+            self.assertEqual(snippet.get_line_count(), 300)
+            for lines, (start, stop) in [('1-1', (0, 1)), ('120-180', (119, 180)), ('290-400', (289, 300)), ('7', (6, 7))]:
+                expected = highlighting.render_lines(self.code, 'java', 'friendly', linenos, start, stop)
+                self.assertEqual(snippet.render_highlighted_lines(start, stop + 5 * (stop == 300)), expected)
+                self.assertIn(expected, self.get_window(pk, lines))
+            if linenos:
+                self.assertIn('<span class="normal">120</span>', self.get_window(pk, '120-121'))
+            # Rows stored without an index are rendered again instead.
+            Snippet.objects.filter(pk=pk).update(line_index=b'')
+            self.assertIn(highlighting.render_lines(self.code, 'java', 'friendly', linenos, 9, 20),
+                          self.get_window(pk, '10-20'))
+            for lines in ('0-3', '301-302', '5-4', 'all'):
+                self.assertEqual(self.client.get('/snippets/%d/highlight/?lines=%s' % (pk, lines)).status_code, 404)
+
+    @override_settings(SNIPPETS_LAZY_HIGHLIGHT_SIZE=1024)
+    def test_lazy_window(self):
+        pk = self.client.post('/snippets/', {'code': self.code, 'language': 'java'}).json()['id']
+        self.assertEqual(Snippet.objects.get(pk=pk).render_status, 'lazy')
+        self.assertIn(highlighting.render_lines(self.code, 'java', 'friendly', False, 199, 250),
+                      self.get_window(pk, '200-250'))
+
+
+class CompressionTests(TestCase):
+
+    def get_stored(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT highlighted FROM snippets_snippet WHERE id = %s', [pk])
+            return cursor.fetchone()[0]
+
+    def test_round_trip(self):
+        html = highlighting.render(SAMPLE_CODE * 20, 'python', 'friendly')
+        for text in ['', 'short', 'é' * 100, html]:
+            for dictionary in (None, 'highlighted'):
+                self.assertEqual(compression.decompress(compression.compress(text, dictionary), dictionary), text)
+        self.assertLess(len(compression.compress(html, 'highlighted')), len(compression.compress(html)))
+        self.assertLess(len(compression.compress(html, 'highlighted')), len(html) // 10)
+
+    def test_field(self):
+        snippet = Snippet.objects.create(code=SAMPLE_CODE)
+        stored = self.get_stored(snippet.pk)
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(compression.decompress(stored, 'highlighted'), snippet.highlighted)
+        loaded = Snippet.objects.get(pk=snippet.pk)
+        self.assertIsInstance(loaded.__dict__['highlighted'], compression.Compressed)
+        self.assertEqual(loaded.highlighted, highlighting.render(SAMPLE_CODE, 'python', 'friendly'))
+        self.assertNotIn('highlighted', Snippet.objects.only('code').get(pk=snippet.pk).__dict__)
+
+        Snippet.objects.filter(pk=snippet.pk).update(highlighted='<p>updated</p>' * 10)
+        self.assertEqual(Snippet.objects.get(pk=snippet.pk).highlighted, '<p>updated</p>' * 10)
+        # Rows stored before the column was compressed still read as text.
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE snippets_snippet SET highlighted = '<p>text</p>' WHERE id = %s", [snippet.pk])
+        self.assertEqual(Snippet.objects.get(pk=snippet.pk).highlighted, '<p>text</p>')
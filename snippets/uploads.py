@@ -0,0 +1,195 @@
+"""
+Size limits of request bodies, and streamed uploads of large snippet code.
+
+JSON bodies over `SNIPPETS_MAX_BODY_SIZE` bytes are refused with 413 before
+they are parsed: from their Content-Length, or once that much has been read
+if they have none. A view may name another setting for its limit in
+`body_size_setting`, as bulk writes do. The code in them is limited to
+`SNIPPETS_MAX_CODE_SIZE` bytes by the serializers.
+
+Larger code is uploaded to /snippets/upload/ or /snippets/<pk>/code/, as the
+raw `text/plain` body, with the other fields as query parameters, or as the
+`code` file of a multipart form. It is read in chunks into a temporary file,
+spooled to disk past `FILE_UPLOAD_MAX_MEMORY_SIZE`, and counted against
+`SNIPPETS_MAX_UPLOAD_SIZE` as it arrives, so that an oversized upload is
+refused without being held in memory.
+"""
+import codecs
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import BaseParser, DataAndFiles, JSONParser, MultiPartParser
+
+CHUNK_SIZE = 64 * 1024
+UPLOAD_FIELDS = ['title', 'language', 'style', 'linenos']
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body too large.'
+    default_code = 'request_too_large'
+
+    def __init__(self, limit):
+        super().__init__('Request body too large: the limit is %d bytes.' % limit)
+
+
+def check_content_length(parser_context, limit):
+    request = (parser_context or {}).get('request')
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except (AttributeError, ValueError):
+        return
+    if length > limit:
+        raise RequestTooLarge(limit)
+
+
+class LimitedStream:
+    """
+    Read from `stream`, raising `RequestTooLarge` once more than `limit` bytes are read.
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.limit + 1 - self.size
+        data = self.stream.read(min(size, self.limit + 1 - self.size))
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestTooLarge(self.limit)
+        return data
+
+
+def get_body_limit(parser_context):
+    view = (parser_context or {}).get('view')
+    return getattr(settings, getattr(view, 'body_size_setting', 'SNIPPETS_MAX_BODY_SIZE'))
+
+
+class LimitedJSONParser(JSONParser):
+    """
+    `JSONParser` refusing bodies over the view's size limit before parsing them.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        limit = get_body_limit(parser_context)
+        check_content_length(parser_context, limit)
+        return super().parse(LimitedStream(stream, limit), media_type, parser_context)
+
+
+def spool(stream, limit):
+    """
+    Copy `stream` in chunks into a temporary file, refusing it once over `limit` bytes.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE) if stream is not None else b''
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            file.close()
+            raise RequestTooLarge(limit)
+        file.write(chunk)
+    file.seek(0)
+    return file
+
+
+def get_charset(media_type):
+    for param in (media_type or '').split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip().strip('"')
+    return None
+
+
+class CodeUploadParser(BaseParser):
+    """
+    Parse a raw `text/plain` body into a `code` file, spooled to disk and limited to `SNIPPETS_MAX_UPLOAD_SIZE`.
+    """
+    media_type = 'text/plain'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        limit = settings.SNIPPETS_MAX_UPLOAD_SIZE
+        check_content_length(parser_context, limit)
+        file = spool(stream, limit)
+        file.charset = get_charset(media_type)
+        return DataAndFiles({}, {'code': file})
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    Refuse multipart file uploads once a file is over `limit` bytes, ahead of the handlers storing it.
+    """
+
+    def __init__(self, request=None, limit=None):
+        super().__init__(request)
+        self.limit = limit
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.limit:
+            raise RequestTooLarge(self.limit)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class CodeMultiPartParser(MultiPartParser):
+    """
+    `MultiPartParser` whose files are limited to `SNIPPETS_MAX_UPLOAD_SIZE`, and the other fields to
+    `SNIPPETS_MAX_BODY_SIZE`.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        limit = settings.SNIPPETS_MAX_UPLOAD_SIZE
+        check_content_length(parser_context, limit + settings.SNIPPETS_MAX_BODY_SIZE)
+        request = parser_context['request']
+        request.upload_handlers.insert(0, UploadLimitHandler(request, limit))
+        return super().parse(stream, media_type, parser_context)
+
+
+def read_code(file):
+    """
+    Decode an uploaded file, chunk by chunk, as text in its charset or UTF-8.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(getattr(file, 'charset', None) or 'utf-8')()
+    except LookupError:
+        raise ValidationError({'code': ['Unknown charset %r.' % file.charset]})
+    parts = []
+    try:
+        file.seek(0)
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError:
+        raise ValidationError({'code': ['The uploaded code is not valid text in its charset.']})
+    finally:
+        file.close()
+    return ''.join(parts)
+
+
+def get_upload_data(request):
+    """
+    Return the serializer data of an upload: the decoded `code` file, and the other fields
+    of the multipart form or, for a raw body, of the query string.
+    """
+    file = request.data.get('code')
+    if file is None or isinstance(file, str):
+        raise ValidationError({'code': ['Upload the code as the request body or as a `code` file.']})
+    data = {name: request.query_params[name] for name in UPLOAD_FIELDS if name in request.query_params}
+    data.update((name, request.data[name]) for name in UPLOAD_FIELDS if name in request.data)
+    data['code'] = read_code(file)
+    return data
@@ -1,8 +1,16 @@
+import hashlib
+from collections import OrderedDict
+
+import pygments
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Count
 from django.http import Http404
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
 
 from rest_framework import renderers
 from rest_framework import status
@@ -16,7 +24,13 @@ from rest_framework.views import APIView
 from rest_framework import generics
 from rest_framework import viewsets
 
-from .models import Snippet
+from . import bulk, conditional, export, highlighting, lineindex, uploads, writer
+from .compiled import compile_serializer
+from .filters import SnippetFilter, SnippetSearchFilter
+from .instrumentation import InstrumentedViewMixin
+from .mixins import CompiledListMixin, ConditionalMixin, EagerQuerysetMixin, ResponseCacheMixin, prepare_queryset
+from .models import Snippet, RENDER_DONE, RENDER_LAZY, STYLE_CHOICES
+from .pagination import SnippetPagination, UserPagination
 from .permissions import IsOwnerOrReadOnly
 from .serializers import SnippetModelSerializer, UserModelSerializer, SnippetHyperlinkedModelSerializer, UserHyperlinkedModelSerializer, SnippetHighlightSerializer
 
@@ -29,7 +43,7 @@ def snippet_list(request):
         2. Create a new Snippet for POST request for validated_data
     """
     if request.method =='GET':
-        serializer = SnippetModelSerializer(Snippet.objects.all(), many=True)
+        serializer = SnippetModelSerializer(prepare_queryset(Snippet.objects.all(), SnippetModelSerializer(), defer=True), many=True)
         return(JsonResponse(serializer.data, safe=False))
 
     elif request.method == 'POST':
@@ -79,7 +93,7 @@ def snippet_list2(request, format=None):
         2. Create a new Snippet for POST request for validated_data
     """
     if request.method =='GET':
-        serializer = SnippetModelSerializer(Snippet.objects.all(), many=True)
+        serializer = SnippetModelSerializer(prepare_queryset(Snippet.objects.all(), SnippetModelSerializer(), defer=True), many=True)
         return Response(serializer.data)
 
     elif request.method == 'POST':
@@ -126,7 +140,7 @@ class SnippetList(APIView):
     List of all Snippets or Create a new Snippet
     """
     def get(self, request, format=None):
-        serializer = SnippetModelSerializer(Snippet.objects.all(), many=True)
+        serializer = SnippetModelSerializer(prepare_queryset(Snippet.objects.all(), SnippetModelSerializer(), defer=True), many=True)
         return Response(serializer.data)
 
     def post(self, request, format=None):
@@ -171,7 +185,7 @@ class SnippetDetail(APIView):
 
 # =================================================================================================
 
-class SnippetList2(mixins.ListModelMixin, mixins.CreateModelMixin, generics.GenericAPIView):
+class SnippetList2(EagerQuerysetMixin, mixins.ListModelMixin, mixins.CreateModelMixin, generics.GenericAPIView):
     """
     1. List for GET request
     2. Create Snippets for POST requests
@@ -185,7 +199,7 @@ class SnippetList2(mixins.ListModelMixin, mixins.CreateModelMixin, generics.Gene
     def post(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
-class SnippetDetail2(mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, generics.GenericAPIView):
+class SnippetDetail2(EagerQuerysetMixin, mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, generics.GenericAPIView):
     """
     1. GET request: Returns details of a Snippet
     1. PUT request: Update a Snippet
@@ -205,40 +219,129 @@ class SnippetDetail2(mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.
 
 # ====================================================================================================
 
-class SnippetList3(generics.ListCreateAPIView):
+class SnippetList3(EagerQuerysetMixin, generics.ListCreateAPIView):
     queryset = Snippet.objects.all()
     serializer_class = SnippetModelSerializer
 
-class SnippetDetail3(generics.RetrieveUpdateDestroyAPIView):
+class SnippetDetail3(EagerQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Snippet.objects.all()
     serializer_class = SnippetModelSerializer
 
 # ====================================================================================================
 
-class SnippetList4(generics.ListCreateAPIView):
+class SnippetList4(EagerQuerysetMixin, generics.ListCreateAPIView):
     lookup_field = 'id'
     queryset = Snippet.objects.all()
     serializer_class = SnippetModelSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        writer.prerender(Snippet(), serializer.validated_data)
+        writer.run_write(serializer.save, owner=self.request.user)
 
-class SnippetDetail4(generics.RetrieveUpdateDestroyAPIView):
+class SnippetDetail4(EagerQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'id'
     queryset = Snippet.objects.all()
     serializer_class = SnippetModelSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
 
+    def perform_update(self, serializer):
+        writer.prerender(serializer.instance, serializer.validated_data)
+        writer.run_write(serializer.save)
+
+    def perform_destroy(self, instance):
+        writer.run_write(instance.delete)
+
 
-class UserList(generics.ListAPIView):
+class UserList(EagerQuerysetMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserModelSerializer
 
-class UserDetail(generics.RetrieveAPIView):
+class UserDetail(EagerQuerysetMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserModelSerializer
 
+# =====================================================================================================
+# Highlighted HTML pages and the stylesheets they link to
+
+def get_highlight_page(request, snippet):
+    """
+    Returns the `?page=` of a Snippet highlighted page by page, or 404 if it has no such page
+    """
+    if snippet.render_status != RENDER_LAZY:
+        return 1
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise Http404
+    if not 1 <= page <= snippet.get_page_count():
+        raise Http404
+    return page
+
+
+def get_highlight_lines(request, snippet):
+    """
+    Returns the `?lines=<first>-<last>` window of a Snippet as `(start, stop)`, `None` without one,
+    or 404 if the Snippet has none of those lines
+    """
+    value = request.GET.get('lines')
+    if value is None:
+        return None
+    lines = lineindex.parse_lines(value)
+    if lines is None or lines[0] >= snippet.get_line_count():
+        raise Http404
+    return lines
+
+
+def highlight_response(request, snippet):
+    """
+    Returns the highlighted page of a Snippet, or 304 if the client's copy is still current
+    """
+    # Wait for a pending render first, so that the validators describe the page served.
+    snippet.wait_for_highlight(settings.SNIPPETS_HIGHLIGHT_WAIT)
+    lines = get_highlight_lines(request, snippet)
+    page = get_highlight_page(request, snippet) if lines is None else 1
+    etag = conditional.make_etag(request, snippet.pk, snippet.updated.isoformat(), snippet.render_status,
+                                 pygments.__version__)
+    response = get_conditional_response(request, etag=etag, last_modified=conditional.timestamp(snippet.updated))
+    if response is None:
+        response = Response(snippet.get_highlighted(page=page, lines=lines))
+    return conditional.set_validators(response, etag, snippet.updated)
+
+
+@require_safe
+def snippet_style(request, style):
+    """
+    Returns the stylesheet shared by all Snippets highlighted with `style`
+    """
+    if style not in STYLE_CHOICES.values:
+        raise Http404
+    css = highlighting.style_css(style)
+    etag = '"%s"' % hashlib.md5(css.encode('utf-8')).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(css, content_type='text/css; charset=utf-8')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.SNIPPETS_STYLESHEET_MAX_AGE, immutable=True)
+    return response
+
+# =====================================================================================================
+# Streaming exports of every Snippet, without pagination
+
+@require_safe
+def snippet_export(request, format=None):
+    """
+    Streams every Snippet as a JSON array, or as NDJSON with `.ndjson` / `?format=ndjson`
+    """
+    format = format or request.GET.get('format', 'json')
+    if format not in export.FORMATS:
+        raise Http404
+    serializer = SnippetHyperlinkedModelSerializer(context={'request': request, 'format': None})
+    compiled = compile_serializer(serializer)
+    queryset = compiled.prepare(Snippet.objects.order_by('created', 'id'))
+    chunks = export.stream(compiled, queryset, format, settings.SNIPPETS_EXPORT_CHUNK_SIZE)
+    return StreamingHttpResponse(chunks, content_type=export.FORMATS[format])
+
 # =====================================================================================================
 # Creatting an endpoint for the root of our API
 # single entry point for our API
@@ -258,48 +361,44 @@ class SnippetHighlight(generics.ListAPIView):
 
     def get(self, request, *args, **kwargs):
         snippet = self.get_object()
-        return Response(snippet.highlighted)
+        return highlight_response(request, snippet)
 
 # ====================================================================================================
 
 
-class SnippetList5(generics.ListCreateAPIView):
+class SnippetList5(ConditionalMixin, CompiledListMixin, EagerQuerysetMixin, generics.ListCreateAPIView):
     queryset = Snippet.objects.all()
     serializer_class = SnippetHyperlinkedModelSerializer
 
 
-class SnippetDetail5(generics.RetrieveUpdateDestroyAPIView):
+class SnippetDetail5(ConditionalMixin, EagerQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Snippet.objects.all()
     serializer_class = SnippetHyperlinkedModelSerializer
 
 
-class UserList2(generics.ListAPIView):
+class UserList2(CompiledListMixin, EagerQuerysetMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserHyperlinkedModelSerializer
 
-class UserDetail2(generics.RetrieveAPIView):
+class UserDetail2(EagerQuerysetMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserHyperlinkedModelSerializer
 
 
 # =====================================================================================================
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(InstrumentedViewMixin, ResponseCacheMixin, CompiledListMixin, EagerQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     A Viewset for viewing Users and Retrieving Users.
     """
     queryset = User.objects.all()
     serializer_class = UserHyperlinkedModelSerializer
-
-    def list(self, serializer):
-        users = User.objects.all()
-        serializer = self.serializer_class(users, many=True, context={'request': self.request})
-        print(serializer.data)
-        return Response(serializer.data)
+    pagination_class = UserPagination
+    cache_tag = 'user'
 
 
 
-class SnippetViewSet(viewsets.ModelViewSet):
+class SnippetViewSet(InstrumentedViewMixin, ResponseCacheMixin, ConditionalMixin, CompiledListMixin, EagerQuerysetMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
@@ -308,14 +407,112 @@ class SnippetViewSet(viewsets.ModelViewSet):
     queryset = Snippet.objects.all()
     serializer_class = SnippetHyperlinkedModelSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-
+    pagination_class = SnippetPagination
+    filter_backends = [SnippetFilter, SnippetSearchFilter]
+    cache_tag = 'snippet'
+    body_size_setting = 'SNIPPETS_MAX_BODY_SIZE'
+    upload_actions = ['upload', 'upload_code']
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.upload_actions:
+            context['max_code_size'] = settings.SNIPPETS_MAX_UPLOAD_SIZE
+        return context
 
     @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
+        return self.serve_cached(request, self.render_highlight, *args, **kwargs)
+
+    def render_highlight(self, request, *args, **kwargs):
         snippet = self.get_object()
-        return Response(snippet.highlighted)
+        response = highlight_response(request, snippet)
+        if snippet.render_status not in (RENDER_DONE, RENDER_LAZY):
+            # Previews are not cached: a per-process cache never sees the worker's write.
+            self.response_cache_key = None
+        return response
 
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        writer.prerender(Snippet(), serializer.validated_data)
+        writer.run_write(serializer.save, owner=self.request.user)
+
+    def perform_update(self, serializer):
+        writer.prerender(serializer.instance, serializer.validated_data)
+        writer.run_write(serializer.save)
+
+    def perform_destroy(self, instance):
+        writer.run_write(instance.delete)
+
+    @action(detail=False)
+    def facets(self, request, *args, **kwargs):
+        """
+        Counts of the listed Snippets per language and per style. Each count applies
+        every filter but its own, so that it shows what choosing another value would list.
+        """
+        facets = {}
+        for field in SnippetFilter.choice_params:
+            queryset = Snippet.objects.filter(**SnippetFilter().get_filters(request, exclude=[field]))
+            queryset = SnippetSearchFilter().filter_queryset(request, queryset, self)
+            rows = queryset.order_by().values_list(field).annotate(count=Count('pk')).order_by('-count', field)
+            facets[field] = OrderedDict(rows)
+        return Response(facets)
+
+    @action(detail=False, methods=['post', 'put', 'patch', 'delete'], body_size_setting='SNIPPETS_BULK_MAX_BODY_SIZE')
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create (POST), update (PUT, PATCH) or delete (DELETE) a list of Snippets in one transaction.
+        Updates and deletes refer to Snippets by `id`. If any item is rejected nothing is written,
+        and the response lists the errors of every item, `{}` for the valid ones.
+        """
+        items = bulk.get_items(request.data)
+        if request.method == 'POST':
+            instances, errors = [None] * len(items), [{}] * len(items)
+        else:
+            instances, errors = bulk.get_instances(self, items)
+        if request.method == 'DELETE':
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            bulk.delete(instances)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        serializer = self.get_serializer(data=items, many=True, partial=request.method == 'PATCH')
+        errors = bulk.merge_errors(errors, serializer)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        if request.method == 'POST':
+            snippets = [Snippet(owner=request.user, **data) for data in serializer.validated_data]
+            bulk.render_highlights(snippets)
+            bulk.create(snippets)
+            return Response(self.get_serializer(snippets, many=True).data, status=status.HTTP_201_CREATED)
+
+        fields = set()
+        for instance, data in zip(instances, serializer.validated_data):
+            for name, value in data.items():
+                setattr(instance, name, value)
+            fields.update(data)
+        bulk.render_highlights(instances)
+        bulk.update(instances, fields)
+        return Response(self.get_serializer(instances, many=True).data)
+
+    @action(detail=False, methods=['post'], parser_classes=[uploads.CodeUploadParser, uploads.CodeMultiPartParser])
+    def upload(self, request, *args, **kwargs):
+        """
+        Create a Snippet of code uploaded as the raw `text/plain` body, with the other fields as query
+        parameters, or as the `code` file of a multipart form. It may have up to `SNIPPETS_MAX_UPLOAD_SIZE` bytes.
+        """
+        serializer = self.get_serializer(data=uploads.get_upload_data(request))
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['put'], url_path='code',
+            parser_classes=[uploads.CodeUploadParser, uploads.CodeMultiPartParser])
+    def upload_code(self, request, *args, **kwargs):
+        """
+        Replace the code of a Snippet by an upload, as `upload` takes it; the fields not sent are kept.
+        """
+        serializer = self.get_serializer(self.get_object(), data=uploads.get_upload_data(request), partial=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
 
@@ -0,0 +1,103 @@
+"""
+Background highlighting of pending snippets.
+
+Snippets saved with `SNIPPETS_HIGHLIGHT_MODE = 'async'` are stored with
+`render_status = 'pending'`; the snippets table itself is the queue. A worker
+claims pending rows, renders them in a process pool and writes the HTML back.
+"""
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import highlighting, lineindex, responsecache
+from .models import Snippet, RENDER_PENDING, RENDER_RENDERING, RENDER_DONE, RENDER_FAILED
+
+logger = logging.getLogger(__name__)
+
+RENDER_FIELDS = ['id', 'code', 'language', 'style', 'linenos']
+
+
+def claim_pending(batch_size):
+    """
+    Claim up to `batch_size` pending snippets, oldest first.
+
+    A row is claimed by moving it from pending to rendering; a row another
+    worker claimed first is skipped.
+    """
+    claimed = []
+    candidates = (Snippet.objects.filter(render_status=RENDER_PENDING)
+                  .order_by('created', 'id').values(*RENDER_FIELDS)[:batch_size])
+    for row in candidates:
+        if Snippet.objects.filter(pk=row['id'], render_status=RENDER_PENDING).update(
+                render_status=RENDER_RENDERING, updated=timezone.now()):
+            claimed.append(row)
+    if claimed:
+        responsecache.invalidate('snippets', *responsecache.snippet_tags(*[row['id'] for row in claimed]))
+    return claimed
+
+
+def store(pk, html, status=RENDER_DONE, line_index=b''):
+    """
+    Write a finished render back, unless the snippet was edited in the meantime.
+    An edit moves the row back to pending, so it gets rendered again.
+    """
+    stored = Snippet.objects.filter(pk=pk, render_status=RENDER_RENDERING).update(
+        highlighted=html, highlight_state='', line_index=line_index, render_status=status, updated=timezone.now())
+    if stored:
+        responsecache.invalidate('snippets', *responsecache.snippet_tags(pk))
+    return stored
+
+
+def render_batch(executor, rows):
+    """
+    Render claimed rows, serving cache hits locally and sending misses to `executor`.
+    """
+    futures = {}
+    for row in rows:
+        inputs = (row['code'], row['language'], row['style'], row['linenos'])
+        html = highlighting.get_cached(*inputs)
+        if html is not None:
+            store(row['id'], html, line_index=lineindex.build(html, *inputs))
+        else:
+            futures[row['id']] = (inputs, executor.submit(highlighting.render, *inputs))
+    for pk, (inputs, future) in futures.items():
+        try:
+            html = future.result()
+        except Exception:
+            logger.exception('Highlighting snippet %s failed', pk)
+            store(pk, '', status=RENDER_FAILED)
+        else:
+            highlighting.get_render_cache().set(highlighting.render_key(*inputs), html)
+            store(pk, html, line_index=lineindex.build(html, *inputs))
+    return len(rows)
+
+
+def requeue_stale():
+    """
+    Move rows left in rendering (e.g. by a killed worker) back to pending.
+    """
+    pks = list(Snippet.objects.filter(render_status=RENDER_RENDERING).values_list('pk', flat=True))
+    requeued = Snippet.objects.filter(pk__in=pks, render_status=RENDER_RENDERING).update(
+        render_status=RENDER_PENDING, updated=timezone.now())
+    responsecache.invalidate('snippets', *responsecache.snippet_tags(*pks))
+    return requeued
+
+
+def run(processes=None, batch_size=50, poll_interval=1.0, once=False):
+    """
+    Render pending snippets until interrupted, or until the queue is empty if `once` is set.
+    """
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            close_old_connections()
+            rows = claim_pending(batch_size)
+            if rows:
+                rendered += render_batch(executor, rows)
+            elif once:
+                return rendered
+            else:
+                time.sleep(poll_interval)
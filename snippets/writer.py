@@ -0,0 +1,151 @@
+"""
+A single-writer queue that groups concurrent snippet writes into shared transactions.
+
+SQLite has one writer at a time, and every transaction pays for its own commit.
+With `SNIPPETS_WRITE_QUEUE` set, views hand their writes to one writer thread.
+That thread takes every write queued while the previous group was committing,
+runs each in a savepoint of one transaction, and commits them together. A
+failing write only rolls back its own savepoint. Callers block until the group
+is committed, so they still read their own writes.
+"""
+import copy
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+from . import highlighting, incremental
+
+
+class WriteQueue:
+
+    def __init__(self, max_batch=100):
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name='snippets-writer', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if self.thread is not None:
+                self.jobs.put(None)
+                self.thread.join()
+                self.thread = None
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue `function(*args, **kwargs)` and return a `Future` of its result, set once committed.
+        """
+        self.start()
+        future = Future()
+        self.jobs.put((future, function, args, kwargs))
+        return future
+
+    def run(self, function, *args, **kwargs):
+        return self.submit(function, *args, **kwargs).result()
+
+    def next_batch(self):
+        batch = [self.jobs.get()]
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        try:
+            while True:
+                batch = self.next_batch()
+                jobs = [job for job in batch if job is not None]
+                if jobs:
+                    self.run_batch(jobs)
+                if len(jobs) < len(batch):
+                    return
+        finally:
+            connection.close()
+
+    def run_batch(self, jobs):
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for future, function, args, kwargs in jobs:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, function(*args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((future, None, exc))
+        except Exception as exc:
+            # The commit itself failed: nothing in the group was written.
+            for future, result, error in outcomes:
+                future.set_exception(exc)
+            return
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """
+    Return the process's write queue, or `None` unless `SNIPPETS_WRITE_QUEUE` is set.
+    """
+    global _write_queue
+    if not getattr(settings, 'SNIPPETS_WRITE_QUEUE', False):
+        return None
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(getattr(settings, 'SNIPPETS_WRITE_QUEUE_BATCH', 100))
+        return _write_queue
+
+
+@receiver(setting_changed)
+def reset_write_queue(setting, **kwargs):
+    global _write_queue
+    if setting in ('SNIPPETS_WRITE_QUEUE', 'SNIPPETS_WRITE_QUEUE_BATCH') and _write_queue is not None:
+        _write_queue.stop()
+        _write_queue = None
+
+
+def run_write(function, *args, **kwargs):
+    """
+    Run a write through the write queue if there is one, else right away.
+    """
+    write_queue = get_write_queue()
+    if write_queue is None:
+        return function(*args, **kwargs)
+    return write_queue.run(function, *args, **kwargs)
+
+
+def prerender(instance, data):
+    """
+    Render the highlight `instance` will have once `data` is saved into it, here rather
+    than in the writer thread, where `Snippet.save()` then finds it in the render cache.
+    """
+    if get_write_queue() is None or highlighting.is_async():
+        return
+    snippet = copy.copy(instance)
+    for name, value in data.items():
+        setattr(snippet, name, value)
+    # An edit of a large snippet is re-highlighted from the previous render instead, in `save()`,
+    # and an oversized one is highlighted when viewed.
+    if incremental.is_large(snippet.code) or highlighting.is_oversized(snippet.code):
+        return
+    highlighting.render_cached(*snippet.get_render_inputs())
@@ -42,7 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'snippets.instrumentation.InstrumentationMiddleware',
+    'snippets.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'snippets.dbrouters.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -70,18 +73,49 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tutorial.wsgi.application'
+ASGI_APPLICATION = 'tutorial.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# SQLite tuning profile (see snippets.sqlite): 'default', or 'production' for
+# WAL, relaxed fsyncs, persistent connections and the single-writer queue.
+SNIPPETS_SQLITE_PROFILE = os.environ.get('SNIPPETS_SQLITE_PROFILE', 'default')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600 if SNIPPETS_SQLITE_PROFILE == 'production' else 0,
     }
 }
 
+# Read replicas of the database, as comma-separated SQLite paths, kept in sync
+# with it by external replication (see snippets.dbrouters). Test databases
+# mirror the primary.
+for index, path in enumerate(filter(None, os.environ.get('SNIPPETS_READ_REPLICAS', '').split(','))):
+    DATABASES['replica_%d' % index] = dict(DATABASES['default'], NAME=path, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['snippets.dbrouters.PrimaryReplicaRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered API responses (see snippets.responsecache). Use
+    # 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION to
+    # share it between processes, e.g. with the highlight worker.
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -123,5 +157,116 @@ STATIC_URL = '/static/'
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
-}
\ No newline at end of file
+    'PAGE_SIZE': 10,
+    'DEFAULT_PARSER_CLASSES': [
+        'snippets.uploads.LimitedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Snippets
+
+# Cache of rendered highlight HTML, keyed by a hash of the render inputs.
+# Use 'snippets.highlighting.DjangoRenderCache' to share it between workers.
+SNIPPETS_RENDER_CACHE = {
+    'BACKEND': 'snippets.highlighting.LRURenderCache',
+    'OPTIONS': {
+        'max_entries': 1024,
+        'max_bytes': 32 * 1024 * 1024,
+    },
+}
+
+# 'sync' renders highlights inside Snippet.save(); 'async' marks them pending
+# for `manage.py highlight_worker`.
+SNIPPETS_HIGHLIGHT_MODE = 'sync'
+
+# Seconds the highlight views wait for a pending render before serving a plain preview.
+SNIPPETS_HIGHLIGHT_WAIT = 0.5
+
+# Lifetime of the per-style stylesheets linked from highlighted pages.
+SNIPPETS_STYLESHEET_MAX_AGE = 60 * 60 * 24 * 365
+
+# Render hyperlinked snippet and user lists from `.values()` rows with
+# precompiled serializers (see snippets.compiled).
+SNIPPETS_COMPILED_SERIALIZERS = True
+
+# Rows fetched per database round trip by the streaming export at /snippets/export/.
+SNIPPETS_EXPORT_CHUNK_SIZE = 2000
+
+# Bulk writes at /snippets/bulk/: the most items per request, the rows per
+# INSERT/UPDATE statement, and the number of distinct cache misses from which
+# a batch is highlighted in the render process pool.
+SNIPPETS_BULK_MAX_ITEMS = 10000
+SNIPPETS_BULK_BATCH_SIZE = 500
+SNIPPETS_BULK_PARALLEL_MIN = 32
+
+# Size of the process pool rendering highlights for bulk writes and async
+# views (None for one process per CPU).
+SNIPPETS_RENDER_PROCESSES = None
+
+# Seconds a process may serve a cached snippet table version (latest `updated`
+# and row count) for list ETags after another process wrote to the table.
+SNIPPETS_LIST_VERSION_TIMEOUT = 5
+
+# Cache alias of rendered responses of the snippet and user viewsets, or None
+# to disable it; responses larger than the maximum size in bytes are not cached.
+SNIPPETS_RESPONSE_CACHE = 'responses'
+SNIPPETS_RESPONSE_CACHE_MAX_SIZE = 512 * 1024
+
+# Search backend of `?search=` on /snippets/ (see snippets.search).
+SNIPPETS_SEARCH_BACKEND = 'snippets.search.SQLiteFTS5Backend'
+
+# Hand snippet writes of the viewset to one writer thread, which commits the
+# writes queued meanwhile (up to the batch size) in one transaction.
+SNIPPETS_WRITE_QUEUE = SNIPPETS_SQLITE_PROFILE == 'production'
+SNIPPETS_WRITE_QUEUE_BATCH = 100
+
+# Aliases of DATABASES that safe requests read from, and the seconds a replica
+# may lag behind: clients stay on the primary that long after a write.
+SNIPPETS_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+SNIPPETS_REPLICA_MAX_LAG = 5
+
+# Record per-phase timings of every request (see snippets.instrumentation),
+# and the client addresses allowed to read the aggregates at /metrics besides
+# staff users.
+SNIPPETS_INSTRUMENTATION = True
+SNIPPETS_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Opt-in profiling of live workers (see snippets.profiling): where sessions
+# leave their results, the seconds between stack samples, and the longest a
+# session runs.
+SNIPPETS_PROFILING = False
+SNIPPETS_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+SNIPPETS_PROFILE_INTERVAL = 0.005
+SNIPPETS_PROFILE_MAX_SECONDS = 300
+
+# Snippets of at least this many lines are highlighted incrementally (see
+# snippets.incremental): an edit re-highlights the lines around it only.
+# None to always highlight in full.
+SNIPPETS_INCREMENTAL_HIGHLIGHT_LINES = 1000
+
+# Size limits in bytes (see snippets.uploads): of JSON request bodies, of bulk
+# ones, of the code in them, and of code uploaded to /snippets/upload/ or
+# /snippets/<pk>/code/ as a raw body or a multipart file.
+SNIPPETS_MAX_BODY_SIZE = 2 * 1024 * 1024
+SNIPPETS_BULK_MAX_BODY_SIZE = 64 * 1024 * 1024
+SNIPPETS_MAX_CODE_SIZE = 1024 * 1024
+SNIPPETS_MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+
+# Snippets of at least this many bytes of code are not highlighted on save but
+# when viewed, a page of this many lines at a time (`?page=`). None to always
+# highlight on save.
+SNIPPETS_LAZY_HIGHLIGHT_SIZE = 1024 * 1024
+SNIPPETS_HIGHLIGHT_PAGE_LINES = 1000
+
+# zlib level of compressed columns (see snippets.compression): 1 is fastest,
+# 9 smallest.
+SNIPPETS_COMPRESSION_LEVEL = 6
+
+# Encodings cached responses are also stored in, compressed once and served as
+# the request's Accept-Encoding prefers (see snippets.encoding), and the
+# smallest response compressed. 'br' needs the brotli package.
+SNIPPETS_RESPONSE_ENCODINGS = ['br', 'gzip']
+SNIPPETS_RESPONSE_ENCODING_MIN_SIZE = 1024
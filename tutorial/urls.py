@@ -17,7 +17,10 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 from quickstart import views
-from snippets.views import SnippetViewSet, UserViewSet 
+from snippets import async_views
+from snippets import profiling
+from snippets.instrumentation import metrics_view
+from snippets.views import SnippetViewSet, UserViewSet, snippet_export, snippet_style
 
 router = routers.DefaultRouter()
 # router.register('users', views.UserViewSet)
@@ -28,7 +31,18 @@ router.register('users', UserViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('styles/<str:style>.css', snippet_style, name='snippet-style'),
+    path('metrics', metrics_view, name='metrics'),
+    path('profile/', profiling.profile_list, name='profile-list'),
+    path('profile/<str:name>', profiling.profile_file, name='profile-file'),
+    # Ahead of the router, whose snippet detail routes would match these paths.
+    path('snippets/export/', snippet_export, name='snippet-export'),
+    path('snippets/export.<str:format>', snippet_export, name='snippet-export'),
     path('', include(router.urls)),
+    # Async variants of the snippet endpoints, for deployments under tutorial.asgi.
+    path('async/snippets/', async_views.snippet_list, name='async-snippet-list'),
+    path('async/snippets/<int:pk>/', async_views.snippet_detail, name='async-snippet-detail'),
+    path('async/snippets/<int:pk>/highlight/', async_views.snippet_highlight, name='async-snippet-highlight'),
     path('snippets/', include('snippets.urls')),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]